@@ -0,0 +1,168 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from ignoramus.library import get_library
+
+# Kept in the library's output root
+ANALYTICS_FILE_NAME = ".analytics.sqlite"
+
+# Inputs that change how long a prediction takes; runs are grouped by model and these. The images themselves and
+# the prompt are left out, only whether an input image was given matters.
+LATENCY_PARAMETERS = ("num_inference_steps", "steps", "num_outputs", "aspect_ratio", "megapixels", "width", "height",
+                      "output_format", "go_fast", "upscale", "codeformer_fidelity")
+PERCENTILES = (50, 95)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    prediction_id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT,
+    queue_time REAL,
+    predict_time REAL,
+    total_time REAL,
+    outputs INTEGER,
+    download_bytes INTEGER,
+    download_time REAL,
+    postprocess_time REAL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_group ON runs (model, params);
+CREATE INDEX IF NOT EXISTS runs_recorded_at ON runs (recorded_at);
+"""
+
+
+def latency_params(input):
+    params = {key: input[key] for key in LATENCY_PARAMETERS if key in (input or {})}
+    if "prompt" in (input or {}) and input.get("image"):
+        params["img2img"] = True
+    return json.dumps(params, sort_keys=True)
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def prediction_timings(prediction):
+    # Replicate's own timestamps, so time spent polling or offline doesn't count. predict_time is what is billed.
+    created_at = _parse_time(prediction.created_at)
+    started_at = _parse_time(getattr(prediction, "started_at", None))
+    completed_at = _parse_time(getattr(prediction, "completed_at", None))
+    predict_time = (getattr(prediction, "metrics", None) or {}).get("predict_time")
+    if predict_time is None and started_at and completed_at:
+        predict_time = completed_at - started_at
+    return {
+        "queue_time": started_at - created_at if created_at and started_at else None,
+        "predict_time": predict_time,
+        "total_time": completed_at - created_at if created_at and completed_at else None,
+    }
+
+
+class AnalyticsStore:
+    # Local history of every prediction's latency and of what happened to its outputs afterwards
+    def __init__(self, path=None):
+        path = path or os.path.join(get_library().output_directory(), ANALYTICS_FILE_NAME)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def _execute(self, query, args=()):
+        with self.lock:
+            return self.connection.execute(query, args).fetchall()
+
+    def record_prediction(self, prediction_id, model, input, status, timings):
+        self._execute(
+            "INSERT INTO runs (prediction_id, model, params, status, queue_time, predict_time, total_time, "
+            "recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (prediction_id) DO UPDATE SET "
+            "status = excluded.status, queue_time = excluded.queue_time, predict_time = excluded.predict_time, "
+            "total_time = excluded.total_time",
+            (prediction_id, model, latency_params(input), status, timings["queue_time"], timings["predict_time"],
+             timings["total_time"], time.time()))
+
+    def record_processing(self, prediction_id, model, input, outputs, download_bytes, download_time,
+                          postprocess_time):
+        # Resumed jobs may only get here, without the prediction having been recorded in this run. The input here
+        # includes local settings like upscale, which the model never saw, so it replaces the recorded params.
+        self._execute(
+            "INSERT INTO runs (prediction_id, model, params, status, outputs, download_bytes, download_time, "
+            "postprocess_time, recorded_at) VALUES (?, ?, ?, 'succeeded', ?, ?, ?, ?, ?) "
+            "ON CONFLICT (prediction_id) DO UPDATE SET params = excluded.params, outputs = excluded.outputs, "
+            "download_bytes = excluded.download_bytes, download_time = excluded.download_time, "
+            "postprocess_time = excluded.postprocess_time",
+            (prediction_id, model, latency_params(input), outputs, download_bytes, download_time, postprocess_time,
+             time.time()))
+
+    def runs(self, since=None, model=None):
+        query = ("SELECT model, params, status, queue_time, predict_time, total_time, outputs, download_bytes, "
+                 "download_time, postprocess_time FROM runs WHERE recorded_at >= ?")
+        args = [since or 0]
+        if model:
+            query += " AND model = ?"
+            args.append(model)
+        columns = ("model", "params", "status", "queue_time", "predict_time", "total_time", "outputs",
+                   "download_bytes", "download_time", "postprocess_time")
+        return [dict(zip(columns, row)) for row in self._execute(query, args)]
+
+    def summary(self, since=None, model=None):
+        # p50/p95 per model and parameter set, slowest groups first
+        groups = {}
+        for run in self.runs(since, model):
+            groups.setdefault((run["model"], run["params"]), []).append(run)
+        rows = []
+        for (model, params), runs in groups.items():
+            row = {
+                "model": model,
+                "params": json.loads(params),
+                "runs": len(runs),
+                "failed": sum(1 for run in runs if run["status"] != "succeeded"),
+                "predict_seconds": sum(run["predict_time"] or 0 for run in runs),
+                "download_bytes": sum(run["download_bytes"] or 0 for run in runs),
+            }
+            for column in ("queue_time", "predict_time", "total_time", "postprocess_time"):
+                values = [run[column] for run in runs if run[column] is not None]
+                for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES) if values else [None] * 2):
+                    row[f"{column}_p{p}"] = None if value is None else float(value)
+            rows.append(row)
+        return sorted(rows, key=lambda row: -(row["total_time_p95"] or 0))
+
+
+def format_summary(rows):
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    lines = []
+    for row in rows:
+        params = ", ".join(f"{key}={value}" for key, value in row["params"].items()) or "default"
+        lines.append(f"{row['model']} ({params}): {row['runs']} runs, {row['failed']} not succeeded, "
+                     f"{row['predict_seconds']:.1f}s billed, {row['download_bytes'] / 1e6:.1f} MB downloaded")
+        for column, label in (("queue_time", "queue"), ("predict_time", "predict"), ("total_time", "total"),
+                              ("postprocess_time", "post-processing")):
+            p50, p95 = seconds(row[f"{column}_p50"]), seconds(row[f"{column}_p95"])
+            lines.append(f"  {label:16s} p50 {p50:>8s}  p95 {p95:>8s}")
+    return lines or ["No runs recorded yet"]
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+
+def get_analytics():
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            _analytics = AnalyticsStore()
+        return _analytics
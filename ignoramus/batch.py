@@ -0,0 +1,89 @@
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import piexif
+import piexif.helper
+from PIL import Image
+
+from ignoramus.face_swapper import perform_face_swap_and_save
+from ignoramus.image_generator import add_exif_thumbnail, get_output_directory, unique_timestamp
+from ignoramus.storage import save_with_metadata, insert_metadata
+from ignoramus.upscaler import upscale_image
+from ignoramus.utils import read_image_metadata
+
+# Remote actions are bounded further by the Replicate scheduler; this mostly bounds local CPU and memory
+BATCH_CONCURRENCY = 4
+
+
+def _metadata_exif(metadata):
+    exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+    exif_dict["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(json.dumps(metadata))
+    return exif_dict
+
+
+def upscale_and_save(img_path, engine="remote"):
+    # Saves the upscaled copy next to the results with the original's metadata; returns its path, or None
+    if not (upscaled_data := upscale_image(img_path, engine)):
+        return None
+    metadata = read_image_metadata(img_path)
+    metadata["upscaled"] = True
+    upscaled_path = os.path.join(get_output_directory(), f"img_{unique_timestamp()}.jpg")
+    with Image.open(io.BytesIO(upscaled_data)) as img:
+        exif_bytes = piexif.dump(add_exif_thumbnail(_metadata_exif(metadata), img))
+        save_with_metadata(img, upscaled_path, exif_bytes)
+    return upscaled_path
+
+
+def face_swap_and_save(img_path, face_image_path):
+    return perform_face_swap_and_save(face_image_path, img_path, os.path.dirname(img_path) or ".")
+
+
+def delete_file(img_path):
+    os.remove(img_path)
+    return img_path
+
+
+def parse_tags(text):
+    # "portrait, blue, -draft" adds portrait and blue and removes draft
+    tags = [tag.strip() for tag in text.split(",") if tag.strip()]
+    return {tag for tag in tags if not tag.startswith("-")}, {tag[1:].strip() for tag in tags if tag.startswith("-")}
+
+
+def retag(img_path, add, remove):
+    # Rewrites only the metadata block; pixels and the embedded thumbnail stay as they are
+    with Image.open(img_path) as img:
+        exif_data = img.info.get("exif")
+    exif_dict = piexif.load(exif_data) if exif_data else _metadata_exif({})
+    metadata = read_image_metadata(img_path)
+    metadata["tags"] = sorted((set(metadata.get("tags", [])) | add) - remove)
+    exif_dict["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(json.dumps(metadata))
+    insert_metadata(img_path, piexif.dump(exif_dict))
+    return metadata["tags"]
+
+
+def run_batch(action, paths, on_item_done=None, cancelled=None, max_workers=BATCH_CONCURRENCY):
+    # Runs action(path) for every path on a bounded pool and reports each item as soon as it finishes.
+    # Items not started yet are skipped once `cancelled` is set.
+    cancelled = cancelled or threading.Event()
+    results = []
+
+    def run_item(path):
+        if cancelled.is_set():
+            return None, "cancelled"
+        try:
+            return action(path), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as pool:
+        futures = {pool.submit(run_item, path): path for path in paths}
+        for future in as_completed(futures):
+            result, error = future.result()
+            item = {"path": futures[future], "result": result, "error": error}
+            results.append(item)
+            if on_item_done:
+                on_item_done(item, len(results), len(paths))
+    return results
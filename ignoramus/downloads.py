@@ -0,0 +1,111 @@
+import hashlib
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+import requests
+
+from ignoramus.scheduler import is_retryable, get_retry_after
+from ignoramus.transport import transport
+
+CHUNK_SIZE = 256 * 1024
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 15.0
+PARTIAL_SUFFIX = ".part"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class IncompleteDownload(DownloadError):
+    pass
+
+
+def _is_retryable_download(error):
+    # A connection dropped mid-body shows up as ChunkedEncodingError (or our own truncation check)
+    return isinstance(error, (requests.exceptions.ChunkedEncodingError, IncompleteDownload)) or is_retryable(error)
+
+
+@contextmanager
+def _open_response(url, offset, etag):
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if etag:
+            # Only resume if the file is still the same, otherwise the server sends it whole
+            headers["If-Range"] = etag
+    with transport.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        if response.status_code not in (200, 206) or (response.status_code == 206 and not offset):
+            raise DownloadError(f"Unexpected status {response.status_code} downloading {url}")
+        yield response
+
+
+def download_to_file(url, file_name, expected_sha256=None):
+    # Streams into "<file_name>.<random>.part", hashing as it goes, resumes with Range requests after a dropped
+    # connection and only renames the file into place once it is complete, so readers never see a truncated image.
+    # Accepts the replicate client's FileOutput objects as well as URL strings.
+    url = getattr(url, "url", url)
+    # Unique per download, so two writers of the same name can't interleave their bytes
+    handle, partial_name = tempfile.mkstemp(prefix=os.path.basename(file_name) + ".", suffix=PARTIAL_SUFFIX,
+                                            dir=os.path.dirname(file_name) or ".")
+    sha256 = hashlib.sha256()
+    offset = 0
+    etag = None
+    with os.fdopen(handle, "wb") as file:
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    with _open_response(url, offset, etag) as response:
+                        if response.status_code == 200 and offset:
+                            # The server ignored the range (or the file changed): start over
+                            file.seek(0)
+                            file.truncate()
+                            sha256 = hashlib.sha256()
+                            offset = 0
+                        etag = response.headers.get("ETag")
+                        length = response.headers.get("Content-Length")
+                        expected_size = offset + int(length) if length and length.isdigit() else None
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            file.write(chunk)
+                            sha256.update(chunk)
+                            offset += len(chunk)
+                    if expected_size is not None and offset != expected_size:
+                        raise IncompleteDownload(f"Got {offset} of {expected_size} bytes from {url}")
+                    break
+                except Exception as e:
+                    if not _is_retryable_download(e) or attempt == MAX_ATTEMPTS - 1:
+                        raise
+                    backoff = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+                    delay = get_retry_after(e) or random.uniform(0, backoff)
+                    print(f"Download interrupted at {offset} bytes ({type(e).__name__}), resuming in {delay:.1f}s")
+                    time.sleep(delay)
+
+            digest = sha256.hexdigest()
+            if expected_sha256 and digest != expected_sha256:
+                raise DownloadError(f"Checksum mismatch for {url}: {digest}")
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.close()
+            os.remove(partial_name)
+            raise
+    os.replace(partial_name, file_name)
+    return digest
+
+
+@contextmanager
+def downloaded(url, suffix=""):
+    # Temporary local copy of a URL, for results that are re-encoded rather than kept as downloaded
+    handle, path = tempfile.mkstemp(suffix=suffix)
+    os.close(handle)
+    try:
+        download_to_file(url, path)
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
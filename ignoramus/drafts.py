@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ignoramus.image_generator import generate_image, process_generated_images
+from ignoramus.parameters import default_properties
+from ignoramus.predictions import PredictionCancelled
+
+DRAFT_MODEL = "schnell"
+# Carried over so the draft shows the refine's composition; everything else uses schnell's fastest settings
+DRAFT_PARAMETERS = ("prompt", "seed", "aspect_ratio")
+
+
+def supports_draft(model, properties):
+    # schnell has no image input, so an img2img draft would not show what the refine is going to look like
+    return model != DRAFT_MODEL and not properties.get("image_path")
+
+
+def draft_properties(properties):
+    draft = default_properties(DRAFT_MODEL)
+    draft.update({key: properties[key] for key in DRAFT_PARAMETERS if key in properties})
+    draft.update({"num_outputs": 1, "output_format": "webp", "upscale": False})
+    return draft
+
+
+def generate_with_draft(model, properties, job_callback=None, refine_callback=None, on_draft=None, on_image=None,
+                        pipeline=None):
+    # Renders a schnell draft and the full model in parallel. on_draft(images) gets the draft as soon as it is
+    # saved; the draft files are deleted once the refined images are in. on_image and pipeline are passed on to the
+    # refine's process_generated_images. Returns the refined images.
+    draft_jobs = []
+    refined = threading.Event()
+
+    def register_draft(job):
+        draft_jobs.append(job)
+        if job_callback:
+            job_callback(job)
+
+    def run_draft():
+        draft = draft_properties(properties)
+        output, current_time, results_dir = generate_image(DRAFT_MODEL, draft, register_draft,
+                                                           extra_metadata={"draft_for": model})
+        images = process_generated_images(output, current_time, results_dir, draft, DRAFT_MODEL,
+                                          {"draft_for": model})
+        if on_draft and not refined.is_set():
+            on_draft(images)
+        return images
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="draft") as pool:
+        draft_future = pool.submit(run_draft)
+        try:
+            output, current_time, results_dir = generate_image(model, properties, refine_callback or job_callback)
+            images = process_generated_images(output, current_time, results_dir, properties, model,
+                                              on_image=on_image, pipeline=pipeline)
+            refined.set()
+        finally:
+            if refined.is_set():
+                # A draft still running is of no use anymore
+                for job in list(draft_jobs):
+                    job.cancel()
+        try:
+            draft_images = draft_future.result()
+        except PredictionCancelled:
+            draft_images = []
+        except Exception as e:
+            print(f"Error generating draft: {str(e)}")
+            draft_images = []
+
+    for image in draft_images:
+        try:
+            os.remove(image["file_name"])
+        except OSError as e:
+            print(f"Error removing draft {image['file_name']}: {str(e)}")
+    return images
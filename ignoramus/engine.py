@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ignoramus.image_generator import generate_image, process_generated_images, resume_job
+from ignoramus.journal import get_journal
+from ignoramus.parameters import MODELS, default_properties
+from ignoramus.predictions import PredictionCancelled
+
+DEFAULT_WORKERS = 4
+# Finished jobs kept around for status queries
+MAX_FINISHED_JOBS = 1000
+
+
+class EngineJob:
+    def __init__(self, model, properties):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.properties = properties
+        self.status = "queued"
+        self.prediction = None
+        self.images = []
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancelled = threading.Event()
+
+    def set_prediction(self, prediction):
+        self.prediction = prediction
+        if self.cancelled.is_set():
+            prediction.cancel()
+
+    @staticmethod
+    def named(image):
+        return dict(image, name=os.path.basename(image["file_name"]))
+
+    def add_image(self, image):
+        # Called from the output threads
+        self.images.append(self.named(image))
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.prediction:
+            self.prediction.cancel()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "model": self.model,
+            "status": self.status,
+            "prediction_id": self.prediction.id if self.prediction else None,
+            "prediction_status": self.prediction.status if self.prediction else None,
+            "progress": self.prediction.progress if self.prediction else None,
+            "logs": self.prediction.logs[-2000:] if self.prediction else "",
+            "images": list(self.images),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class GenerationEngine:
+    # One worker pool for every client; the Replicate scheduler still bounds how many predictions are live
+    def __init__(self, max_workers=DEFAULT_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="engine")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, model, properties=None):
+        if not isinstance(model, str) or model not in MODELS:
+            raise ValueError(f"Unknown model: {model}")
+        job_properties = default_properties(model)
+        job_properties.update(properties or {})
+        job = EngineJob(model, job_properties)
+        self._add(job)
+        self.pool.submit(self._run, job)
+        return job
+
+    def resume(self):
+        # Journaled predictions from a previous run show up as ordinary jobs. Jobs another process still holds a
+        # lease on are left to it; if that process is gone, they are claimed once its lease has run out.
+        jobs = self._resume_claimed()
+        if expiry := get_journal().next_lease_expiry():
+            timer = threading.Timer(max(0.0, expiry - time.time()) + 1, self._resume_claimed)
+            timer.daemon = True
+            timer.start()
+        return jobs
+
+    def _resume_claimed(self):
+        jobs = []
+        for entry in get_journal().claim_unfinished():
+            job = EngineJob(entry["model"], entry["properties"])
+            self._add(job)
+            self.pool.submit(self._run, job, entry)
+            jobs.append(job)
+        return jobs
+
+    def _add(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        if job := self.get(job_id):
+            job.cancel()
+        return job
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _run(self, job, entry=None):
+        if job.cancelled.is_set():
+            job.status = "canceled"
+            job.finished_at = time.time()
+            return
+        try:
+            job.status = "running"
+            if entry:
+                images = resume_job(entry, job.set_prediction)
+            else:
+                output, current_time, results_dir = generate_image(job.model, dict(job.properties), job.set_prediction)
+                job.status = "processing"
+                # Outputs show up in the job as they finish; the final list below is in output order
+                images = process_generated_images(output, current_time, results_dir, job.properties, job.model,
+                                                  on_image=job.add_image)
+            job.images = [job.named(image) for image in images]
+            job.status = "succeeded"
+        except PredictionCancelled:
+            job.status = "canceled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
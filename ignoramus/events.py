@@ -0,0 +1,43 @@
+import queue
+
+# About one frame at 60 Hz
+DRAIN_INTERVAL_MS = 16
+# Upper bound of events handled per frame, so a burst can't freeze the window
+MAX_EVENTS_PER_DRAIN = 500
+
+
+class UIEventBus:
+    # Worker threads never touch Tk: they post callbacks here and the Tk main loop runs them in batches, in order.
+    # Keyed events (e.g. "reload the gallery") are coalesced so a batch runs each key once, at its latest position.
+    def __init__(self, master, interval_ms=DRAIN_INTERVAL_MS, max_events=MAX_EVENTS_PER_DRAIN):
+        self.master = master
+        self.interval_ms = interval_ms
+        self.max_events = max_events
+        self.queue = queue.SimpleQueue()
+
+    def post(self, callback, *args):
+        self.queue.put((None, callback, args))
+
+    def post_once(self, key, callback, *args):
+        self.queue.put((key, callback, args))
+
+    def start(self):
+        self.master.after(self.interval_ms, self.drain)
+
+    def drain(self):
+        batch = []
+        try:
+            while len(batch) < self.max_events:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        last_index = {key: i for i, (key, _, _) in enumerate(batch) if key is not None}
+        for i, (key, callback, args) in enumerate(batch):
+            if key is not None and last_index[key] != i:
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error handling UI event: {str(e)}")
+        self.master.after(self.interval_ms, self.drain)
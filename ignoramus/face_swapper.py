@@ -1,35 +1,71 @@
 import os
 import tkinter as tk
 from tkinter import filedialog
-import replicate
-import requests
 from PIL import Image
-import base64
 import piexif
 import json
 
+from ignoramus.downloads import download_to_file, downloaded
+from ignoramus.image_generator import create_exif_metadata as create_generation_metadata, add_exif_thumbnail
+from ignoramus.pipeline import Stage
+from ignoramus.predictions import run_model
+from ignoramus.preprocess import prepare_image
+from ignoramus.storage import save_with_metadata
 
-def face_swap(swap_image_path, target_image_path):
-    # Convert images to base64
-    with open(swap_image_path, "rb") as swap_file, open(target_image_path, "rb") as target_file:
-        swap_image = base64.b64encode(swap_file.read()).decode('utf-8')
-        target_image = base64.b64encode(target_file.read()).decode('utf-8')
+# Across every running generation, so a few 4-output batches don't flood the API
+FACE_SWAP_CONCURRENCY = 4
+
+
+def face_swap(swap_image_path, target_image_path, swap_image=None):
+    # Inputs go as data URIs; the swap image can be passed prepared when it is reused for many targets
+    if swap_image is None:
+        swap_image = prepare_image(swap_image_path, "face_source")
+    target_image = prepare_image(target_image_path, "face_target")
 
     properties = {
-        "local_source": f"data:image/jpeg;base64,{swap_image}",
-        "local_target": f"data:image/jpeg;base64,{target_image}",
+        "local_source": swap_image,
+        "local_target": target_image,
         "weight": 0.5,
         "cache_days": 1,
         "det_thresh": 0.1,
         "request_id": ""
     }
 
-    return replicate.run(
+    return run_model(
         "xiankgx/face-swap:cff87316e31787df12002c9e20a78a017a36cb31fde9862d8dedd15ab29b7288",
         input=properties
     )
 
 
+def swap_face_in_generated_image(swap_image_path, file_name, properties, model, swap_image=None):
+    # Replaces a freshly generated image with its face-swapped version, keeping the generation metadata
+    response = face_swap(swap_image_path, file_name, swap_image)
+    if not response or response.get('code') != 200:
+        return False
+
+    exif_dict = create_generation_metadata(properties, model, {"face_swapped": True})
+    with downloaded(response['image']) as path, Image.open(path) as img:
+        add_exif_thumbnail(exif_dict, img)
+        save_with_metadata(img, file_name, piexif.dump(exif_dict))
+    return True
+
+
+def face_swap_stage(swap_image_path):
+    # Pipeline stage swapping the face into each output once any upscale is done
+    def run(context):
+        image = context["image"]
+        try:
+            # The prepared face is cached, so a batch only encodes it once
+            image['face_swapped'] = swap_face_in_generated_image(
+                swap_image_path, context["file_name"], context["properties"], context["model"],
+                prepare_image(swap_image_path, "face_source"))
+        except Exception as e:
+            print(f"Error during face swap: {str(e)}")
+            image['face_swapped'] = False
+
+    return Stage("face_swap", run, after=["upscale"], concurrency=FACE_SWAP_CONCURRENCY)
+
+
 def select_swap_image():
     return filedialog.askopenfilename(
         filetypes=[("Image files", "*.jpg *.jpeg *.png")]
@@ -65,10 +101,10 @@ def copy_exif_data(source_path, target_path):
         user_comment = piexif.helper.UserComment.dump(metadata_json)
         exif_dict["Exif"][piexif.ExifIFD.UserComment] = user_comment
 
-        # Write EXIF data to target image
-        exif_bytes = piexif.dump(exif_dict)
+        # Write EXIF data to target image, with a thumbnail of the swapped result
         with Image.open(target_path) as target_img:
-            target_img.save(target_path, exif=exif_bytes)
+            add_exif_thumbnail(exif_dict, target_img)
+            target_img.save(target_path, exif=piexif.dump(exif_dict))
 
     except Exception as e:
         print(f"Error copying EXIF data: {str(e)}")
@@ -98,11 +134,11 @@ def perform_face_swap_and_save(swap_image_path, target_image_path, output_dir):
     output_path = os.path.join(output_dir, output_filename)
 
     # Download and save the face-swapped image
-    img_response = requests.get(output_url)
-    if img_response.status_code != 200:
+    try:
+        download_to_file(output_url, output_path)
+    except Exception as e:
+        print(f"Error downloading face swap result: {str(e)}")
         return None
-    with open(output_path, 'wb') as f:
-        f.write(img_response.content)
 
     # Copy EXIF data from the original image to the face-swapped image
     copy_exif_data(target_image_path, output_path)
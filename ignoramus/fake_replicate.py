@@ -0,0 +1,283 @@
+import datetime
+import io
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+import numpy as np
+from PIL import Image
+
+# Stand-in for the Replicate API, the models IGNORAMUS runs (Flux, CodeFormer, face swap) and the output CDN, so the
+# whole generation path can be load tested locally. Point the replicate client at it with REPLICATE_BASE_URL.
+DEFAULT_PORT = 8766
+# Encoded output files kept around for download
+FILE_CACHE_SIZE = 256
+SAMPLING_STEPS = 20
+FORMATS = {"webp": "WEBP", "jpg": "JPEG", "png": "PNG"}
+CONTENT_TYPES = {"webp": "image/webp", "jpg": "image/jpeg", "png": "image/png"}
+
+
+class FakeConfig:
+    def __init__(self, queue_time=0.2, run_time=1.0, jitter=0.25, api_latency=0.01, api_error_rate=0.0,
+                 failure_rate=0.0, cdn_latency=0.01, cdn_drop_rate=0.0, image_size=(1024, 768)):
+        self.queue_time = queue_time
+        self.run_time = run_time
+        # Relative random variation of queue and run time
+        self.jitter = jitter
+        self.api_latency = api_latency
+        # Fraction of API requests answered with 429/503
+        self.api_error_rate = api_error_rate
+        # Fraction of predictions that end "failed"
+        self.failure_rate = failure_rate
+        self.cdn_latency = cdn_latency
+        # Fraction of downloads cut off half way through, to exercise resumption
+        self.cdn_drop_rate = cdn_drop_rate
+        self.image_size = image_size
+
+
+def _timestamp(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _jittered(value, jitter):
+    return max(0.0, value * random.uniform(1 - jitter, 1 + jitter))
+
+
+def _model_kind(input):
+    if "local_target" in input:
+        return "face-swap"
+    if "codeformer_fidelity" in input:
+        return "codeformer"
+    return "flux"
+
+
+class FakePrediction:
+    def __init__(self, model, version, input, config):
+        self.id = uuid.uuid4().hex[:20]
+        # The client requires both; official models have no public version and versioned refs don't name the model
+        self.model = model or "fake/versioned-model"
+        self.version = version or "official"
+        self.input = input
+        self.kind = _model_kind(input)
+        self.created_at = time.time()
+        self.started_at = self.created_at + _jittered(config.queue_time, config.jitter)
+        self.completed_at = self.started_at + _jittered(config.run_time, config.jitter)
+        self.fails = random.random() < config.failure_rate
+        self.canceled_at = None
+
+    def status(self, now):
+        if self.canceled_at:
+            return "canceled"
+        if now < self.started_at:
+            return "starting"
+        if now < self.completed_at:
+            return "processing"
+        return "failed" if self.fails else "succeeded"
+
+    def output(self, base_url):
+        if self.kind == "codeformer":
+            return f"{base_url}/files/{self.id}_0.png"
+        if self.kind == "face-swap":
+            return {"code": 200, "image": f"{base_url}/files/{self.id}_0.jpg", "status": "succeed"}
+        extension = self.input.get("output_format", "webp")
+        return [f"{base_url}/files/{self.id}_{i}.{extension}" for i in range(int(self.input.get("num_outputs", 1)))]
+
+    def logs(self, now):
+        # tqdm-style progress lines like the real models print
+        if now < self.started_at:
+            return ""
+        fraction = min(1.0, (now - self.started_at) / max(1e-6, self.completed_at - self.started_at))
+        step = int(fraction * SAMPLING_STEPS)
+        return "\n".join(f"{100 * i // SAMPLING_STEPS:3d}%|{'#' * i}| {i}/{SAMPLING_STEPS}" for i in range(step + 1))
+
+    def to_dict(self, base_url):
+        now = time.time()
+        status = self.status(now)
+        finished = status in ("succeeded", "failed", "canceled")
+        return {
+            "id": self.id,
+            "model": self.model,
+            "version": self.version,
+            "status": status,
+            "input": {key: value for key, value in self.input.items() if not str(value).startswith("data:")},
+            "output": self.output(base_url) if status == "succeeded" else None,
+            "logs": self.logs(now),
+            "error": "Fake model failure" if status == "failed" else None,
+            "metrics": {"predict_time": self.completed_at - self.started_at} if status == "succeeded" else {},
+            "created_at": _timestamp(self.created_at),
+            "started_at": _timestamp(self.started_at) if now >= self.started_at else None,
+            "completed_at": _timestamp(min(now, self.completed_at)) if finished else None,
+            "urls": {
+                "get": f"{base_url}/v1/predictions/{self.id}",
+                "cancel": f"{base_url}/v1/predictions/{self.id}/cancel",
+            },
+        }
+
+
+class FakeReplicateState:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.predictions = {}
+        self.files = OrderedDict()
+        self.counters = {"predictions": 0, "api_requests": 0, "api_errors": 0, "downloads": 0, "dropped": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def create(self, model, version, input):
+        prediction = FakePrediction(model, version, input, self.config)
+        with self.lock:
+            self.predictions[prediction.id] = prediction
+            self.counters["predictions"] += 1
+        return prediction
+
+    def file(self, name):
+        with self.lock:
+            if name in self.files:
+                self.files.move_to_end(name)
+                return self.files[name]
+        stem, extension = name.rsplit(".", 1)
+        # Noise seeded by the file name: every output is different, the same URL always serves the same bytes
+        rng = np.random.default_rng(zlib.crc32(stem.encode()))
+        width, height = self.config.image_size
+        small = rng.integers(0, 256, (max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+        img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        img.save(buffer, FORMATS.get(extension, "PNG"))
+        data = buffer.getvalue()
+        with self.lock:
+            self.files[name] = data
+            while len(self.files) > FILE_CACHE_SIZE:
+                self.files.popitem(last=False)
+        return data
+
+
+class FakeReplicateHandler(BaseHTTPRequestHandler):
+    state = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def api_request(self):
+        # Common API behaviour: latency and injected rate limiting / outages. Returns False if already answered.
+        config = self.state.config
+        self.state.count("api_requests")
+        time.sleep(_jittered(config.api_latency, config.jitter))
+        if random.random() < config.api_error_rate:
+            self.state.count("api_errors")
+            if random.random() < 0.5:
+                self.send_json({"detail": "Request was throttled."}, 429, {"Retry-After": "1"})
+            else:
+                self.send_json({"detail": "Service unavailable"}, 503)
+            return False
+        return True
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        body = self.read_json()
+        if not self.api_request():
+            return
+        if parts == ["v1", "predictions"]:
+            prediction = self.state.create(None, body.get("version"), body.get("input") or {})
+            self.send_json(prediction.to_dict(self.base_url), 201)
+        elif len(parts) == 5 and parts[:2] == ["v1", "models"] and parts[4] == "predictions":
+            prediction = self.state.create(f"{parts[2]}/{parts[3]}", None, body.get("input") or {})
+            self.send_json(prediction.to_dict(self.base_url), 201)
+        elif len(parts) == 4 and parts[:2] == ["v1", "predictions"] and parts[3] == "cancel":
+            if not (prediction := self.state.predictions.get(parts[2])):
+                self.send_json({"detail": "Not found."}, 404)
+                return
+            if prediction.status(time.time()) in ("starting", "processing"):
+                prediction.canceled_at = time.time()
+            self.send_json(prediction.to_dict(self.base_url))
+        else:
+            self.send_json({"detail": "Not found."}, 404)
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "files":
+            self.send_file(parts[1])
+            return
+        if not self.api_request():
+            return
+        if len(parts) == 3 and parts[:2] == ["v1", "predictions"]:
+            if prediction := self.state.predictions.get(parts[2]):
+                self.send_json(prediction.to_dict(self.base_url))
+            else:
+                self.send_json({"detail": "Not found."}, 404)
+        elif len(parts) == 6 and parts[:2] == ["v1", "models"] and parts[4] == "versions":
+            # replicate.run looks the version up to see whether the output is an iterator
+            self.send_json({
+                "id": parts[5],
+                "created_at": _timestamp(0),
+                "cog_version": "0.9.0",
+                "openapi_schema": {"components": {"schemas": {"Output": {"type": "string", "format": "uri"}}}},
+            })
+        else:
+            self.send_json({"detail": "Not found."}, 404)
+
+    def send_file(self, name):
+        config = self.state.config
+        self.state.count("downloads")
+        time.sleep(_jittered(config.cdn_latency, config.jitter))
+        if "." not in name:
+            self.send_json({"detail": "Not found."}, 404)
+            return
+        data = self.state.file(name)
+        start = 0
+        if (range_header := self.headers.get("Range", "")).startswith("bytes="):
+            start = min(len(data), int(range_header[6:].split("-")[0] or 0))
+        body = data[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", CONTENT_TYPES.get(name.rsplit(".", 1)[1], "application/octet-stream"))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", f'"{name}"')
+        self.send_header("Accept-Ranges", "bytes")
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+        if random.random() < config.cdn_drop_rate:
+            self.state.count("dropped")
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+def start_fake_replicate(config=None, host="127.0.0.1", port=0):
+    # Runs in a background thread; returns the server (for shutdown()), its state and its base URL
+    state = FakeReplicateState(config or FakeConfig())
+    handler = type("Handler", (FakeReplicateHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-replicate", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, state, f"http://{host}:{port}"
@@ -0,0 +1,71 @@
+import io
+import json
+import os
+import threading
+
+from PIL import Image
+
+from ignoramus.image_cache import LRUCache
+from ignoramus.utils import read_image_metadata, read_exif_thumbnail
+
+THUMBNAIL_SIZE = (100, 100)
+THUMBNAIL_CACHE_BUDGET = 64 * 1024 * 1024
+
+
+class Gallery:
+    # Listing, metadata and thumbnails of every library root, cached and shared by every caller. Images are named by
+    # their path inside their root; without a root the output root is meant.
+    def __init__(self, library):
+        self.library = library
+        self.lock = threading.Lock()
+        self.metadata_cache = {}
+        self.thumbnail_cache = LRUCache(THUMBNAIL_CACHE_BUDGET)
+
+    def path_for(self, name, root=None):
+        return self.library.root(root).resolve(name)
+
+    def list_images(self, root=None):
+        images = self.library.root(root).images() if root else self.library.images()
+        return [{key: entry[key] for key in ("root", "name", "mtime", "size")} for entry in images]
+
+    def metadata(self, name, root=None):
+        path = self.path_for(name, root)
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            cached = self.metadata_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        metadata = read_image_metadata(path)
+        with self.lock:
+            self.metadata_cache[path] = (mtime, metadata)
+        return metadata
+
+    def search(self, query, limit=100, root=None):
+        # Case-insensitive substring match over every metadata value (prompt, model, parameters)
+        query = query.lower()
+        results = []
+        for entry in self.list_images(root):
+            try:
+                metadata = self.metadata(entry["name"], entry["root"])
+            except (KeyError, OSError):
+                continue
+            if query in json.dumps(metadata).lower():
+                results.append(dict(entry, metadata=metadata))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def thumbnail(self, name, root=None):
+        path = self.path_for(name, root)
+        key = (path, os.path.getmtime(path))
+        if (data := self.thumbnail_cache.get(key)) is not None:
+            return data
+        with read_exif_thumbnail(path) or Image.open(path) as img:
+            img.draft("RGB", THUMBNAIL_SIZE)
+            img = img.convert("RGB")
+        img.thumbnail(THUMBNAIL_SIZE)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=85)
+        data = buffer.getvalue()
+        self.thumbnail_cache.put(key, data, len(data))
+        return data
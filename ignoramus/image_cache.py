@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+
+
+def image_nbytes(img):
+    width, height = img.size
+    return width * height * len(img.getbands())
+
+
+class LRUCache:
+    # Least-recently-used cache bounded by the total size of its values rather than their count
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.budget_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self.used_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.used_bytes += nbytes
+            while self.used_bytes > self.budget_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.used_bytes -= evicted_bytes
+        return True
+
+    def has_room(self, nbytes):
+        with self.lock:
+            return self.used_bytes + nbytes <= self.budget_bytes
+
+    def discard(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.used_bytes -= self.entries.pop(key)[1]
@@ -1,43 +1,100 @@
-import base64
 import datetime
+import io
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import piexif
 import piexif.helper
-import replicate
-import requests
 from PIL import Image
+from replicate.exceptions import ModelError
 
+from ignoramus.analytics import get_analytics
+from ignoramus.downloads import download_to_file
+from ignoramus.journal import get_journal
+from ignoramus.library import get_library
+from ignoramus.parameters import model_input
+from ignoramus.phash import get_index
+from ignoramus.pipeline import Pipeline, Stage
+from ignoramus.preprocess import prepare_image
+from ignoramus.predictions import run_prediction, PredictionCancelled
+from ignoramus.scheduler import is_retryable
+from ignoramus.storage import store_image, save_with_metadata, extension_for_url, match_extension
 from ignoramus.upscaler import upscale_image
 
+# Small JPEG embedded in the EXIF "1st" IFD so previews don't need a full decode; must stay well under 64 KB
+EXIF_THUMBNAIL_SIZE = (160, 160)
+EXIF_THUMBNAIL_QUALITY = 85
+RESUME_CONCURRENCY = 4
+DOWNLOAD_CONCURRENCY = 8
+UPSCALE_CONCURRENCY = 4
 
-def generate_image(model, properties):
-    current_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+
+_last_timestamp = None
+_timestamp_lock = threading.Lock()
+
+
+def unique_timestamp():
+    # File names are built from this; generations started in the same millisecond must not share one
+    global _last_timestamp
+    with _timestamp_lock:
+        now = datetime.datetime.now()
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        if _last_timestamp and now <= _last_timestamp:
+            now = _last_timestamp + datetime.timedelta(milliseconds=1)
+        _last_timestamp = now
+    return now.strftime("%Y%m%d_%H%M%S_%f")[:-3]
+
+
+def generate_image(model, properties, job_callback=None, file_stem=None, extra_metadata=None):
+    # file_stem and extra_metadata are how the outputs will be saved, journaled up front so a resume saves them
+    # the same way even if the app stops before the prediction finishes
+    current_time = file_stem or unique_timestamp()
     results_dir = get_output_directory()
     try:
         # Check if image_path is in properties and handle it
         if "image_path" in properties and properties["image_path"]:
-            with open(properties["image_path"], "rb") as image_file:
-                encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-            properties["image"] = f"data:image/jpeg;base64,{encoded_image}"
+            properties["image"] = prepare_image(properties["image_path"], "img2img")
             del properties["image_path"]  # Remove image_path from properties
 
-        output = replicate.run(f"black-forest-labs/flux-{model}", input=properties)
+        journal = get_journal()
+        created = []
+
+        def record_prediction(prediction):
+            created.append(prediction.id)
+            journal.record(prediction.id, model, properties, current_time, results_dir, extra_metadata)
+
+        try:
+            output = run_prediction(f"black-forest-labs/flux-{model}", model_input(properties), job_callback,
+                                    on_created=record_prediction)
+        except PredictionCancelled:
+            for prediction_id in created:
+                journal.finish(prediction_id, "canceled")
+            raise
+        except ModelError as e:
+            for prediction_id in created:
+                journal.finish(prediction_id, "failed", str(e))
+            raise
+        # Any other error leaves the prediction "predicting" in the journal, to be picked up on the next start
+        for prediction_id in created:
+            journal.set_output(prediction_id, output)
         return output, current_time, results_dir
     except Exception:
         raise
 
 
 def get_output_directory():
-    if not os.path.exists("results"):
-        os.makedirs("results")
-    return "results"
+    # The library's output root, "results" unless library.json says otherwise
+    return get_library().output_directory()
 
 
-def create_exif_metadata(properties, model):
+def create_exif_metadata(properties, model, extra_metadata=None):
     metadata = properties.copy()
     metadata["model"] = model
+    if extra_metadata:
+        metadata.update(extra_metadata)
 
     # Remove the 'image' key from metadata to prevent EXIF data from being too long
     if 'image' in metadata:
@@ -50,44 +107,180 @@ def create_exif_metadata(properties, model):
     return exif_dict
 
 
+def create_exif_thumbnail(img):
+    thumbnail = img.convert("RGB")
+    thumbnail.thumbnail(EXIF_THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, "JPEG", quality=EXIF_THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def add_exif_thumbnail(exif_dict, img):
+    exif_dict["thumbnail"] = create_exif_thumbnail(img)
+    return exif_dict
+
+
 def save_image_with_metadata(img, file_name, exif_dict):
     exif_bytes = piexif.dump(exif_dict)
     img.save(file_name, "JPEG", exif=exif_bytes, quality=95)
 
 
 def fetch_and_save_image(url, file_name):
-    response = requests.get(url)
-    with open(file_name, "wb") as file:
-        file.write(response.content)
+    return download_to_file(url, file_name)
 
 
-def handle_upscaling(file_name, exif_bytes):
-    if upscaled_data := upscale_image(file_name):
-        os.remove(file_name)
-        with open(file_name, "wb") as upscaled_file:
-            upscaled_file.write(upscaled_data)
+def handle_upscaling(file_name, exif_bytes, engine="remote"):
+    if upscaled_data := upscale_image(file_name, engine):
         try:
-            upscaled_img = Image.open(file_name)
-            upscaled_img.save(file_name, "JPEG", exif=exif_bytes, quality=95)
+            with Image.open(io.BytesIO(upscaled_data)) as upscaled_img:
+                save_with_metadata(upscaled_img, file_name, exif_bytes)
             return True
         except Exception:
             return False
     return False
 
 
-def process_generated_images(output, current_time, results_dir, properties, model):
+def find_duplicate(file_name, results_dir):
+    try:
+        return get_index(results_dir).add(file_name)
+    except Exception as e:
+        print(f"Error updating perceptual hash index: {str(e)}")
+        return None
+
+
+def download_output(context):
+    fetch_and_save_image(context["url"], context["file_name"])
+    context["download_bytes"] = os.path.getsize(context["file_name"])
+    context["file_name"] = context["image"]["file_name"] = match_extension(context["file_name"])
+
+
+def stamp_metadata(context):
+    with Image.open(context["file_name"]) as img:
+        exif_dict = add_exif_thumbnail(
+            create_exif_metadata(context["properties"], context["model"], context["extra_metadata"]), img)
+    context["exif_bytes"] = piexif.dump(exif_dict)
+
+
+def store_output(context):
+    encoding = context["properties"].get("storage_encoding", "native")
+    context["file_name"] = context["image"]["file_name"] = store_image(context["file_name"], context["exif_bytes"],
+                                                                       encoding)
+
+
+def upscale_output(context):
+    engine = context["properties"].get("upscale_engine", "remote")
+    context["image"]["upscaled"] = handle_upscaling(context["file_name"], context["exif_bytes"], engine)
+
+
+def check_duplicate(context):
+    context["image"]["duplicate_of"] = find_duplicate(context["file_name"], context["results_dir"])
+
+
+# What happens to every output of a generation. Callers add their own stages with with_stage(), e.g. a face swap
+# after "upscale". The duplicate check reads the stored file while an upscale may replace it, which is safe because
+# files are always replaced atomically.
+GENERATION_PIPELINE = Pipeline([
+    Stage("download", download_output, concurrency=DOWNLOAD_CONCURRENCY),
+    # Pillow releases the GIL while encoding, so threads are enough to use every core
+    Stage("metadata", stamp_metadata, after=["download"], concurrency=os.cpu_count() or 1),
+    Stage("store", store_output, after=["metadata"], concurrency=os.cpu_count() or 1),
+    Stage("duplicate_check", check_duplicate, after=["store"], concurrency=os.cpu_count() or 1),
+    Stage("upscale", upscale_output, after=["store"], concurrency=UPSCALE_CONCURRENCY,
+          when=lambda context: context["properties"].get("upscale", False)),
+])
+
+
+def process_generated_images(output, current_time, results_dir, properties, model, extra_metadata=None,
+                             on_image=None, pipeline=None):
+    # Every output goes through the pipeline (GENERATION_PIPELINE unless given) on its own; on_image(image) is called
+    # from a worker thread as soon as that output is done, so the first image of a batch doesn't wait for the
+    # slowest one. Returns the images in output order.
     if not isinstance(output, list):
         output = [output]
-    processed_images = []
+    journal = get_journal()
+    prediction_id = journal.start_processing(output, current_time, extra_metadata)
+
+    contexts = []
     for idx, url in enumerate(output):
-        file_name = f"{results_dir}/img_{current_time}{f'_{str(idx)}' if len(output) > 1 else ''}.jpg"
-        fetch_and_save_image(url, file_name)
-        img = Image.open(file_name)
-        exif_dict = create_exif_metadata(properties, model)
-        save_image_with_metadata(img, file_name, exif_dict)
-        if properties.get("upscale", False):
-            upscaled = handle_upscaling(file_name, piexif.dump(exif_dict))
-        else:
-            upscaled = False
-        processed_images.append({"file_name": file_name, "upscaled": upscaled})
+        # Keep the format the model produced instead of transcoding everything to JPEG
+        suffix = f"_{str(idx)}" if len(output) > 1 else ""
+        file_name = f"{results_dir}/img_{current_time}{suffix}{extension_for_url(url)}"
+        contexts.append({
+            "url": url,
+            "file_name": file_name,
+            "properties": properties,
+            "model": model,
+            "extra_metadata": extra_metadata,
+            "results_dir": results_dir,
+            "image": {"file_name": file_name, "upscaled": False, "duplicate_of": None},
+        })
+    # The journal keeps the job for a resume unless every output made it
+    (pipeline or GENERATION_PIPELINE).run(contexts, (lambda context: on_image(context["image"])) if on_image else None)
+    processed_images = [context["image"] for context in contexts]
+    get_index(results_dir).save()
+    if prediction_id:
+        journal.finish(prediction_id)
+        try:
+            # Stage times are summed over outputs, which run in parallel
+            download_time = sum(context["timings"].get("download", 0) for context in contexts)
+            processing_time = sum(sum(context["timings"].values()) for context in contexts) - download_time
+            get_analytics().record_processing(prediction_id, f"black-forest-labs/flux-{model}", properties,
+                                              len(output), sum(context["download_bytes"] for context in contexts),
+                                              download_time, processing_time)
+        except Exception as e:
+            print(f"Error recording analytics: {str(e)}")
     return processed_images
+
+
+def resume_job(entry, job_callback=None):
+    # Finishes a journaled prediction from wherever it stopped: polling, then downloading and saving
+    journal = get_journal()
+    prediction_id = entry["prediction_id"]
+    output = entry["output"]
+    try:
+        if entry["stage"] == "predicting":
+            output = run_prediction(f"black-forest-labs/flux-{entry['model']}", None, job_callback,
+                                    prediction_id=prediction_id)
+            journal.set_output(prediction_id, output)
+        return process_generated_images(output, entry["file_stem"], entry["results_dir"], entry["properties"],
+                                        entry["model"], entry["extra_metadata"])
+    except PredictionCancelled:
+        journal.finish(prediction_id, "canceled")
+        raise
+    except Exception as e:
+        # Connection problems keep the job for the next start; anything else (failed prediction, expired output
+        # URLs) won't get better by retrying
+        if not is_retryable(e):
+            journal.finish(prediction_id, "failed", str(e))
+        raise
+
+
+def resume_interrupted_jobs(on_resumed=None, max_workers=RESUME_CONCURRENCY):
+    # Only jobs no other running process holds are resumed. Jobs still leased by a process that is gone (e.g. this
+    # app crashed a moment ago) are claimed once the lease has run out.
+    journal = get_journal()
+    results = _resume_entries(journal.claim_unfinished(), on_resumed, max_workers)
+    if expiry := journal.next_lease_expiry():
+        time.sleep(max(0.0, expiry - time.time()) + 1)
+        results += _resume_entries(journal.claim_unfinished(), on_resumed, max_workers)
+    return results
+
+
+def _resume_entries(entries, on_resumed, max_workers):
+    if not entries:
+        return []
+    print(f"Resuming {len(entries)} interrupted job(s).")
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="resume") as pool:
+        futures = {pool.submit(resume_job, entry): entry for entry in entries}
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                result = {"prediction_id": entry["prediction_id"], "images": future.result(), "error": None}
+            except Exception as e:
+                print(f"Error resuming prediction {entry['prediction_id']}: {str(e)}")
+                result = {"prediction_id": entry["prediction_id"], "images": [], "error": str(e)}
+            results.append(result)
+            if on_resumed:
+                on_resumed(result)
+    return results
@@ -0,0 +1,147 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from ignoramus.library import get_library
+
+# Kept in the library's output root
+JOURNAL_FILE_NAME = ".journal.sqlite"
+
+# predicting: created on Replicate, output not known yet
+# downloading: prediction succeeded, outputs not saved yet
+# done / failed / canceled: nothing left to resume
+UNFINISHED_STAGES = ("predicting", "downloading")
+# Every process sharing the journal (the GUI, ignoramus serve) owns the jobs it started or resumed and renews a lease
+# on them while it runs; only jobs whose owner's lease ran out (it crashed or quit) are resumed by another process
+LEASE_SECONDS = 30
+HEARTBEAT_SECONDS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    prediction_id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    properties TEXT NOT NULL,
+    file_stem TEXT NOT NULL,
+    results_dir TEXT NOT NULL,
+    extra_metadata TEXT,
+    stage TEXT NOT NULL,
+    output TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage);
+CREATE INDEX IF NOT EXISTS jobs_output ON jobs (output);
+"""
+# Added after the first release; older journals get them on open
+ADDED_COLUMNS = {"owner": "TEXT", "lease_until": "REAL"}
+JOB_COLUMNS = "prediction_id, model, properties, file_stem, results_dir, extra_metadata, stage, output"
+
+
+class JobJournal:
+    # Every paid prediction is written down as soon as it exists, so a crash or restart never loses its output
+    def __init__(self, path=None):
+        path = path or os.path.join(get_library().output_directory(), JOURNAL_FILE_NAME)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        threading.Thread(target=self._heartbeat, name="journal-heartbeat", daemon=True).start()
+
+    def _execute(self, query, args=()):
+        with self.lock:
+            return self.connection.execute(query, args).fetchall()
+
+    def _heartbeat(self):
+        while True:
+            try:
+                self._execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND stage IN (?, ?)",
+                              (time.time() + LEASE_SECONDS, self.owner) + UNFINISHED_STAGES)
+            except Exception as e:
+                print(f"Error renewing journal leases: {str(e)}")
+            time.sleep(HEARTBEAT_SECONDS)
+
+    def record(self, prediction_id, model, properties, file_stem, results_dir, extra_metadata=None):
+        # The encoded input image is only needed to create the prediction
+        properties = {key: value for key, value in properties.items() if key != "image"}
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO jobs (prediction_id, model, properties, file_stem, results_dir, extra_metadata, "
+            "stage, created_at, updated_at, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, 'predicting', ?, ?, ?, ?)",
+            (prediction_id, model, json.dumps(properties), file_stem, results_dir, json.dumps(extra_metadata), now,
+             now, self.owner, now + LEASE_SECONDS))
+
+    def set_output(self, prediction_id, output):
+        self._execute("UPDATE jobs SET stage = 'downloading', output = ?, updated_at = ? WHERE prediction_id = ?",
+                      (json.dumps(output), time.time(), prediction_id))
+
+    def start_processing(self, output, file_stem, extra_metadata=None):
+        # Finds the job these outputs belong to. The stem and metadata were journaled when the prediction was
+        # created; they are written again in case the caller only settled on them afterwards.
+        rows = self._execute("SELECT prediction_id FROM jobs WHERE output = ? AND stage = 'downloading'",
+                             (json.dumps(output),))
+        if not rows:
+            return None
+        prediction_id = rows[0][0]
+        self._execute("UPDATE jobs SET file_stem = ?, extra_metadata = ?, updated_at = ? WHERE prediction_id = ?",
+                      (file_stem, json.dumps(extra_metadata), time.time(), prediction_id))
+        return prediction_id
+
+    def finish(self, prediction_id, stage="done", error=None):
+        self._execute("UPDATE jobs SET stage = ?, error = ?, updated_at = ? WHERE prediction_id = ?",
+                      (stage, error, time.time(), prediction_id))
+
+    def claim_unfinished(self):
+        # Takes over the unfinished jobs nobody holds a live lease on, in one statement so two processes starting
+        # at the same time never both get the same job. Returns only the jobs claimed here.
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET owner = ?, lease_until = ?, updated_at = ? WHERE stage IN (?, ?) "
+            f"AND (owner IS NULL OR lease_until IS NULL OR lease_until < ?) RETURNING {JOB_COLUMNS}, created_at",
+            (self.owner, now + LEASE_SECONDS, now) + UNFINISHED_STAGES + (now,))
+        rows.sort(key=lambda row: row[-1])
+        return [{
+            "prediction_id": prediction_id,
+            "model": model,
+            "properties": json.loads(properties),
+            "file_stem": file_stem,
+            "results_dir": results_dir,
+            "extra_metadata": json.loads(extra_metadata) if extra_metadata else None,
+            "stage": stage,
+            "output": json.loads(output) if output else None,
+        } for prediction_id, model, properties, file_stem, results_dir, extra_metadata, stage, output, _ in rows]
+
+    def next_lease_expiry(self):
+        # When the latest lease another process holds on an unfinished job runs out, if any. A process that is
+        # still running keeps renewing it; one that crashed lets it expire and its jobs can be claimed then.
+        rows = self._execute(
+            "SELECT MAX(lease_until) FROM jobs WHERE stage IN (?, ?) AND owner IS NOT NULL AND owner != ? "
+            "AND lease_until >= ?",
+            UNFINISHED_STAGES + (self.owner, time.time()))
+        return rows[0][0] if rows else None
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = JobJournal()
+        return _journal
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+
+# The project directory (where token.txt goes). The config and the default root are looked up here, whatever the
+# working directory the app was started from.
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Optional. Relative root paths are relative to the config file:
+# {"roots": [{"path": "results", "output": true},
+#            {"path": "/Volumes/nas/ignoramus-archive", "name": "archive", "network": true}]}
+LIBRARY_CONFIG = os.path.join(PROJECT_DIR, "library.json")
+DEFAULT_ROOT = os.path.join(PROJECT_DIR, "results")
+INDEX_FILE_NAME = ".library_index.json"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+# How often watchers look for changes. Roots are only ever scanned from background threads.
+LOCAL_WATCH_INTERVAL = 3
+NETWORK_WATCH_INTERVAL = 60
+# Network filesystems may only keep directory mtimes to the second or two; a directory changed this recently is
+# listed again on the next scan, in case it changes again within the same mtime
+MTIME_GRANULARITY = 2.0
+
+
+class LibraryRoot:
+    # One folder tree of images with a persistent incremental index. Only directories whose mtime changed since the
+    # last scan are listed again, so an unchanged archive costs one stat per directory. Files rewritten in place
+    # keep their indexed mtime until their directory changes.
+    def __init__(self, path, name=None, network=False, output=False):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.name = name or os.path.basename(self.path) or self.path
+        self.network = network
+        self.output = output
+        self.index_path = os.path.join(self.path, INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        # relative directory -> {"mtime": ns, "files": {name: [mtime, size]}, "dirs": [names]}
+        self.directories = {}
+        self.listing = []
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                self.directories = json.load(f)["directories"]
+            self.listing = self._build_listing(self.directories)
+        except Exception as e:
+            print(f"Error loading library index of {self.path}, rescanning: {str(e)}")
+            self.directories = {}
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"directories": self.directories})
+        temp_path = f"{self.index_path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(data)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            # e.g. a read-only archive; the index then only lives for this session
+            print(f"Error saving library index of {self.path}: {str(e)}")
+
+    def _build_listing(self, directories):
+        listing = []
+        for relative, directory in directories.items():
+            for name, (mtime, size) in directory["files"].items():
+                relative_name = f"{relative}/{name}" if relative else name
+                listing.append({
+                    "root": self.name,
+                    "name": relative_name,
+                    "path": os.path.join(self.path, *relative_name.split("/")),
+                    "mtime": mtime,
+                    "size": size,
+                })
+        return sorted(listing, key=lambda entry: entry["mtime"], reverse=True)
+
+    @staticmethod
+    def _scan_directory(directory, mtime):
+        files, dirs = {}, []
+        for entry in os.scandir(directory):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                files[entry.name] = [stat.st_mtime, stat.st_size]
+        return {"mtime": mtime, "files": files, "dirs": dirs}
+
+    def scan(self):
+        # Returns True if anything was added, removed or renamed
+        with self.scan_lock:
+            if not os.path.isdir(self.path):
+                return False
+            directories = {}
+            changed = False
+            pending = [""]
+            while pending:
+                relative = pending.pop()
+                directory = os.path.join(self.path, *relative.split("/")) if relative else self.path
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                    cached = self.directories.get(relative)
+                    if cached and cached["mtime"] == mtime:
+                        entry = cached
+                    else:
+                        recent = time.time() - mtime / 1e9 < MTIME_GRANULARITY
+                        entry = self._scan_directory(directory, None if recent else mtime)
+                        changed = changed or cached is None or (entry["files"], entry["dirs"]) != (
+                            cached["files"], cached["dirs"])
+                except OSError as e:
+                    print(f"Error scanning {directory}: {str(e)}")
+                    continue
+                directories[relative] = entry
+                pending.extend(f"{relative}/{name}" if relative else name for name in entry["dirs"])
+            changed = changed or directories.keys() != self.directories.keys()
+            # Directories that were only touched get their new mtime too, so they aren't listed again next time
+            listing = self._build_listing(directories) if changed else None
+            with self.lock:
+                self.directories = directories
+                if changed:
+                    self.listing = listing
+            if changed:
+                self.save()
+            return changed
+
+    def images(self):
+        with self.lock:
+            return list(self.listing)
+
+    def resolve(self, name):
+        # Only paths inside the root are served
+        parts = name.replace("\\", "/").split("/")
+        if os.path.isabs(name) or any(part in ("", ".", "..") for part in parts):
+            raise KeyError(name)
+        path = os.path.join(self.path, *parts)
+        if not name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+            raise KeyError(name)
+        return path
+
+
+class Library:
+    def __init__(self, roots):
+        self.roots = roots
+        self.output_root = next((root for root in roots if root.output), roots[0])
+        self.watchers = []
+
+    def output_directory(self):
+        if not os.path.exists(self.output_root.path):
+            os.makedirs(self.output_root.path)
+        return self.output_root.path
+
+    def root(self, name=None):
+        if name is None:
+            return self.output_root
+        for root in self.roots:
+            if root.name == name:
+                return root
+        raise KeyError(name)
+
+    def images(self):
+        # Newest first across every root, as far as their indexes know. Never touches the disk, so it is safe on the
+        # Tk thread; the watchers (or scan_local) keep the indexes current.
+        images = []
+        for root in self.roots:
+            images.extend(root.images())
+        return sorted(images, key=lambda entry: entry["mtime"], reverse=True)
+
+    def scan_local(self):
+        # Brings the local roots up to date right away, e.g. after saving or deleting images, rather than waiting
+        # for their watchers. Network roots are left to theirs. Call from a worker thread.
+        changed = False
+        for root in self.roots:
+            if not root.network:
+                changed = root.scan() or changed
+        return changed
+
+    def start_watching(self, on_change):
+        # One polling thread per root; on_change(root) is called from it whenever the root changed
+        for root in self.roots:
+            interval = NETWORK_WATCH_INTERVAL if root.network else LOCAL_WATCH_INTERVAL
+            watcher = threading.Thread(target=self._watch, args=(root, interval, on_change),
+                                       name=f"library-watch-{root.name}", daemon=True)
+            watcher.start()
+            self.watchers.append(watcher)
+
+    @staticmethod
+    def _watch(root, interval, on_change):
+        while True:
+            try:
+                if root.scan():
+                    on_change(root)
+            except Exception as e:
+                print(f"Error watching {root.path}: {str(e)}")
+            time.sleep(interval)
+
+
+def load_library(config_path=LIBRARY_CONFIG):
+    if not os.path.exists(config_path):
+        return Library([LibraryRoot(DEFAULT_ROOT, output=True)])
+    base = os.path.dirname(os.path.abspath(config_path))
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+        roots = []
+        for spec in config["roots"]:
+            path = os.path.abspath(os.path.join(base, os.path.expanduser(spec["path"])))
+            name = spec.get("name") or os.path.basename(path) or path
+            if name in (root.name for root in roots):
+                name = f"{name}-{len(roots)}"
+            roots.append(LibraryRoot(path, name, spec.get("network", False), spec.get("output", False)))
+        if roots:
+            return Library(roots)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Error reading {config_path}, using {DEFAULT_ROOT}: {str(e)}")
+    return Library([LibraryRoot(DEFAULT_ROOT, output=True)])
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_library():
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = load_library()
+        return _library
+
+
+def set_library(library):
+    # For tools that write somewhere else than the configured library, e.g. the load test
+    global _library
+    with _library_lock:
+        _library = library
@@ -0,0 +1,149 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from ignoramus.fake_replicate import FakeConfig, start_fake_replicate
+from ignoramus.library import Library, LibraryRoot, set_library
+
+# Drives the real generation path (create, poll, download, store, index) at N parallel jobs against the fake
+# Replicate server and reports throughput and latency percentiles:
+#   python -m ignoramus.loadtest --jobs 200 --concurrency 16 --run-time 2 --api-error-rate 0.05
+PERCENTILES = (50, 95, 99)
+
+
+def run_direct_job(model, properties):
+    from ignoramus.image_generator import generate_image, process_generated_images
+    output, current_time, results_dir = generate_image(model, dict(properties))
+    return process_generated_images(output, current_time, results_dir, properties, model)
+
+
+def run_direct(model, properties, jobs, concurrency, on_done):
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadtest") as pool:
+        futures = {pool.submit(run_direct_job, model, properties): time.perf_counter() for _ in range(jobs)}
+        for future in as_completed(futures):
+            try:
+                images = len(future.result())
+                error = None
+            except Exception as e:
+                images, error = 0, str(e)
+            # Submission time is only a lower bound of when the job started; queueing in the pool counts as latency
+            on_done(time.perf_counter() - futures[future], images, error)
+
+
+def run_engine(model, properties, jobs, concurrency, on_done):
+    from ignoramus.engine import GenerationEngine
+    engine = GenerationEngine(concurrency)
+    pending = [engine.submit(model, properties) for _ in range(jobs)]
+    while pending:
+        time.sleep(0.05)
+        for job in [job for job in pending if job.finished_at]:
+            pending.remove(job)
+            on_done(job.finished_at - job.created_at, len(job.images), job.error)
+
+
+def summarize(latencies, images, errors, elapsed):
+    lines = [f"{len(latencies)} jobs in {elapsed:.2f}s: {len(latencies) / elapsed:.2f} jobs/s, "
+             f"{images / elapsed:.2f} images/s, {len(errors)} failed"]
+    if latencies:
+        values = np.percentile(latencies, PERCENTILES)
+        lines.append("latency " + ", ".join(f"p{p} {v:.3f}s" for p, v in zip(PERCENTILES, values))
+                     + f", max {max(latencies):.3f}s")
+    for error in sorted(set(errors))[:5]:
+        lines.append(f"  error: {error}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m ignoramus.loadtest")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=["direct", "engine"], default="direct",
+                        help="generate_image + process_generated_images per thread, or the shared GenerationEngine")
+    parser.add_argument("--model", default="schnell")
+    parser.add_argument("--num-outputs", type=int, default=1)
+    parser.add_argument("--output-format", default="webp")
+    parser.add_argument("--upscale", action="store_true", help="Also run the CodeFormer upscale step")
+    parser.add_argument("--base-url", help="Use an already running fake server instead of starting one")
+    parser.add_argument("--workdir", help="Where results are written (default: a temporary directory)")
+    parser.add_argument("--queue-time", type=float, default=0.2)
+    parser.add_argument("--run-time", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--api-latency", type=float, default=0.01)
+    parser.add_argument("--api-error-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--cdn-latency", type=float, default=0.01)
+    parser.add_argument("--cdn-drop-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", default="1024x768")
+    parser.add_argument("--serve", action="store_true", help="Only run the fake server (on port 8766) until Ctrl+C")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    config = FakeConfig(args.queue_time, args.run_time, args.jitter, args.api_latency, args.api_error_rate,
+                        args.failure_rate, args.cdn_latency, args.cdn_drop_rate, (width, height))
+
+    if args.serve:
+        server, state, base_url = start_fake_replicate(config, port=8766)
+        print(f"Fake Replicate listening on {base_url}; use REPLICATE_BASE_URL={base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    server = state = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server, state, base_url = start_fake_replicate(config)
+    # The replicate client reads these when it makes its first request
+    os.environ["REPLICATE_BASE_URL"] = base_url
+    os.environ.setdefault("REPLICATE_API_TOKEN", "fake-token")
+    # Results, the journal and the hash index go to a library of their own rather than the configured one
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="ignoramus-loadtest-"))
+    set_library(Library([LibraryRoot(os.path.join(workdir, "results"), output=True)]))
+    print(f"Writing results to {workdir}")
+
+    from ignoramus.parameters import default_properties
+    from ignoramus.scheduler import scheduler
+    from ignoramus.transport import transport
+    properties = default_properties(args.model)
+    properties.update({"prompt": "load test", "upscale": args.upscale})
+    if "num_outputs" in properties:
+        properties.update({"num_outputs": args.num_outputs, "output_format": args.output_format})
+
+    latencies, errors = [], []
+    image_count = 0
+    lock = threading.Lock()
+
+    def on_done(latency, images, error):
+        nonlocal image_count
+        with lock:
+            latencies.append(latency)
+            image_count += images
+            if error:
+                errors.append(error)
+            if len(latencies) % max(1, args.jobs // 10) == 0:
+                print(f"  {len(latencies)}/{args.jobs} done")
+
+    run = run_engine if args.mode == "engine" else run_direct
+    started = time.perf_counter()
+    run(args.model, properties, args.jobs, args.concurrency, on_done)
+    elapsed = time.perf_counter() - started
+
+    for line in summarize(latencies, image_count, errors, elapsed):
+        print(line)
+    print(f"scheduler concurrency {scheduler.concurrency}, rate {scheduler.bucket.rate:.2f}/s")
+    for host, stats in transport.stats().items():
+        print(f"{host}: {stats['requests']} requests over {stats['connections']} connections")
+    if state:
+        print("fake server: " + ", ".join(f"{key} {value}" for key, value in state.counters.items()))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
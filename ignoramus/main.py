@@ -1,87 +1,167 @@
-import datetime
+import argparse
 import random
 import threading
 import time
-from tkinter import ttk, filedialog
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import ttk, filedialog, simpledialog
 
-import piexif.helper
-import requests
 from PIL import ImageTk
 
-from ignoramus.upscaler import upscale_image
+from ignoramus.parameters import MODELS, COMMON_PARAMETERS, MODEL_PARAMETERS, default_values, step_values, \
+    label_for, format_for_step
 from ignoramus.utils import *
 from ignoramus.version_checker import check_updates
-from ignoramus.image_generator import generate_image, process_generated_images, get_output_directory
-from ignoramus.face_swapper import add_face_swap_button
-from ignoramus.face_swapper import face_swap
+from ignoramus.image_generator import generate_image, process_generated_images, get_output_directory, \
+    resume_interrupted_jobs, GENERATION_PIPELINE
+from ignoramus.face_swapper import face_swap_stage
+from ignoramus.preprocess import prefetch_image
+from ignoramus.phash import get_index
+from ignoramus.predictions import PredictionCancelled
+from ignoramus.viewer import ImageViewer
+from ignoramus.engine import DEFAULT_WORKERS
+from ignoramus.events import UIEventBus
+from ignoramus.image_cache import LRUCache
+from ignoramus.profiling import profiler, profiled, DEFAULT_REPORT_PATH
+from ignoramus.analytics import get_analytics, format_summary
+from ignoramus.library import get_library
+from ignoramus.drafts import supports_draft, generate_with_draft
+from ignoramus.batch import upscale_and_save, face_swap_and_save, delete_file, parse_tags, retag, run_batch
+from ignoramus.server import serve, DEFAULT_HOST, DEFAULT_PORT
+from ignoramus.sweep import SWEEPABLE_PARAMETERS, DEFAULT_SWEEP_CONCURRENCY, parse_sweep_values, count_cells, \
+    run_sweep
+
+# The gallery is a virtual grid: only rows within GALLERY_OVERSCAN_ROWS of the viewport have widgets, and their
+# thumbnails are loaded on worker threads
+GALLERY_COLUMNS = 3
+GALLERY_THUMBNAIL_SIZE = 100
+GALLERY_CELL = 110
+GALLERY_OVERSCAN_ROWS = 2
+GALLERY_THUMBNAIL_WORKERS = 4
+GALLERY_THUMBNAIL_BUDGET = 32 * 1024 * 1024
 
 
 class ImageGeneratorGUI:
     def __init__(self, master):
         self.face_image_path = tk.StringVar()
         self.sliders = None
-        self.full_size_image = None
         self.gallery_tab = None
         self.gallery_notebook = None
-        self.on_frame_configure = None
-        self.gallery_images_frame = None
         self.gallery_scrollbar = None
         self.gallery_canvas = None
         self.gallery_frame = None
+        self.gallery_image_paths = []
+        self.gallery_mtimes = {}
+        self.gallery_labels = {}
+        self.gallery_windows = {}
+        self.gallery_placeholder = None
+        self.thumbnail_photos = LRUCache(GALLERY_THUMBNAIL_BUDGET)
+        self.thumbnail_pending = set()
+        self.thumbnail_pool = ThreadPoolExecutor(max_workers=GALLERY_THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+        self.gallery_refresh_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-refresh")
+        self.gallery_refresh_lock = threading.Lock()
+        self.gallery_refresh_pending = False
+        self.selected_paths = set()
+        self.selection_anchor = None
+        self.batch_label = None
+        self.batch_progress = None
+        self.batch_buttons = []
+        self.batch_cancel_button = None
+        self.batch_cancelled = threading.Event()
+        self.batch_running = False
         self.step_values = None
         self.default_values = None
-        self.default_values_dev = None
+        self.common_panel = None
+        self.model_panels = {}
         self.output_text = None
         self.generate_button = None
+        self.sweep_button = None
+        self.stats_button = None
+        self.draft_var = None
+        self.reject_draft_button = None
+        self.refine_jobs = []
+        self.refine_rejected = threading.Event()
         self.param_frame = None
         self.prompt_text = None
         self.model_combo = None
         self.model_var = None
         self.is_generating = False
+        self.generation_lock = threading.Lock()
         self.progress_bar = None
-        self.last_modified_time = 0
-        self.update_thread = None
-        self.update_lock = threading.Lock()
-        self.start_gallery_update_thread()
+        self.cancel_button = None
+        self.job_status_label = None
+        self.progress_poll = None  # after() id of the pending poll_job_progress, so only one chain ever runs
+        self.active_jobs = []
+        self.jobs_lock = threading.Lock()
+        self.cancel_requested = threading.Event()
+        self.library = get_library()
         self.master = master
+        self.events = UIEventBus(master)
+        self.events.start()
         master.title("IGNORAMUS")
         master.geometry("1200x900")
 
         self.common_vars = {}
-        self.model_specific_vars = {
-            "1.1-pro": {},
-            "dev": {},
-            "schnell": {}
-        }
+        self.model_specific_vars = {model: {} for model in MODELS}
 
+        self.setup_styles()
         self.create_widgets()
         self.setup_keyboard_shortcuts()
         self.create_gallery()
+        # Every library root is watched from its own thread, which has already rescanned it when it reports a change
+        self.library.start_watching(lambda root: self.events.post_once("gallery", self.load_images_from_results))
+        self.start_resume_thread()
 
-    def start_gallery_update_thread(self):
-        self.update_thread = threading.Thread(target=self.periodic_gallery_update, daemon=True)
-        self.update_thread.start()
+    def start_resume_thread(self):
+        # Predictions that were still running (or not yet downloaded) when the app last closed
+        threading.Thread(target=resume_interrupted_jobs, args=(self.on_job_resumed,), daemon=True).start()
 
-    def periodic_gallery_update(self):
-        while True:
-            time.sleep(3)  # Wait for 3 seconds
-            self.check_and_update_gallery()
-
-    def check_and_update_gallery(self):
-        results_folder = "results"
-        if not os.path.exists(results_folder):
+    def on_job_resumed(self, result):
+        if result["error"]:
+            self.post_output(f"Could not resume prediction {result['prediction_id']}: {result['error']}\n")
             return
+        self.post_output(f"Resumed prediction {result['prediction_id']}.\n")
+        self.events.post(self.update_output_text, result["images"])
+        self.post_gallery_reload()
+
+    def append_output(self, message):
+        # The output box starts out disabled, which would silently drop messages that come before any generation
+        # (e.g. resumed predictions)
+        self.output_text.config(state="normal")
+        self.output_text.insert(tk.END, message)
 
-        with self.update_lock:
-            latest_modified_time = max(
-                os.path.getmtime(os.path.join(results_folder, f))
-                for f in os.listdir(results_folder)
-                if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'))
-            )
+    def post_output(self, message):
+        # Safe to call from any thread
+        self.events.post(self.append_output, message)
 
-            if latest_modified_time > self.last_modified_time:
-                self.last_modified_time = latest_modified_time
-                self.master.after(0, self.load_images_from_results)
+    def post_gallery_reload(self):
+        # Safe to call from any thread. The local roots are rescanned on a worker (never on the Tk thread) and the
+        # gallery reloaded after; any number of reloads requested meanwhile run once.
+        with self.gallery_refresh_lock:
+            if self.gallery_refresh_pending:
+                return
+            self.gallery_refresh_pending = True
+        self.gallery_refresh_pool.submit(self._refresh_gallery)
+
+    def _refresh_gallery(self):
+        with self.gallery_refresh_lock:
+            self.gallery_refresh_pending = False
+        try:
+            self.library.scan_local()
+        except Exception as e:
+            print(f"Error scanning the library: {str(e)}")
+        self.events.post_once("gallery", self.load_images_from_results)
+
+    def begin_generation(self):
+        with self.generation_lock:
+            if self.is_generating:
+                return False
+            self.is_generating = True
+            return True
+
+    def end_generation(self):
+        with self.generation_lock:
+            self.is_generating = False
+        self.events.post(self.update_generate_button)
 
     def generate_image_keyboard(self):
         # Workaround: Erase the newline character added by the Enter key
@@ -89,20 +169,24 @@ class ImageGeneratorGUI:
         self.generate_image()
 
     def generate_image(self):
-        if self.is_generating:
+        if not self.begin_generation():
             return
 
-        self.is_generating = True
+        self.cancel_requested.clear()
+        self.refine_rejected.clear()
         self.update_generate_button()
 
         model = self.model_var.get()
         properties = self.get_properties()
+        use_draft = self.draft_var.get() and supports_draft(model, properties)
 
         self.output_text.config(state="normal")
         self.output_text.delete("1.0", tk.END)
         self.output_text.insert(tk.END, "Generating image...\n")
 
-        threading.Thread(target=self._generate_image_task, args=(model, properties)).start()
+        # Workers only get plain values; Tk variables are read here, on the main thread
+        face_image_path = self.face_image_path.get()
+        threading.Thread(target=self._generate_image_task, args=(model, properties, face_image_path, use_draft)).start()
 
     def get_properties(self):
         properties = {
@@ -139,7 +223,7 @@ class ImageGeneratorGUI:
         # Model selection
         ttk.Label(left_frame, text="Select Model:").grid(row=0, column=0, padx=10, pady=10, sticky="w")
         self.model_var = tk.StringVar(value="schnell")
-        self.model_combo = ttk.Combobox(left_frame, textvariable=self.model_var, values=["1.1-pro", "dev", "schnell"],
+        self.model_combo = ttk.Combobox(left_frame, textvariable=self.model_var, values=MODELS,
                                         state="readonly")
         self.model_combo.grid(row=0, column=1, padx=10, pady=10, sticky="we")
         self.model_combo.bind("<<ComboboxSelected>>", self.update_parameter_fields)
@@ -157,13 +241,30 @@ class ImageGeneratorGUI:
         self.generate_frame = ttk.Frame(left_frame)
         self.generate_frame.grid(row=3, column=0, columnspan=2, padx=10, pady=10, sticky="we")
 
+        # Render a quick schnell draft next to the full model, to judge the composition sooner
+        self.draft_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.generate_frame, text="Show a schnell draft first", variable=self.draft_var).pack(
+            fill=tk.X)
+
         # Generate button
         self.generate_button = ttk.Button(self.generate_frame, text="Generate Image", command=self.generate_image)
         self.generate_button.pack(fill=tk.X)
 
-        # Progress bar (initially hidden)
+        # Sweep button
+        self.sweep_button = ttk.Button(self.generate_frame, text="Parameter Sweep...", command=self.open_sweep_dialog)
+        self.sweep_button.pack(fill=tk.X)
+
+        # Latency history per model and parameter set
+        self.stats_button = ttk.Button(self.generate_frame, text="Latency Stats...", command=self.open_stats_window)
+        self.stats_button.pack(fill=tk.X)
+
+        # Progress bar, job status and cancel button (initially hidden)
         self.progress_bar = ttk.Progressbar(self.generate_frame, mode='indeterminate',
                                             style="red.Horizontal.TProgressbar")
+        self.job_status_label = ttk.Label(self.generate_frame, text="")
+        self.cancel_button = ttk.Button(self.generate_frame, text="Cancel", command=self.cancel_generation)
+        self.reject_draft_button = ttk.Button(self.generate_frame, text="Reject Draft (cancel refine)",
+                                              command=self.reject_draft)
 
         # Output
         self.output_text = tk.Text(left_frame, height=20, width=70, state="disabled")
@@ -176,127 +277,90 @@ class ImageGeneratorGUI:
         self.gallery_frame = ttk.Frame(main_frame)
         self.gallery_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
 
+    def setup_styles(self):
+        # Theme and styles are applied once; changing the theme restyles every widget in the application
+        style = ttk.Style()
+        if platform.system() == "Darwin":
+            style.theme_use("aqua")
+        elif platform.system() == "Windows":
+            style.theme_use("xpnative")
+        else:
+            style.theme_use("clam")
+        style.configure("Value.TLabel", anchor="e", width=6)
+        style.configure("Selected.TLabel", background="#4a90d9")
+        style.configure("Red.TButton", foreground="#FF7C8B")
+        style.configure("blue.Horizontal.TProgressbar", troughcolor='lightgray', background='blue')
+
     def initialize_variables(self):
-        self.common_vars = {
-            "aspect_ratio": tk.StringVar(value="16:9"),
-            "upscale": tk.BooleanVar(value=False),
-            "seed": tk.IntVar(value=random.randint(0, 2 ** 32 - 1)),
-            "randomize_seed": tk.BooleanVar(value=True),
-        }
+        variable_types = {int: tk.IntVar, float: tk.DoubleVar, bool: tk.BooleanVar, str: tk.StringVar}
 
-        self.default_values = {
-            "1.1-pro": {
-                "steps": 25,
-                "guidance": 3.0,
-                "interval": 2.0,
-                "safety_tolerance": 5,
-                "prompt_upsampling": True,
-            },
-            "dev": {
-                "guidance": 3.5,
-                "num_outputs": 1,
-                "output_quality": 80,
-                "prompt_strength": 0.8,
-                "num_inference_steps": 50,
-                "output_format": "jpg",
-                "disable_safety_checker": True,
-            },
-            "schnell": {
-                "num_outputs": 1,
-                "output_quality": 80,
-                "output_format": "jpg",
-                "disable_safety_checker": True,
-            }
-        }
+        self.common_vars = {}
+        for param, spec in COMMON_PARAMETERS.items():
+            value = random.randint(0, 2 ** 32 - 1) if param == "seed" else spec["default"]
+            self.common_vars[param] = variable_types[spec["type"]](value=value)
 
-        self.model_specific_vars = {
-            "1.1-pro": {
-                "steps": tk.IntVar(value=self.default_values["1.1-pro"]["steps"]),
-                "guidance": tk.DoubleVar(value=self.default_values["1.1-pro"]["guidance"]),
-                "interval": tk.DoubleVar(value=self.default_values["1.1-pro"]["interval"]),
-                "safety_tolerance": tk.IntVar(value=self.default_values["1.1-pro"]["safety_tolerance"]),
-            },
-            "dev": {
-                "image_path": tk.StringVar(),
-                "guidance": tk.DoubleVar(value=self.default_values["dev"]["guidance"]),
-                "num_outputs": tk.IntVar(value=self.default_values["dev"]["num_outputs"]),
-                "output_format": tk.StringVar(value=self.default_values["dev"]["output_format"]),
-                "output_quality": tk.IntVar(value=self.default_values["dev"]["output_quality"]),
-                "prompt_strength": tk.DoubleVar(value=self.default_values["dev"]["prompt_strength"]),
-                "num_inference_steps": tk.IntVar(value=self.default_values["dev"]["num_inference_steps"]),
-                "disable_safety_checker": tk.BooleanVar(value=self.default_values["dev"]["disable_safety_checker"]),
-            },
-            "schnell": {
-                "num_outputs": tk.IntVar(value=self.default_values["schnell"]["num_outputs"]),
-                "output_format": tk.StringVar(value=self.default_values["schnell"]["output_format"]),
-                "output_quality": tk.IntVar(value=self.default_values["schnell"]["output_quality"]),
-                "disable_safety_checker": tk.BooleanVar(value=self.default_values["schnell"]["disable_safety_checker"]),
-            }
-        }
+        self.default_values = default_values()
+        self.step_values = step_values()
 
-        self.step_values = {
-            "1.1-pro": {
-                "guidance": 0.1,
-                "steps": 1,
-                "interval": 0.1,
-                "safety_tolerance": 1,
-            },
-            "dev": {
-                "guidance": 0.1,
-                "num_outputs": 1,
-                "output_quality": 1,
-                "prompt_strength": 0.01,
-                "num_inference_steps": 1,
-            },
-            "schnell": {
-                "num_outputs": 1,
-                "output_quality": 1,
-            }
+        self.model_specific_vars = {
+            model: {param: variable_types[spec["type"]](value=spec["default"]) for param, spec in params.items()}
+            for model, params in MODEL_PARAMETERS.items()
         }
 
     def update_parameter_fields(self, event=None):
-        current_face_image_path = self.face_image_path.get()
-        for widget in self.param_frame.winfo_children():
-            widget.destroy()
-
-        self.sliders = {}
-
+        # Panels are built the first time a model is shown and only hidden/shown afterwards
         model = self.model_var.get()
-        self.create_common_fields()
-        self.create_model_specific_fields(model)
-        self.face_image_path.set(current_face_image_path)
+        if self.common_panel is None:
+            self.common_panel = self.create_common_fields()
+            self.common_panel.grid(row=0, column=0, sticky="we")
+        for other_model, (panel, _) in self.model_panels.items():
+            if other_model != model:
+                panel.grid_remove()
+        if model not in self.model_panels:
+            self.model_panels[model] = self.create_model_specific_fields(model)
+        panel, self.sliders = self.model_panels[model]
+        panel.grid(row=1, column=0, sticky="we")
 
     def browse_face_image(self):
         if filename := filedialog.askopenfilename(
             filetypes=[("Image files", "*.jpg *.jpeg *.png *.webp *.webm")]
         ):
             self.face_image_path.set(filename)
+            prefetch_image(filename, "face_source")
+
+    def create_panel(self):
+        panel = ttk.Frame(self.param_frame)
+        # Fixed label column so the common and model panels line up
+        panel.columnconfigure(0, minsize=160)
+        panel.columnconfigure(1, weight=1)
+        return panel
 
     def create_common_fields(self):
+        panel = self.create_panel()
         row = 0
-        for param, var in self.common_vars.items():
-            if param == "randomize_seed":
+        for param, spec in COMMON_PARAMETERS.items():
+            var = self.common_vars[param]
+            widget = spec["widget"]
+            if widget is None:
                 continue
-            if param == "upscale":
-                checkbutton = ttk.Checkbutton(self.param_frame, text="Upscale", variable=var)
+            if widget == "upscale":
+                checkbutton = ttk.Checkbutton(panel, text="Upscale", variable=var)
                 checkbutton.grid(row=row, column=0, columnspan=2, padx=5, pady=5, sticky="w")
-                ttk.Label(self.param_frame, text="Use Face From:").grid(row=row, column=0, padx=5, pady=5, sticky="w")
-                face_frame = ttk.Frame(self.param_frame)
+                row += 1
+                ttk.Label(panel, text="Use Face From:").grid(row=row, column=0, padx=5, pady=5, sticky="w")
+                face_frame = ttk.Frame(panel)
                 face_frame.grid(row=row, column=1, padx=5, pady=5, sticky="we")
                 face_entry = ttk.Entry(face_frame, textvariable=self.face_image_path)  # Use self.face_image_path
                 face_entry.pack(side=tk.LEFT, expand=True, fill=tk.X)
                 browse_button = ttk.Button(face_frame, text="Browse", command=self.browse_face_image)
                 browse_button.pack(side=tk.RIGHT)
-                row += 1
             else:
-                ttk.Label(self.param_frame, text=f"{param.replace('_', ' ').title()}:").grid(row=row, column=0, padx=5,
-                                                                                             pady=5, sticky="w")
-                if param == "aspect_ratio":
-                    ttk.Combobox(self.param_frame, textvariable=var,
-                                 values=["16:9", "21:9", "1:1", "2:3", "3:2", "4:5", "5:4", "9:16", "9:21"],
+                ttk.Label(panel, text=label_for(param)).grid(row=row, column=0, padx=5, pady=5, sticky="w")
+                if widget == "combo":
+                    ttk.Combobox(panel, textvariable=var, values=spec["values"],
                                  state="readonly").grid(row=row, column=1, padx=5, pady=5, sticky="we")
-                elif param == "seed":
-                    seed_frame = ttk.Frame(self.param_frame)
+                elif widget == "seed":
+                    seed_frame = ttk.Frame(panel)
                     seed_frame.grid(row=row, column=1, padx=5, pady=5, sticky="we")
 
                     seed_entry = ttk.Entry(seed_frame, textvariable=var)
@@ -307,118 +371,71 @@ class ImageGeneratorGUI:
                                                       variable=self.common_vars["randomize_seed"])
                     randomize_check.grid(row=0, column=1, padx=(5, 0))
                 else:
-                    ttk.Entry(self.param_frame, textvariable=var).grid(row=row, column=1, padx=5, pady=5, sticky="we")
+                    ttk.Entry(panel, textvariable=var).grid(row=row, column=1, padx=5, pady=5, sticky="we")
             row += 1
-
-    def create_model_specific_fields(self, model: str) -> None:
-        row = len(self.common_vars)
-        for param, var in self.model_specific_vars[model].items():
-            if param == "image_path":
-                ttk.Label(self.param_frame, text="Image Path:").grid(row=row, column=0, padx=5, pady=5, sticky="w")
-                entry = ttk.Entry(self.param_frame, textvariable=var)
+        return panel
+
+    def create_model_specific_fields(self, model: str):
+        panel = self.create_panel()
+        sliders = {}
+        for row, (param, spec) in enumerate(MODEL_PARAMETERS[model].items()):
+            var = self.model_specific_vars[model][param]
+            widget = spec["widget"]
+            if widget == "image_path":
+                ttk.Label(panel, text="Image Path:").grid(row=row, column=0, padx=5, pady=5, sticky="w")
+                entry = ttk.Entry(panel, textvariable=var)
                 entry.grid(row=row, column=1, padx=5, pady=5, sticky="we")
-                ttk.Button(self.param_frame, text="Browse", command=self.browse_image).grid(row=row, column=2, padx=5,
-                                                                                            pady=5)
-            elif param == "disable_safety_checker":
-                checkbutton = ttk.Checkbutton(self.param_frame, text="Disable Safety Checker", variable=var)
+                ttk.Button(panel, text="Browse", command=self.browse_image).grid(row=row, column=2, padx=5, pady=5)
+            elif widget == "check":
+                checkbutton = ttk.Checkbutton(panel, text=label_for(param).rstrip(":"), variable=var)
                 checkbutton.grid(row=row, column=0, columnspan=2, padx=5, pady=5, sticky="w")
-            elif param == "output_format":
-                ttk.Label(self.param_frame, text="Output Format:").grid(row=row, column=0, padx=5, pady=5, sticky="w")
-                format_combo = ttk.Combobox(self.param_frame, textvariable=var, values=["webp", "jpg", "png"],
-                                            state="readonly")
-                format_combo.grid(row=row, column=1, padx=5, pady=5, sticky="we")
-                format_combo.set(self.default_values[model]["output_format"])
+            elif widget == "combo":
+                ttk.Label(panel, text=label_for(param)).grid(row=row, column=0, padx=5, pady=5, sticky="w")
+                ttk.Combobox(panel, textvariable=var, values=spec["values"],
+                             state="readonly").grid(row=row, column=1, padx=5, pady=5, sticky="we")
+            elif widget == "slider":
+                ttk.Label(panel, text=label_for(param)).grid(row=row, column=0, padx=5, pady=5, sticky="w")
+                sliders[param] = self.create_slider(panel, row, var, spec)
             else:
-                ttk.Label(self.param_frame, text=f"{param.replace('_', ' ').title()}:").grid(row=row, column=0, padx=5,
-                                                                                             pady=5, sticky="w")
-                if param in ["guidance", "num_outputs", "output_quality", "prompt_strength", "num_inference_steps",
-                             "steps", "interval", "safety_tolerance"]:
-                    slider_frame = ttk.Frame(self.param_frame)
-                    slider_frame.grid(row=row, column=1, padx=5, pady=5, sticky="we")
-
-                    if model == "1.1-pro":
-                        if param == "guidance":
-                            min_val, max_val, step = 2, 5, 0.1
-                        elif param == "steps":
-                            min_val, max_val, step = 1, 50, 1
-                        elif param == "interval":
-                            min_val, max_val, step = 1, 4, 0.1
-                        elif param == "safety_tolerance":
-                            min_val, max_val, step = 1, 5, 1
-                    elif model == "dev":
-                        if param == "guidance":
-                            min_val, max_val, step = 0, 10, 0.1
-                        elif param == "num_outputs":
-                            min_val, max_val, step = 1, 4, 1
-                        elif param == "output_quality":
-                            min_val, max_val, step = 0, 100, 1
-                        elif param == "prompt_strength":
-                            min_val, max_val, step = 0, 1, 0.01
-                        elif param == "num_inference_steps":
-                            min_val, max_val, step = 1, 50, 1
-                    elif model == "schnell":
-                        if param == "num_outputs":
-                            min_val, max_val, step = 1, 4, 1
-                        elif param == "output_quality":
-                            min_val, max_val, step = 0, 100, 1
-
-                    style = ttk.Style()
-                    if platform.system() == "Darwin":
-                        style.theme_use("aqua")
-                    elif platform.system() == "Windows":
-                        style.theme_use("xpnative")
-                    else:
-                        style.theme_use("clam")
-                    style.configure("Value.TLabel", anchor="e", width=6)
-                    style.configure("blue.Horizontal.TProgressbar", troughcolor='lightgray', background='blue')
-
-                    format_string = ".2f" if step < 0.1 else (".1f" if step < 1 else "d")
-                    value_label = ttk.Label(slider_frame, text=f"{var.get():{format_string}}", style="Value.TLabel")
-                    value_label.grid(row=0, column=3, padx=(5, 0))
-
-                    def update_value(value, label, var, param_name):
-                        float_value = float(value)
-                        model = self.model_var.get()
-                        step_value = self.step_values[model].get(param_name, 1)
-                        if step_value >= 1:
-                            snapped_value = round(float_value)
-                        else:
-                            snapped_value = round(float_value / step_value) * step_value
-                        format_string = ".2f" if step_value < 0.1 else (".1f" if step_value < 1 else "d")
-                        var.set(snapped_value)
-                        label.config(text=f"{snapped_value:{format_string}}")
-                        return snapped_value
-
-                    def create_update_function(label, var, param_name):
-                        return lambda value: update_value(value, label, var, param_name)
-
-                    slider = ttk.Scale(
-                        slider_frame,
-                        from_=min_val,
-                        to=max_val,
-                        orient=tk.HORIZONTAL,
-                        command=create_update_function(value_label, var, param)
-                    )
-                    slider.grid(row=0, column=1, padx=5, sticky="we")
-                    self.sliders[param] = slider
-                    slider_frame.columnconfigure(1, weight=1)  # Make the slider expandable
-                    slider.set(update_value(var.get(), value_label, var, param))  # Set initial value
-
-                    def reset_slider(event, s=slider, label=value_label, value=var, m=model, p=param):
-                        default_value = self.default_values[m].get(p, value.get())
-                        s.set(update_value(default_value, label, value, p))
-
-                    value_label.bind("<Button-1>", reset_slider)
-                else:
-                    entry = ttk.Entry(self.param_frame, textvariable=var)
-                    entry.grid(row=row, column=1, padx=5, pady=5, sticky="we")
-            row += 1
+                ttk.Label(panel, text=label_for(param)).grid(row=row, column=0, padx=5, pady=5, sticky="w")
+                ttk.Entry(panel, textvariable=var).grid(row=row, column=1, padx=5, pady=5, sticky="we")
+        return panel, sliders
+
+    def create_slider(self, panel, row, var, spec):
+        slider_frame = ttk.Frame(panel)
+        slider_frame.grid(row=row, column=1, padx=5, pady=5, sticky="we")
+
+        step = spec["step"]
+        format_string = format_for_step(step)
+        value_label = ttk.Label(slider_frame, text=f"{var.get():{format_string}}", style="Value.TLabel")
+        value_label.grid(row=0, column=3, padx=(5, 0))
+
+        def update_value(value):
+            float_value = float(value)
+            if step >= 1:
+                snapped_value = round(float_value)
+            else:
+                snapped_value = round(float_value / step) * step
+            var.set(snapped_value)
+            value_label.config(text=f"{snapped_value:{format_string}}")
+            return snapped_value
+
+        slider = ttk.Scale(slider_frame, from_=spec["min"], to=spec["max"], orient=tk.HORIZONTAL,
+                           command=update_value)
+        slider.grid(row=0, column=1, padx=5, sticky="we")
+        slider_frame.columnconfigure(1, weight=1)  # Make the slider expandable
+        slider.set(update_value(var.get()))  # Set initial value
+
+        # Clicking the value resets the slider to its default
+        value_label.bind("<Button-1>", lambda event: slider.set(update_value(spec["default"])))
+        return slider
 
     def browse_image(self):
         if filename := tk.filedialog.askopenfilename(
                 filetypes=[("Image files", "*.jpg *.jpeg *.png *.webm *.webp")]
         ):
             self.model_specific_vars["dev"]["image_path"].set(filename)
+            prefetch_image(filename, "img2img")
 
     def show_loading_screen(self):
         # Get the position and size of the output text box
@@ -446,64 +463,108 @@ class ImageGeneratorGUI:
         loading_screen.update_idletasks()
         return loading_screen
 
-    def _generate_image_task(self, model, properties):
+    @profiled("generate_image_task")
+    def _generate_image_task(self, model, properties, face_image_path, use_draft=False):
         try:
-            output, current_time, results_dir = generate_image(model, properties)
-            processed_images = process_generated_images(output, current_time, results_dir, properties, model)
-
-            # Perform face swap if a face image is specified
-            face_image_path = self.face_image_path.get()
-            if face_image_path:
-                for image in processed_images:
-                    response = face_swap(face_image_path, image['file_name'])
-                    if response and response.get('code') == 200:
-                        swapped_output = response['image']
-                        # Download and save the face-swapped image
-                        img_response = requests.get(swapped_output)
-                        if img_response.status_code == 200:
-                            # Save the face-swapped image temporarily
-                            temp_file = f"{image['file_name']}_temp.jpg"
-                            with open(temp_file, 'wb') as f:
-                                f.write(img_response.content)
-
-                            # Create EXIF metadata with original properties
-                            exif_dict = create_exif_metadata(properties, model)
-
-                            # Add face_swapped flag to the metadata
-                            metadata = json.loads(
-                                piexif.helper.UserComment.load(exif_dict["Exif"][piexif.ExifIFD.UserComment]))
-                            metadata["face_swapped"] = True
-                            exif_dict["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(
-                                json.dumps(metadata))
-
-                            exif_bytes = piexif.dump(exif_dict)
-
-                            # Open the temporary image, add EXIF, and save it to the original filename
-                            with Image.open(temp_file) as img:
-                                img.save(image['file_name'], exif=exif_bytes, quality=95)
-
-                            # Remove the temporary file
-                            os.remove(temp_file)
-
-                            image['face_swapped'] = True
-                        else:
-                            image['face_swapped'] = False
-                    else:
-                        image['face_swapped'] = False
-
-            self.master.after(0, lambda: self.update_output_text(processed_images))
-            self.master.after(0, self.load_images_from_results)
+            def on_image(image):
+                # Runs in a worker thread as soon as this output is through the pipeline; the others carry on
+                self.events.post(self.update_output_text, [image])
+                self.post_gallery_reload()
+
+            pipeline = GENERATION_PIPELINE.with_stage(face_swap_stage(face_image_path)) if face_image_path else None
+            if use_draft:
+                generate_with_draft(model, properties, self.register_job, self.register_refine_job,
+                                    self.on_draft_ready, on_image, pipeline)
+            else:
+                output, current_time, results_dir = generate_image(model, properties, self.register_job)
+                process_generated_images(output, current_time, results_dir, properties, model, on_image=on_image,
+                                         pipeline=pipeline)
+
+        except PredictionCancelled:
+            if self.refine_rejected.is_set() and not self.cancel_requested.is_set():
+                self.post_output("Refine cancelled, the draft was kept.\n")
+            else:
+                self.post_output("Generation cancelled.\n")
 
         except Exception as e:
-            error_message = f"Error: {str(e)}\n"
-            self.master.after(0, lambda: self.output_text.insert(tk.END, error_message))
+            self.post_output(f"Error: {str(e)}\n")
 
         finally:
-            self.is_generating = False
-            self.master.after(0, self.update_generate_button)
+            self.finish_jobs()
+            self.end_generation()
+
+    def on_draft_ready(self, images):
+        # Called from the draft's worker thread while the refine is still running
+        for image in images:
+            self.post_output(f"Draft preview: {image['file_name']}\n")
+        self.post_gallery_reload()
+        self.events.post(self.show_reject_draft_button)
+
+    def show_reject_draft_button(self):
+        if self.is_generating and not self.refine_rejected.is_set():
+            self.reject_draft_button.pack(fill=tk.X)
+
+    def register_refine_job(self, job):
+        self.register_job(job)
+        with self.jobs_lock:
+            self.refine_jobs.append(job)
+        if self.refine_rejected.is_set():
+            job.cancel()
+
+    def reject_draft(self):
+        self.refine_rejected.set()
+        with self.jobs_lock:
+            jobs = list(self.refine_jobs)
+        for job in jobs:
+            job.cancel()
+        self.reject_draft_button.pack_forget()
+        self.job_status_label.config(text="Cancelling refine...")
+
+    def register_job(self, job):
+        # Called from worker threads right before a prediction is created
+        with self.jobs_lock:
+            self.active_jobs.append(job)
+        if self.cancel_requested.is_set():
+            job.cancel()
+
+    def finish_jobs(self):
+        with self.jobs_lock:
+            self.active_jobs = []
+            self.refine_jobs = []
+
+    def cancel_generation(self):
+        self.cancel_requested.set()
+        with self.jobs_lock:
+            jobs = list(self.active_jobs)
+        for job in jobs:
+            job.cancel()
+        self.job_status_label.config(text="Cancelling...")
+
+    def poll_job_progress(self):
+        self.progress_poll = None
+        if not self.is_generating:
+            return
+        with self.jobs_lock:
+            jobs = [job for job in self.active_jobs if job.status not in ("pending", "canceled")]
+        progresses = [job.progress for job in jobs if job.progress is not None]
+        if progresses:
+            if str(self.progress_bar.cget("mode")) != "determinate":
+                self.progress_bar.stop()
+                self.progress_bar.config(mode="determinate", maximum=100)
+            # Jobs that haven't reported any steps yet count as 0%
+            self.progress_bar["value"] = sum(progresses) / len(jobs)
+        if not self.cancel_requested.is_set() and jobs:
+            statuses = ", ".join(sorted({job.status for job in jobs}))
+            percent = f" {self.progress_bar['value']:.0f}%" if progresses else ""
+            self.job_status_label.config(text=f"{len(jobs)} job(s) {statuses}{percent}")
+        self.progress_poll = self.master.after(250, self.poll_job_progress)
+
     def update_output_text(self, processed_images):
+        self.output_text.config(state="normal")
         for image in processed_images:
             self.output_text.insert(tk.END, f"Saved image: {image['file_name']}\n")
+            if image.get('duplicate_of'):
+                self.output_text.insert(tk.END, f"Near-duplicate of {image['duplicate_of']}.\n")
             if image.get('face_swapped'):
                 self.output_text.insert(tk.END, "Face swap applied successfully.\n")
             elif 'face_swapped' in image:
@@ -513,15 +574,135 @@ class ImageGeneratorGUI:
             else:
                 self.output_text.insert(tk.END, "Done.\n")
 
+    def open_sweep_dialog(self):
+        if self.is_generating:
+            return
+
+        model = self.model_var.get()
+        params = [p for p in list(self.common_vars) + list(self.model_specific_vars[model])
+                  if p in SWEEPABLE_PARAMETERS]
+
+        dialog = tk.Toplevel(self.master)
+        dialog.title("Parameter Sweep")
+
+        ttk.Label(dialog, text="Values as a list (1, 2, 3) or an inclusive range (start:stop:step).\n"
+                               "Leave a field empty to use the current value.").grid(
+            row=0, column=0, columnspan=3, padx=10, pady=10, sticky="w")
+
+        entries = {}
+        for row, param in enumerate(params, start=1):
+            current = self.common_vars[param].get() if param in self.common_vars \
+                else self.model_specific_vars[model][param].get()
+            ttk.Label(dialog, text=f"{param.replace('_', ' ').title()}:").grid(row=row, column=0, padx=5, pady=5,
+                                                                               sticky="w")
+            entries[param] = ttk.Entry(dialog, width=30)
+            entries[param].grid(row=row, column=1, padx=5, pady=5, sticky="we")
+            ttk.Label(dialog, text=f"current: {current}").grid(row=row, column=2, padx=5, pady=5, sticky="w")
+
+        row = len(params) + 1
+        ttk.Label(dialog, text="Concurrency:").grid(row=row, column=0, padx=5, pady=5, sticky="w")
+        concurrency_var = tk.IntVar(value=DEFAULT_SWEEP_CONCURRENCY)
+        ttk.Spinbox(dialog, from_=1, to=16, textvariable=concurrency_var, width=5).grid(row=row, column=1, padx=5,
+                                                                                        pady=5, sticky="w")
+
+        def start():
+            try:
+                axes = {}
+                for param, entry in entries.items():
+                    if values := parse_sweep_values(entry.get(), SWEEPABLE_PARAMETERS[param]):
+                        axes[param] = values
+            except ValueError as e:
+                tk.messagebox.showerror("Invalid Sweep", str(e), parent=dialog)
+                return
+            if not axes:
+                tk.messagebox.showerror("Invalid Sweep", "Enter values for at least one parameter.", parent=dialog)
+                return
+            cells = count_cells(axes)
+            if cells > 100 and not tk.messagebox.askyesno(
+                    "Large Sweep", f"This sweep will generate {cells} images. Continue?", parent=dialog):
+                return
+            dialog.destroy()
+            self.start_sweep(model, axes, concurrency_var.get())
+
+        ttk.Button(dialog, text="Run Sweep", command=start).grid(row=row + 1, column=0, columnspan=3, padx=10,
+                                                                  pady=10, sticky="we")
+
+    def open_stats_window(self):
+        window = tk.Toplevel(self.master)
+        window.title("Latency Stats")
+        text = tk.Text(window, width=100, height=30)
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        try:
+            lines = format_summary(get_analytics().summary())
+        except Exception as e:
+            lines = [f"Error reading analytics: {str(e)}"]
+        text.insert(tk.END, "\n".join(lines))
+        text.config(state="disabled")
+
+    def start_sweep(self, model, axes, max_workers):
+        if not self.begin_generation():
+            return
+
+        self.cancel_requested.clear()
+        self.update_generate_button()
+
+        properties = self.get_properties()
+        # Seeds are fixed across the grid unless the seed itself is being swept
+        properties.pop("randomize_seed", None)
+
+        self.output_text.config(state="normal")
+        self.output_text.delete("1.0", tk.END)
+        self.output_text.insert(tk.END, f"Running sweep of {count_cells(axes)} images over {', '.join(axes)}...\n")
+
+        threading.Thread(target=self._sweep_task, args=(model, properties, axes, max_workers)).start()
+
+    def _sweep_task(self, model, properties, axes, max_workers):
+        def on_cell_done(result, done, total):
+            coords = ", ".join(f"{k}={v}" for k, v in result["coords"].items())
+            if self.cancel_requested.is_set() and not result["images"]:
+                message = f"[{done}/{total}] {coords}: Cancelled\n"
+            elif result["error"]:
+                message = f"[{done}/{total}] {coords}: Error: {result['error']}\n"
+            else:
+                files = ", ".join(image["file_name"] for image in result["images"])
+                message = f"[{done}/{total}] {coords}: {files}\n"
+            self.post_output(message)
+            self.post_gallery_reload()
+
+        try:
+            sweep_id, results = run_sweep(model, properties, axes, max_workers, on_cell_done, self.register_job)
+            failed = sum(1 for result in results if result["error"])
+            self.post_output(f"Sweep {sweep_id} finished: {len(results) - failed} succeeded, {failed} failed.\n")
+        except Exception as e:
+            self.post_output(f"Error: {str(e)}\n")
+        finally:
+            self.finish_jobs()
+            self.end_generation()
+
     def update_generate_button(self):
+        if self.progress_poll is not None:
+            self.master.after_cancel(self.progress_poll)
+            self.progress_poll = None
         if self.is_generating:
             self.generate_button.pack_forget()
+            self.sweep_button.pack_forget()
+            self.stats_button.pack_forget()
+            self.progress_bar.config(mode="indeterminate", value=0)
             self.progress_bar.pack(fill=tk.X)
-            self.progress_bar.start(10)  # Start the progress bar animation
+            self.progress_bar.start(10)  # Animate until the model reports step progress
+            self.job_status_label.config(text="Starting...")
+            self.job_status_label.pack(fill=tk.X)
+            self.cancel_button.pack(fill=tk.X)
+            self.progress_poll = self.master.after(250, self.poll_job_progress)
         else:
             self.progress_bar.stop()  # Stop the progress bar animation
             self.progress_bar.pack_forget()
+            self.job_status_label.pack_forget()
+            self.cancel_button.pack_forget()
+            self.reject_draft_button.pack_forget()
             self.generate_button.pack(fill=tk.X)
+            self.sweep_button.pack(fill=tk.X)
+            self.stats_button.pack(fill=tk.X)
         self.master.update_idletasks()
 
     def setup_keyboard_shortcuts(self):
@@ -534,6 +715,8 @@ class ImageGeneratorGUI:
         self.prompt_text.bind("<Shift-Tab>", focus_previous_widget)
 
     def create_gallery(self):
+        self.create_batch_toolbar()
+
         # Create a notebook widget
         self.gallery_notebook = ttk.Notebook(self.gallery_frame)
         self.gallery_notebook.pack(fill=tk.BOTH, expand=True)
@@ -549,14 +732,11 @@ class ImageGeneratorGUI:
         # Add a vertical scrollbar
         self.gallery_scrollbar = ttk.Scrollbar(self.gallery_tab, orient="vertical", command=self.gallery_canvas.yview)
         self.gallery_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.gallery_canvas.configure(yscrollcommand=self.gallery_scrollbar.set)
-
-        # Create a frame inside the canvas to hold the images
-        self.gallery_images_frame = ttk.Frame(self.gallery_canvas)
-        self.gallery_canvas.create_window((0, 0), window=self.gallery_images_frame, anchor=tk.NW)
+        self.gallery_canvas.configure(yscrollcommand=self.on_gallery_scroll)
 
-        # Configure the canvas to update its scroll region when the size of the frame changes
-        self.gallery_images_frame.bind("<Configure>", self.on_frame_configure)
+        # Thumbnail widgets are created for the rows that come into view and destroyed when they leave it
+        self.gallery_canvas.bind("<Configure>", lambda event: self.update_visible_thumbnails())
+        self.gallery_placeholder = tk.PhotoImage(width=GALLERY_THUMBNAIL_SIZE, height=GALLERY_THUMBNAIL_SIZE)
 
         # Bind mousewheel event to the canvas
         self.gallery_canvas.bind("<MouseWheel>", self._on_mousewheel)
@@ -566,12 +746,149 @@ class ImageGeneratorGUI:
         # Load initial images
         self.load_images_from_results()
 
+        # Bring the perceptual hash index up to date without blocking startup
+        threading.Thread(target=get_index(get_output_directory()).sync, daemon=True).start()
+
     def _on_mousewheel(self, event):
         if event.num == 4 or event.delta > 0:
             self.gallery_canvas.yview_scroll(-1, "units")
         elif event.num == 5 or event.delta < 0:
             self.gallery_canvas.yview_scroll(1, "units")
 
+    def create_batch_toolbar(self):
+        # Actions on the images selected with Ctrl+click / Shift+click in the gallery
+        toolbar = ttk.Frame(self.gallery_frame)
+        toolbar.pack(side=tk.TOP, fill=tk.X)
+        self.batch_label = ttk.Label(toolbar, text="Ctrl/Shift+click to select")
+        self.batch_label.pack(side=tk.LEFT, padx=5)
+        self.batch_buttons = [
+            ttk.Button(toolbar, text="🗑️ Delete", style="Red.TButton", command=self.batch_delete),
+            ttk.Button(toolbar, text="🏷️ Tag", command=self.batch_retag),
+            ttk.Button(toolbar, text="🎭 Face Swap", command=self.batch_face_swap),
+            ttk.Button(toolbar, text="🔍 Upscale", command=self.batch_upscale),
+            ttk.Button(toolbar, text="Clear", command=self.clear_selection),
+            ttk.Button(toolbar, text="All", command=self.select_all),
+        ]
+        for button in self.batch_buttons:
+            button.pack(side=tk.RIGHT, padx=2)
+        self.batch_cancel_button = ttk.Button(toolbar, text="Cancel", command=self.batch_cancelled.set)
+        self.batch_progress = ttk.Progressbar(toolbar, mode="determinate", length=120)
+        self.update_batch_toolbar()
+
+    def update_batch_toolbar(self):
+        if self.batch_running:
+            return
+        count = len(self.selected_paths)
+        self.batch_label.config(text=f"{count} selected" if count else "Ctrl/Shift+click to select")
+        for button in self.batch_buttons[:4]:
+            button.config(state=tk.NORMAL if count else tk.DISABLED)
+
+    def toggle_selection(self, img_path):
+        if img_path in self.selected_paths:
+            self.selected_paths.discard(img_path)
+        else:
+            self.selected_paths.add(img_path)
+        self.selection_anchor = img_path
+        self.refresh_selection([img_path])
+
+    def select_range(self, img_path):
+        # Everything between the last clicked image and this one, in gallery order
+        if self.selection_anchor not in self.gallery_image_paths:
+            self.toggle_selection(img_path)
+            return
+        start = self.gallery_image_paths.index(self.selection_anchor)
+        end = self.gallery_image_paths.index(img_path)
+        paths = self.gallery_image_paths[min(start, end):max(start, end) + 1]
+        self.selected_paths.update(paths)
+        self.refresh_selection(paths)
+
+    def select_all(self):
+        self.selected_paths = set(self.gallery_image_paths)
+        self.refresh_selection(self.gallery_image_paths)
+
+    def clear_selection(self):
+        paths = list(self.selected_paths)
+        self.selected_paths.clear()
+        self.refresh_selection(paths)
+
+    def refresh_selection(self, paths):
+        for path in paths:
+            if label := self.gallery_labels.get(path):
+                label.config(style="Selected.TLabel" if path in self.selected_paths else "TLabel")
+        self.update_batch_toolbar()
+
+    def batch_upscale(self):
+        engine = self.common_vars["upscale_engine"].get()
+        self.start_batch("Upscale", lambda path: upscale_and_save(path, engine))
+
+    def batch_face_swap(self):
+        if not (face_image_path := self.face_image_path.get()):
+            tk.messagebox.showinfo("Face Swap", "Choose a face image first.")
+            return
+        # Prepared once here, every item reuses the cached result
+        prefetch_image(face_image_path, "face_source")
+        self.start_batch("Face swap", lambda path: face_swap_and_save(path, face_image_path))
+
+    def batch_retag(self):
+        text = simpledialog.askstring("Tag", "Tags, comma separated (prefix with - to remove):",
+                                      parent=self.master)
+        if not text:
+            return
+        add, remove = parse_tags(text)
+        self.start_batch("Tag", lambda path: retag(path, add, remove))
+
+    def batch_delete(self):
+        count = len(self.selected_paths)
+        if tk.messagebox.askyesno("Delete Images", f"Are you sure you want to delete {count} image(s)?"):
+            self.start_batch("Delete", delete_file)
+
+    def start_batch(self, name, action):
+        if self.batch_running or not self.selected_paths:
+            return
+        # Gallery order, newest first, so progress follows what the user sees
+        paths = [path for path in self.gallery_image_paths if path in self.selected_paths]
+        self.batch_running = True
+        self.batch_cancelled.clear()
+        for button in self.batch_buttons:
+            button.config(state=tk.DISABLED)
+        self.batch_label.config(text=f"{name} 0/{len(paths)}")
+        self.batch_progress.config(maximum=len(paths), value=0)
+        self.batch_progress.pack(side=tk.LEFT, padx=5)
+        self.batch_cancel_button.pack(side=tk.LEFT, padx=2)
+        self.append_output(f"{name}: {len(paths)} image(s)...\n")
+        threading.Thread(target=self._batch_task, args=(name, action, paths), daemon=True).start()
+
+    def _batch_task(self, name, action, paths):
+        failed = []
+
+        def on_item_done(item, done, total):
+            if item["error"] and item["error"] != "cancelled":
+                failed.append(item)
+                self.post_output(f"{name} failed for {item['path']}: {item['error']}\n")
+            elif item["result"]:
+                self.post_output(f"{name}: {item['path']} -> {item['result']}\n")
+            self.events.post(self.update_batch_progress, name, done, total, len(failed))
+            self.post_gallery_reload()
+
+        results = run_batch(action, paths, on_item_done, self.batch_cancelled)
+        skipped = sum(1 for item in results if item["error"] == "cancelled")
+        summary = f"{name} finished: {len(results) - len(failed) - skipped} done, {len(failed)} failed"
+        self.post_output(summary + (f", {skipped} cancelled.\n" if skipped else ".\n"))
+        self.events.post(self.finish_batch)
+
+    def update_batch_progress(self, name, done, total, failed):
+        self.batch_progress["value"] = done
+        self.batch_label.config(text=f"{name} {done}/{total}" + (f" ({failed} failed)" if failed else ""))
+
+    def finish_batch(self):
+        self.batch_running = False
+        self.batch_progress.pack_forget()
+        self.batch_cancel_button.pack_forget()
+        for button in self.batch_buttons:
+            button.config(state=tk.NORMAL)
+        self.selected_paths = {path for path in self.selected_paths if os.path.exists(path)}
+        self.update_batch_toolbar()
+
     def _bind_mousewheel(self, widget):
         # Bind mousewheel event to the widget
         widget.bind("<MouseWheel>", self._on_mousewheel)
@@ -588,236 +905,163 @@ class ImageGeneratorGUI:
         self.gallery_canvas.unbind_all("<Button-4>")
         self.gallery_canvas.unbind_all("<Button-5>")
 
-    def on_frame_configure(self, event):
-        self.gallery_canvas.configure(scrollregion=self.gallery_canvas.bbox("all"))
+    def on_gallery_scroll(self, first, last):
+        self.gallery_scrollbar.set(first, last)
+        self.update_visible_thumbnails()
 
+    @profiled("load_images_from_results")
     def load_images_from_results(self):
-        results_folder = "results"
-        if not os.path.exists(results_folder):
-            return
+        # Every library root, newest first, as their indexes know them; nothing here reads the disk
+        entries = self.library.images()
 
-        # Get list of image files, sorted by modification time (newest first)
-        image_files = sorted(
-            [f for f in os.listdir(results_folder) if
-             f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'))],
-            key=lambda x: os.path.getmtime(os.path.join(results_folder, x)),
-            reverse=True
-        )
-
-        # Clear existing images
-        for widget in self.gallery_images_frame.winfo_children():
-            widget.destroy()
-
-        row, col = 0, 0
-        for img_file in image_files:
-            img_path = os.path.join(results_folder, img_file)
-            self.add_image_to_gallery(img_path, row, col)
-            col += 1
-            if col == 3:  # Move to next row after 3 columns
-                col = 0
-                row += 1
+        # Gallery order, used by the viewer for next/previous navigation
+        self.gallery_image_paths = [entry["path"] for entry in entries]
+        self.gallery_mtimes = {entry["path"]: entry["mtime"] for entry in entries}
+        if not self.batch_running:
+            self.selected_paths &= set(self.gallery_image_paths)
 
-        self.gallery_images_frame.update_idletasks()
-        self.gallery_canvas.config(scrollregion=self.gallery_canvas.bbox("all"))
+        self._clear_gallery()
+        rows = -(-len(self.gallery_image_paths) // GALLERY_COLUMNS)
+        self.gallery_canvas.config(scrollregion=(0, 0, GALLERY_COLUMNS * GALLERY_CELL, rows * GALLERY_CELL))
+        self.update_visible_thumbnails()
 
     def _clear_gallery(self):
-        for widget in self.gallery_images_frame.winfo_children():
-            widget.destroy()
-
-    def _update_gallery_scrollregion(self):
-        self.gallery_images_frame.update_idletasks()
-        self.gallery_canvas.config(scrollregion=self.gallery_canvas.bbox("all"))
+        for label in self.gallery_labels.values():
+            label.destroy()
+        self.gallery_canvas.delete("thumbnail")
+        self.gallery_labels = {}
+        self.gallery_windows = {}
+
+    def update_visible_thumbnails(self):
+        top = self.gallery_canvas.canvasy(0)
+        first_row = max(0, int(top // GALLERY_CELL) - GALLERY_OVERSCAN_ROWS)
+        last_row = int((top + self.gallery_canvas.winfo_height()) // GALLERY_CELL) + GALLERY_OVERSCAN_ROWS
+        first = first_row * GALLERY_COLUMNS
+        visible = self.gallery_image_paths[first:(last_row + 1) * GALLERY_COLUMNS]
+
+        visible_paths = set(visible)
+        for img_path in [path for path in self.gallery_labels if path not in visible_paths]:
+            self.gallery_labels.pop(img_path).destroy()
+            self.gallery_canvas.delete(self.gallery_windows.pop(img_path))
+        for index, img_path in enumerate(visible, first):
+            if img_path not in self.gallery_labels:
+                self.add_image_to_gallery(img_path, index // GALLERY_COLUMNS, index % GALLERY_COLUMNS)
 
     def add_image_to_gallery(self, img_path, row, col):
-        try:
-            # Open the image and create a thumbnail
-            with Image.open(img_path) as img:
-                img.thumbnail((100, 100))  # Resize image to fit in the gallery
-                photo = ImageTk.PhotoImage(img)
-
-            # Create a label with the image and add it to the gallery
-            label = ttk.Label(self.gallery_images_frame, image=photo)
-            label.image = photo  # Keep a reference to prevent garbage collection
-            label.grid(row=row, column=col, padx=5, pady=5)
-
-            # Bind click event to open full-size image
-            label.bind("<Button-1>", lambda e, path=img_path: self.open_full_size_image(path))
+        # Shows the cached thumbnail, or a blank one until the thumbnail worker has read the image
+        key = (img_path, self.gallery_mtimes.get(img_path))
+        photo = self.thumbnail_photos.get(key)
+        if photo is None:
+            self.request_thumbnail(key)
+
+        # Create a label with the image and add it to the gallery
+        style = "Selected.TLabel" if img_path in self.selected_paths else "TLabel"
+        label = ttk.Label(self.gallery_canvas, image=photo or self.gallery_placeholder, style=style, padding=3)
+        label.image = photo  # Keep a reference to prevent garbage collection
+        self.gallery_windows[img_path] = self.gallery_canvas.create_window(
+            col * GALLERY_CELL + GALLERY_CELL // 2, row * GALLERY_CELL + GALLERY_CELL // 2, window=label,
+            tags="thumbnail")
+        self.gallery_labels[img_path] = label
+
+        # Click opens the full-size image, Ctrl/Cmd+click and Shift+click select for batch actions
+        label.bind("<Button-1>", lambda e, path=img_path: self.open_full_size_image(path))
+        label.bind("<Control-Button-1>", lambda e, path=img_path: self.toggle_selection(path))
+        label.bind("<Command-Button-1>", lambda e, path=img_path: self.toggle_selection(path))
+        label.bind("<Shift-Button-1>", lambda e, path=img_path: self.select_range(path))
+
+        # Bind mousewheel event to the label
+        self._bind_mousewheel(label)
+
+    def request_thumbnail(self, key):
+        if key in self.thumbnail_pending:
+            return
+        self.thumbnail_pending.add(key)
+        self.thumbnail_pool.submit(self._load_thumbnail, key)
 
-            # Bind mousewheel event to the label
-            self._bind_mousewheel(label)
+    def _load_thumbnail(self, key):
+        # Runs on a worker, so a slow (network) root never blocks the UI; PhotoImages can only be made on the Tk thread
+        img_path = key[0]
+        try:
+            thumbnail = load_thumbnail(img_path, GALLERY_THUMBNAIL_SIZE)
         except Exception as e:
+            # Stays pending, so an unreadable image isn't retried until it changes
             print(f"Error adding image to gallery: {img_path}")
             print(f"Error details: {str(e)}")
-
+            return
+        self.events.post(self.show_thumbnail, key, thumbnail)
+
+    def show_thumbnail(self, key, thumbnail):
+        self.thumbnail_pending.discard(key)
+        photo = ImageTk.PhotoImage(thumbnail)
+        self.thumbnail_photos.put(key, photo, thumbnail.width * thumbnail.height * 4)
+        label = self.gallery_labels.get(key[0])
+        if label is not None and self.gallery_mtimes.get(key[0]) == key[1]:
+            label.config(image=photo)
+            label.image = photo
+
+    @profiled("open_full_size_image")
     def open_full_size_image(self, img_path):
-        # Open the full-size image in a new window
-        top = tk.Toplevel(self.master)
-        top.title("Full Size Image")
-
-        # Create a main frame to hold everything
-        main_frame = ttk.Frame(top)
-        main_frame.pack(fill=tk.BOTH, expand=True)
-
-        # Create a canvas to hold the image
-        canvas = tk.Canvas(main_frame)
-        canvas.pack(fill=tk.BOTH, expand=True)
-
-        # Open the image and store it in memory
-        with Image.open(img_path) as img:
-            self.full_size_image = img.copy()
-
-        # Create a frame to hold the text widget and buttons
-        control_frame = ttk.Frame(main_frame)
-        control_frame.pack(fill=tk.X, expand=False, side=tk.BOTTOM)
-
-        # Variables for delayed resizing
-        resize_timer = None
-        last_resize_time = 0
-        resize_delay = 200  # milliseconds
-
-        # Function to resize the image
-        def resize_image():
-            nonlocal last_resize_time
-            current_time = time.time() * 1000  # Convert to milliseconds
-            if current_time - last_resize_time < resize_delay:
-                return
+        return ImageViewer(self, img_path)
+
+    def show_similar_images(self, img_path):
+        def search():
+            index = get_index(os.path.dirname(img_path) or ".")
+            index.sync()
+            similar = []
+            for path, distance in index.search(img_path):
+                try:
+                    similar.append((path, distance, load_thumbnail(path, GALLERY_THUMBNAIL_SIZE)))
+                except Exception as e:
+                    print(f"Error loading similar image {path}: {str(e)}")
+            self.events.post(self._open_similar_window, img_path, similar)
+
+        threading.Thread(target=search, daemon=True).start()
+
+    def _open_similar_window(self, img_path, similar):
+        if not similar:
+            tk.messagebox.showinfo("Similar Images", "No similar images found.")
+            return
 
-            # Get the current window size
-            window_width = top.winfo_width()
-            window_height = top.winfo_height()
-            control_height = control_frame.winfo_height()
-
-            # Check if the window size is valid
-            if window_width <= 1 or window_height <= 1:
-                return  # Skip resizing if the window is too small
-
-            # Calculate the scaling factor
-            img_width, img_height = self.full_size_image.size
-            available_height = window_height - control_height
-            scale = min(window_width / img_width, available_height / img_height)
-
-            # Resize the image
-            new_width = max(1, int(img_width * scale))
-            new_height = max(1, int(img_height * scale))
-            resized_img = self.full_size_image.copy().resize((new_width, new_height), Image.LANCZOS)
-
-            # Create a PhotoImage object
-            photo = ImageTk.PhotoImage(resized_img)
-
-            # Update the canvas
-            canvas.delete("all")
-            canvas.create_image(window_width // 2, available_height // 2, anchor=tk.CENTER, image=photo)
-            canvas.image = photo  # Keep a reference
-
-            last_resize_time = current_time
-
-        # Function to schedule delayed resize
-        def schedule_resize(event=None):
-            nonlocal resize_timer
-            if resize_timer is not None:
-                top.after_cancel(resize_timer)
-            resize_timer = top.after(resize_delay, resize_image)
-
-        # Read metadata from EXIF
-        metadata = read_image_metadata(img_path)
-        if metadata:
-            # Create a text widget to display metadata
-            text_widget = tk.Text(control_frame, height=10, wrap=tk.WORD)
-            text_widget.pack(side=tk.LEFT, fill=tk.X, expand=True)
-            text_widget.insert(tk.END, json.dumps(metadata, indent=2))
-            text_widget.config(state=tk.DISABLED)  # Make it read-only
-
-            # Create a frame for buttons
-            button_frame = ttk.Frame(control_frame)
-            button_frame.pack(side=tk.RIGHT, fill=tk.Y)
-
-            # Create a button to set widgets according to EXIF data
-            set_widgets_button = ttk.Button(button_frame, text="🔧 Set Widgets",
-                                            command=lambda: self.set_widgets_and_close(metadata, top))
-            set_widgets_button.pack(side=tk.TOP, padx=5, pady=5)
-
-            # Create an Upscale button
-            upscale_button = ttk.Button(button_frame, text="🔍 Upscale",
-                                        command=lambda: self.upscale_image(img_path, metadata, top))
-            upscale_button.pack(side=tk.TOP, padx=5, pady=5)
-
-            # Create a Face Swap button
-            add_face_swap_button(button_frame, img_path, "results", self.load_images_from_results)
-
-            # Create a button to copy the image to clipboard
-            copy_button = ttk.Button(button_frame, text="📋 Clipboard",
-                                     command=lambda: copy_image_to_clipboard(img_path))
-            copy_button.pack(side=tk.TOP, padx=2, pady=2)
-
-            # Create a button to open image location
-            open_location_button = ttk.Button(button_frame, text="📂 Open", style="Blue.TButton",
-                                              command=lambda: open_file_location(img_path))
-            open_location_button.pack(side=tk.TOP, padx=5, pady=5)
-
-            # Create a Delete button
-            style = ttk.Style()
-            style.configure("Red.TButton", foreground="#FF7C8B")
-            style.configure("Blue.TButton", foreground="lightblue")
-
-            delete_button = ttk.Button(button_frame, text="🗑️ Delete", style="Red.TButton",
-                                       command=lambda: self.delete_image(img_path, top))
-            delete_button.pack(side=tk.TOP, padx=5, pady=5)
-
-        # Bind the resize event
-        top.bind("<Configure>", schedule_resize)
-        top.bind("<ButtonRelease-1>", schedule_resize)  # Trigger resize on mouse button release
-
-        # Bind click event to close the window
-        canvas.bind("<Button-1>", lambda e: top.destroy())
-
-        # Initial resize
-        top.update_idletasks()  # Ensure the window size is updated
-        top.after(100, resize_image)  # Schedule the initial resize after a short delay
+        top = tk.Toplevel(self.master)
+        top.title(f"Similar to {os.path.basename(img_path)}")
+        frame = ttk.Frame(top)
+        frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        for i, (path, distance, thumbnail) in enumerate(similar):
+            photo = ImageTk.PhotoImage(thumbnail)
+            cell = ttk.Frame(frame)
+            cell.grid(row=i // 4, column=i % 4, padx=5, pady=5)
+            label = ttk.Label(cell, image=photo)
+            label.image = photo  # Keep a reference to prevent garbage collection
+            label.pack()
+            label.bind("<Button-1>", lambda e, p=path: self.open_full_size_image(p))
+            ttk.Label(cell, text=f"distance {distance}").pack()
 
     def upscale_image(self, img_path, metadata, window):
-        if upscaled_data := upscale_image(img_path):
-            # Generate a new filename for the upscaled image
-            current_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-            results_dir = get_output_directory()
-            new_filename = f"img_{current_time}.jpg"
-            upscaled_path = os.path.join(results_dir, new_filename)
+        # The upscale runs in the background; the viewer stays usable until the result is ready
+        engine = self.common_vars["upscale_engine"].get()
+        self.append_output(f"Upscaling {img_path}...\n")
 
-            # Save the upscaled image
-            with open(upscaled_path, "wb") as upscaled_file:
-                upscaled_file.write(upscaled_data)
-
-            # Update metadata
-            metadata["upscaled"] = True
-
-            # Convert metadata to a JSON string
-            metadata_json = json.dumps(metadata)
-
-            # Create or update EXIF data
-            exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
-
-            # Add metadata to EXIF
-            user_comment = piexif.helper.UserComment.dump(metadata_json)
-            exif_dict["Exif"][piexif.ExifIFD.UserComment] = user_comment
-
-            # Convert EXIF dict to bytes
-            exif_bytes = piexif.dump(exif_dict)
-
-            # Save the image with updated EXIF data
-            img = Image.open(upscaled_path)
-            img.save(upscaled_path, "JPEG", exif=exif_bytes, quality=95)
-
-            # Close the current window and open the new upscaled image
-            window.destroy()
-            self.open_full_size_image(upscaled_path)
+        def task():
+            try:
+                upscaled_path = upscale_and_save(img_path, engine)
+            except Exception as e:
+                print(f"Error during upscaling: {str(e)}")
+                upscaled_path = None
+            self.events.post(self.finish_upscale, upscaled_path, window)
 
-            # Refresh the gallery
-            self.load_images_from_results()
+        threading.Thread(target=task, daemon=True).start()
 
-            # Show a success message
-            tk.messagebox.showinfo("Upscale Complete", f"Image upscaled and saved as {new_filename}")
-        else:
-            # Show an error message if upscaling failed
+    def finish_upscale(self, upscaled_path, window):
+        if not upscaled_path:
             tk.messagebox.showerror("Upscale Failed", "Failed to upscale the image.")
+            return
+        # Close the current window (unless the user already did) and open the new upscaled image
+        if window.winfo_exists():
+            window.destroy()
+        self.open_full_size_image(upscaled_path)
+        self.post_gallery_reload()
+        self.append_output(f"Image upscaled and saved as {os.path.basename(upscaled_path)}\n")
 
     def delete_image(self, img_path, window):
         # Ask for confirmation
@@ -825,7 +1069,7 @@ class ImageGeneratorGUI:
             try:
                 os.remove(img_path)
                 window.destroy()
-                self.load_images_from_results()  # Refresh the gallery
+                self.post_gallery_reload()  # Refresh the gallery
             except Exception as e:
                 tk.messagebox.showerror("Error", f"Failed to delete image: {str(e)}")
 
@@ -870,10 +1114,38 @@ class ImageGeneratorGUI:
 
 
 def main():
+    parser = argparse.ArgumentParser(prog="ignoramus")
+    parser.add_argument("--profile", action="store_true", help="Sample CPU and memory usage and write a report on exit")
+    parser.add_argument("--profile-report", default=DEFAULT_REPORT_PATH, metavar="PATH",
+                        help=f"Where --profile writes its report (default {DEFAULT_REPORT_PATH})")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="Run the local HTTP API instead of the GUI")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    stats_parser = subparsers.add_parser("stats", help="Print p50/p95 latency per model and parameter set")
+    stats_parser.add_argument("--days", type=float, help="Only runs from the last DAYS days")
+    stats_parser.add_argument("--model", help="Only this model, e.g. black-forest-labs/flux-dev")
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable(args.profile_report)
+
+    if args.command == "serve":
+        initialize_app()
+        serve(args.host, args.port, args.workers)
+        return
+    if args.command == "stats":
+        since = time.time() - args.days * 86400 if args.days else None
+        for line in format_summary(get_analytics().summary(since, args.model)):
+            print(line)
+        return
+
     check_updates()
-    initialize_app()
-    root = tk.Tk()
-    gui = ImageGeneratorGUI(root)
+    with profiler.section("startup"):
+        initialize_app()
+        root = tk.Tk()
+        gui = ImageGeneratorGUI(root)
+        root.update()
     root.mainloop()
 
 
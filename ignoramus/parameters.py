@@ -0,0 +1,80 @@
+import random
+
+from ignoramus.storage import STORAGE_ENCODINGS
+from ignoramus.upscaler import UPSCALE_ENGINES
+
+MODELS = ["1.1-pro", "dev", "schnell"]
+
+ASPECT_RATIOS = ["16:9", "21:9", "1:1", "2:3", "3:2", "4:5", "5:4", "9:16", "9:21"]
+OUTPUT_FORMATS = ["webp", "jpg", "png"]
+
+# Declarative description of the parameter panels. "widget" decides how a field is drawn, "type" which Tk variable
+# holds it; sliders also carry their range and the step their values snap to. "local" settings only steer what
+# happens on this machine and are never sent to the model.
+COMMON_PARAMETERS = {
+    "aspect_ratio": {"widget": "combo", "type": str, "default": "16:9", "values": ASPECT_RATIOS},
+    "upscale": {"widget": "upscale", "type": bool, "default": False, "local": True},
+    "upscale_engine": {"widget": "combo", "type": str, "default": "remote", "values": UPSCALE_ENGINES, "local": True},
+    "storage_encoding": {"widget": "combo", "type": str, "default": "native", "values": list(STORAGE_ENCODINGS),
+                         "local": True},
+    "seed": {"widget": "seed", "type": int, "default": None},
+    "randomize_seed": {"widget": None, "type": bool, "default": True, "local": True},
+}
+
+MODEL_PARAMETERS = {
+    "1.1-pro": {
+        "steps": {"widget": "slider", "type": int, "default": 25, "min": 1, "max": 50, "step": 1},
+        "guidance": {"widget": "slider", "type": float, "default": 3.0, "min": 2, "max": 5, "step": 0.1},
+        "interval": {"widget": "slider", "type": float, "default": 2.0, "min": 1, "max": 4, "step": 0.1},
+        "safety_tolerance": {"widget": "slider", "type": int, "default": 5, "min": 1, "max": 5, "step": 1},
+    },
+    "dev": {
+        "image_path": {"widget": "image_path", "type": str, "default": ""},
+        "guidance": {"widget": "slider", "type": float, "default": 3.5, "min": 0, "max": 10, "step": 0.1},
+        "num_outputs": {"widget": "slider", "type": int, "default": 1, "min": 1, "max": 4, "step": 1},
+        "output_format": {"widget": "combo", "type": str, "default": "jpg", "values": OUTPUT_FORMATS},
+        "output_quality": {"widget": "slider", "type": int, "default": 80, "min": 0, "max": 100, "step": 1},
+        "prompt_strength": {"widget": "slider", "type": float, "default": 0.8, "min": 0, "max": 1, "step": 0.01},
+        "num_inference_steps": {"widget": "slider", "type": int, "default": 50, "min": 1, "max": 50, "step": 1},
+        "disable_safety_checker": {"widget": "check", "type": bool, "default": True},
+    },
+    "schnell": {
+        "num_outputs": {"widget": "slider", "type": int, "default": 1, "min": 1, "max": 4, "step": 1},
+        "output_format": {"widget": "combo", "type": str, "default": "jpg", "values": OUTPUT_FORMATS},
+        "output_quality": {"widget": "slider", "type": int, "default": 80, "min": 0, "max": 100, "step": 1},
+        "disable_safety_checker": {"widget": "check", "type": bool, "default": True},
+    },
+}
+
+
+def default_values():
+    return {model: {param: spec["default"] for param, spec in params.items()}
+            for model, params in MODEL_PARAMETERS.items()}
+
+
+def step_values():
+    return {model: {param: spec["step"] for param, spec in params.items() if "step" in spec}
+            for model, params in MODEL_PARAMETERS.items()}
+
+
+def default_properties(model):
+    # Properties for a generation that wasn't configured through the GUI panels
+    properties = {param: spec["default"] for param, spec in COMMON_PARAMETERS.items() if param != "randomize_seed"}
+    properties["seed"] = random.randint(0, 2 ** 32 - 1)
+    properties.update({param: spec["default"] for param, spec in MODEL_PARAMETERS[model].items()
+                       if param != "image_path"})
+    return properties
+
+
+def model_input(properties):
+    # What is sent to Replicate; local settings stay in the properties for post-processing and metadata
+    local = {param for param, spec in COMMON_PARAMETERS.items() if spec.get("local")}
+    return {key: value for key, value in properties.items() if key not in local}
+
+
+def label_for(param):
+    return f"{param.replace('_', ' ').title()}:"
+
+
+def format_for_step(step):
+    return ".2f" if step < 0.1 else (".1f" if step < 1 else "d")
@@ -0,0 +1,210 @@
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+INDEX_FILE_NAME = ".phash_index.npz"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+# Hamming distance (out of 64 bits) under which two images are considered near-duplicates
+DUPLICATE_DISTANCE = 8
+SIMILAR_DISTANCE = 16
+HASH_BATCH_SIZE = 256
+
+DHASH_SIZE = (9, 8)
+PHASH_SIZE = (32, 32)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(PHASH_SIZE[0])
+
+
+def _pack_bits(bits):
+    # (N, 64) booleans -> (N,) uint64
+    return np.packbits(bits.reshape(len(bits), 64), axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def dhash_batch(thumbnails):
+    # thumbnails: (N, 8, 9) grayscale, one bit per horizontal gradient
+    return _pack_bits(thumbnails[:, :, 1:] > thumbnails[:, :, :-1])
+
+
+def phash_batch(thumbnails):
+    # thumbnails: (N, 32, 32) grayscale; keep the 8x8 lowest frequencies of the 2D DCT and compare against the median
+    coefficients = _DCT @ thumbnails @ _DCT.T
+    low = coefficients[:, :8, :8].reshape(len(thumbnails), 64)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack_bits(low > median)
+
+
+def load_thumbnails(img):
+    # Let the JPEG decoder downscale while decoding; only a 32x32 grayscale copy is ever needed
+    img.draft("L", PHASH_SIZE)
+    gray = img.convert("L")
+    dhash_thumb = np.asarray(gray.resize(DHASH_SIZE, Image.BILINEAR), dtype=np.float32)
+    phash_thumb = np.asarray(gray.resize(PHASH_SIZE, Image.BILINEAR), dtype=np.float32)
+    return dhash_thumb, phash_thumb
+
+
+def hash_thumbnails(thumbnails):
+    if not thumbnails:
+        return np.empty(0, np.uint64), np.empty(0, np.uint64)
+    dhash_thumbs, phash_thumbs = (np.stack(t) for t in zip(*thumbnails))
+    return dhash_batch(dhash_thumbs), phash_batch(phash_thumbs)
+
+
+def compute_file_hashes(path):
+    with Image.open(path) as img:
+        dhashes, phashes = hash_thumbnails([load_thumbnails(img)])
+    return dhashes[0], phashes[0]
+
+
+def hamming_distances(hashes, value):
+    return np.bitwise_count(hashes ^ np.uint64(value))
+
+
+class PHashIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE_NAME)
+        self.lock = threading.RLock()
+        self.names = []
+        self.positions = {}
+        self.mtimes = np.empty(0, np.float64)
+        self.dhashes = np.empty(0, np.uint64)
+        self.phashes = np.empty(0, np.uint64)
+        self.load()
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with np.load(self.index_path) as data:
+                names = data["names"].tobytes().decode("utf-8")
+                self.names = names.split("\n") if names else []
+                self.mtimes = data["mtimes"]
+                self.dhashes = data["dhashes"]
+                self.phashes = data["phashes"]
+            self.positions = {name: i for i, name in enumerate(self.names)}
+        except Exception as e:
+            print(f"Error loading perceptual hash index, rebuilding: {str(e)}")
+            self.names, self.positions = [], {}
+
+    def save(self):
+        with self.lock:
+            names = np.frombuffer("\n".join(self.names).encode("utf-8"), dtype=np.uint8)
+            temp_path = f"{self.index_path}.tmp"
+            with open(temp_path, "wb") as f:
+                np.savez(f, names=names, mtimes=self.mtimes, dhashes=self.dhashes, phashes=self.phashes)
+            os.replace(temp_path, self.index_path)
+
+    def _set(self, names, mtimes, dhashes, phashes):
+        with self.lock:
+            new_rows = []
+            for name, mtime, dhash, phash in zip(names, mtimes, dhashes, phashes):
+                if name in self.positions:
+                    i = self.positions[name]
+                    self.mtimes[i], self.dhashes[i], self.phashes[i] = mtime, dhash, phash
+                else:
+                    new_rows.append((name, mtime, dhash, phash))
+            if new_rows:
+                new_names, new_mtimes, new_dhashes, new_phashes = zip(*new_rows)
+                self.positions.update({name: len(self.names) + i for i, name in enumerate(new_names)})
+                self.names.extend(new_names)
+                self.mtimes = np.concatenate([self.mtimes, np.array(new_mtimes, np.float64)])
+                self.dhashes = np.concatenate([self.dhashes, np.array(new_dhashes, np.uint64)])
+                self.phashes = np.concatenate([self.phashes, np.array(new_phashes, np.uint64)])
+
+    def _remove(self, names):
+        with self.lock:
+            keep = np.ones(len(self.names), dtype=bool)
+            keep[[self.positions[name] for name in names if name in self.positions]] = False
+            self.names = [name for name, k in zip(self.names, keep) if k]
+            self.positions = {name: i for i, name in enumerate(self.names)}
+            self.mtimes, self.dhashes, self.phashes = self.mtimes[keep], self.dhashes[keep], self.phashes[keep]
+
+    def sync(self):
+        # Incremental: only files that are new or changed since they were hashed get decoded
+        if not os.path.exists(self.directory):
+            return
+        current = {
+            entry.name: entry.stat().st_mtime
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        }
+        with self.lock:
+            stale = [name for name in self.names if name not in current]
+            changed = [name for name, mtime in current.items()
+                       if name not in self.positions or self.mtimes[self.positions[name]] != mtime]
+        if stale:
+            self._remove(stale)
+        for start in range(0, len(changed), HASH_BATCH_SIZE):
+            batch, thumbnails = [], []
+            for name in changed[start:start + HASH_BATCH_SIZE]:
+                try:
+                    with Image.open(os.path.join(self.directory, name)) as img:
+                        thumbnails.append(load_thumbnails(img))
+                    batch.append(name)
+                except Exception as e:
+                    print(f"Error hashing {name}: {str(e)}")
+            dhashes, phashes = hash_thumbnails(thumbnails)
+            self._set(batch, [current[name] for name in batch], dhashes, phashes)
+        if stale or changed:
+            self.save()
+
+    def add(self, path):
+        # Hashes a newly saved image and returns the closest existing near-duplicate, if any
+        name = os.path.basename(path)
+        dhash, phash = compute_file_hashes(path)
+        duplicate = self.find_duplicate(dhash, phash, exclude=name)
+        self._set([name], [os.path.getmtime(path)], [dhash], [phash])
+        return duplicate
+
+    def find_duplicate(self, dhash, phash, exclude=None):
+        # Both hashes have to agree to flag a duplicate, which keeps false positives low
+        with self.lock:
+            if not self.names:
+                return None
+            distances = hamming_distances(self.phashes, phash)
+            dhash_distances = hamming_distances(self.dhashes, dhash)
+            matches = np.nonzero((distances <= DUPLICATE_DISTANCE) & (dhash_distances <= DUPLICATE_DISTANCE))[0]
+            matches = [i for i in matches[np.argsort(distances[matches], kind="stable")] if self.names[i] != exclude]
+            return os.path.join(self.directory, self.names[matches[0]]) if matches else None
+
+    def search(self, path, max_distance=SIMILAR_DISTANCE, limit=24):
+        # Returns [(path, distance)] sorted by pHash Hamming distance, excluding the query image itself
+        name = os.path.basename(path)
+        with self.lock:
+            position = self.positions.get(name)
+            phash = self.phashes[position] if position is not None else None
+        if phash is None:
+            _, phash = compute_file_hashes(path)
+        with self.lock:
+            distances = hamming_distances(self.phashes, phash)
+            matches = np.nonzero(distances <= max_distance)[0]
+            matches = matches[np.argsort(distances[matches], kind="stable")]
+            return [(os.path.join(self.directory, self.names[i]), int(distances[i]))
+                    for i in matches if self.names[i] != name][:limit]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory):
+    with _indexes_lock:
+        key = os.path.abspath(directory)
+        if key not in _indexes:
+            _indexes[key] = PHashIndex(directory)
+        return _indexes[key]
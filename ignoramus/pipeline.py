@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrency limits are per stage name and shared by every pipeline run, so e.g. all running generations together
+# never do more than the upscale stage's limit of upscales at once. Stages sharing a name therefore have to agree on
+# the limit.
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def _limit(stage):
+    with _limits_lock:
+        if stage.name not in _limits:
+            semaphore = threading.BoundedSemaphore(stage.concurrency) if stage.concurrency else None
+            _limits[stage.name] = (stage.concurrency, semaphore)
+        concurrency, semaphore = _limits[stage.name]
+        if concurrency != stage.concurrency:
+            raise ValueError(f"Stage {stage.name} has concurrency {stage.concurrency}, but another stage with that "
+                             f"name has {concurrency}")
+        return semaphore
+
+
+class Stage:
+    # run(context) does the work for one item and keeps its results in the context dict. The stage starts once
+    # every stage named in `after` has finished for that item; when(context) returning False skips it (stages
+    # after it still run).
+    def __init__(self, name, run, after=(), concurrency=None, when=None):
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+        self.concurrency = concurrency
+        self.when = when
+
+
+class Pipeline:
+    # A graph of stages run for each item (e.g. each output of a prediction). Stages that don't depend on each
+    # other run at the same time, and so do different items.
+    def __init__(self, stages=()):
+        self.stages = {}
+        for stage in stages:
+            # Dependencies have to be declared first, which also rules out cycles
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage: {stage.name}")
+            if missing := [name for name in stage.after if name not in self.stages]:
+                raise ValueError(f"Stage {stage.name} comes after unknown stage(s): {', '.join(missing)}")
+            # Checked here so a conflicting limit fails when the pipeline is built, not halfway through a run
+            _limit(stage)
+            self.stages[stage.name] = stage
+
+    def with_stage(self, stage):
+        return Pipeline(list(self.stages.values()) + [stage])
+
+    def run(self, contexts, on_done=None):
+        # on_done(context) is called from a worker thread as soon as every stage of that item is done. Once a stage
+        # fails, the item's remaining stages are skipped; the first error is raised after all items finished.
+        errors = []
+        finished = threading.Semaphore(0)
+        with ThreadPoolExecutor(max_workers=max(1, len(contexts) * len(self.stages)),
+                                thread_name_prefix="pipeline") as pool:
+            for context in contexts:
+                _Run(self, context, pool, on_done, errors, finished.release).start()
+            # Stages submit the stages after them, so the pool may only shut down once every item is through
+            for _ in contexts:
+                finished.acquire()
+        if errors:
+            raise errors[0]
+        return contexts
+
+
+class _Run:
+    # Progress of one item through the graph
+    def __init__(self, pipeline, context, pool, on_done, errors, on_finished):
+        self.pipeline = pipeline
+        self.context = context
+        self.pool = pool
+        self.on_done = on_done
+        self.errors = errors
+        self.on_finished = on_finished
+        self.lock = threading.Lock()
+        self.waiting = {name: set(stage.after) for name, stage in pipeline.stages.items()}
+        self.running = 0
+        self.error = None
+        context.setdefault("timings", {})
+
+    def start(self):
+        with self.lock:
+            ready = self._take_ready()
+        if not ready and not self.running:
+            self._finish()
+        for stage in ready:
+            self.pool.submit(self._run_stage, stage)
+
+    def _take_ready(self):
+        ready = [self.pipeline.stages[name] for name, after in self.waiting.items() if not after]
+        for stage in ready:
+            del self.waiting[stage.name]
+        self.running += len(ready)
+        return ready
+
+    def _run_stage(self, stage):
+        try:
+            if self.error is None and (stage.when is None or stage.when(self.context)):
+                limit = _limit(stage)
+                if limit:
+                    limit.acquire()
+                try:
+                    started = time.perf_counter()
+                    stage.run(self.context)
+                    self.context["timings"][stage.name] = time.perf_counter() - started
+                finally:
+                    if limit:
+                        limit.release()
+        except Exception as e:
+            with self.lock:
+                self.error = self.error or e
+        with self.lock:
+            self.running -= 1
+            for after in self.waiting.values():
+                after.discard(stage.name)
+            ready = self._take_ready()
+            done = not self.running and not self.waiting
+        for next_stage in ready:
+            self.pool.submit(self._run_stage, next_stage)
+        if done:
+            self._finish()
+
+    def _finish(self):
+        if self.error is None and self.on_done:
+            try:
+                self.on_done(self.context)
+            except Exception as e:
+                self.error = e
+        if self.error is not None:
+            self.errors.append(self.error)
+        self.on_finished()
@@ -0,0 +1,146 @@
+import re
+import threading
+
+import replicate
+from replicate.exceptions import ModelError
+
+from ignoramus.analytics import get_analytics, prediction_timings
+from ignoramus.scheduler import scheduler, is_retryable, record_response
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+# Models log their denoising loop through tqdm, e.g. " 45%|████▌     | 9/20 [00:02<00:02,  4.31it/s]"
+PERCENTAGE_PATTERN = re.compile(r"(\d{1,3})%\|")
+STEP_PATTERN = re.compile(r"\|\s*(\d+)/(\d+)")
+
+
+def build_client(**kwargs):
+    # The response hook keeps the headers of failed calls, which ReplicateError drops, so the scheduler can honour
+    # Retry-After. The token and base URL are read from the environment on first use.
+    return replicate.Client(event_hooks={"response": [record_response]}, **kwargs)
+
+
+client = build_client()
+
+
+class PredictionCancelled(Exception):
+    pass
+
+
+def parse_progress(logs):
+    for line in reversed((logs or "").splitlines()):
+        if match := PERCENTAGE_PATTERN.search(line):
+            return min(100.0, float(match.group(1)))
+        if (match := STEP_PATTERN.search(line)) and int(match.group(2)):
+            return 100.0 * int(match.group(1)) / int(match.group(2))
+    return None
+
+
+def create_prediction(ref, input):
+    # Versioned references ("owner/name:version") go through the versions endpoint, official models through
+    # the models endpoint, like replicate.run does
+    if ":" in ref:
+        return client.predictions.create(version=ref.split(":", 1)[1], input=input)
+    return client.models.predictions.create(model=ref, input=input)
+
+
+class PredictionJob:
+    def __init__(self, ref, input, poll_interval=1.0, prediction_id=None, on_created=None):
+        self.ref = ref
+        self.input = input
+        # Resumes polling an existing prediction instead of creating (and paying for) a new one
+        self.prediction_id = prediction_id
+        self.on_created = on_created
+        self.poll_interval = poll_interval
+        self.prediction = None
+        self.status = "pending"
+        self.logs = ""
+        self.progress = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def id(self):
+        return self.prediction.id if self.prediction else None
+
+    def run(self):
+        # Holds a scheduler slot only while the prediction is live; a cancel releases it on the next wakeup
+        with scheduler.slot():
+            if self.cancelled.is_set():
+                self.status = "canceled"
+                raise PredictionCancelled()
+            if self.prediction_id:
+                prediction = scheduler.retry(client.predictions.get, self.prediction_id)
+            else:
+                prediction = scheduler.retry(create_prediction, self.ref, self.input)
+                if self.on_created:
+                    self.on_created(prediction)
+            with self.lock:
+                self.prediction = prediction
+                cancelled = self.cancelled.is_set()
+            if cancelled:
+                # cancel() was called while the prediction was being created
+                self._cancel_remote()
+            self._update()
+            while self.status not in TERMINAL_STATUSES:
+                if self.cancelled.wait(self.poll_interval):
+                    self.status = "canceled"
+                    raise PredictionCancelled()
+                try:
+                    self.prediction.reload()
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    continue
+                self._update()
+
+        self._record_analytics()
+        if self.status == "canceled":
+            raise PredictionCancelled()
+        if self.status == "failed":
+            self.error = self.prediction.error
+            raise ModelError(self.prediction)
+        return self.prediction.output
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled.set()
+            prediction = self.prediction
+        if prediction is not None and self.status not in TERMINAL_STATUSES:
+            # Don't block the caller (usually the Tk thread) on the cancel request
+            threading.Thread(target=self._cancel_remote, daemon=True).start()
+
+    def _cancel_remote(self):
+        try:
+            self.prediction.cancel()
+        except Exception as e:
+            print(f"Error cancelling prediction {self.id}: {str(e)}")
+
+    def _record_analytics(self):
+        try:
+            input = self.input if self.input is not None else self.prediction.input
+            get_analytics().record_prediction(self.id, self.ref.split(":", 1)[0], input, self.status,
+                                              prediction_timings(self.prediction))
+        except Exception as e:
+            print(f"Error recording analytics for prediction {self.id}: {str(e)}")
+
+    def _update(self):
+        self.status = self.prediction.status
+        self.logs = self.prediction.logs or ""
+        if self.status == "succeeded":
+            self.progress = 100.0
+        elif (progress := parse_progress(self.logs)) is not None:
+            self.progress = progress
+
+
+def run_prediction(ref, input, job_callback=None, prediction_id=None, on_created=None):
+    job = PredictionJob(ref, input, prediction_id=prediction_id, on_created=on_created)
+    if job_callback:
+        job_callback(job)
+    return job.run()
+
+
+def run_model(ref, input):
+    # For the short helper models (CodeFormer, face swap); polled faster since they usually take a few seconds
+    return PredictionJob(ref, input, poll_interval=0.5).run()
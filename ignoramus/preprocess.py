@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import io
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import piexif
+from PIL import Image, ImageOps
+
+from ignoramus.image_cache import LRUCache
+
+# Longest side each kind of input is sent at. Flux img2img works at about one megapixel; the face swap model detects
+# faces at 640 px, so a larger source face only costs upload time. Face swap targets and upscaler inputs keep their
+# size because it is the size of the result.
+INPUT_MAX_SIDE = {
+    "img2img": 1440,
+    "face_source": 1024,
+    "face_target": None,
+    "upscale": None,
+}
+JPEG_QUALITY = 95
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+PREPARED_CACHE_BUDGET = 64 * 1024 * 1024
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG chunks that affect how the pixels look; text, eXIf, timestamps and the like are dropped
+PNG_KEPT_CHUNKS = {b"IHDR", b"PLTE", b"tRNS", b"IDAT", b"IEND", b"gAMA", b"cHRM", b"sRGB", b"iCCP", b"sBIT"}
+
+prepared_cache = LRUCache(PREPARED_CACHE_BUDGET)
+preprocess_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preprocess")
+
+
+def _strip_metadata(data):
+    # Drops the EXIF block (our JSON metadata and thumbnail) from JPEG/WebP without re-encoding the pixels
+    output = io.BytesIO()
+    piexif.remove(data, output)
+    return output.getvalue()
+
+
+def _strip_png_metadata(data):
+    # Same for PNG: the chunks are copied as they are, minus the ancillary ones that only carry metadata
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    output = io.BytesIO()
+    output.write(PNG_SIGNATURE)
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        end = position + 12 + length
+        if chunk_type in PNG_KEPT_CHUNKS:
+            output.write(data[position:end])
+        position = end
+        if chunk_type == b"IEND":
+            break
+    return output.getvalue()
+
+
+def _encode(img, max_side):
+    img = ImageOps.exif_transpose(img)
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    buffer = io.BytesIO()
+    img.convert("RGB").save(buffer, "JPEG", quality=JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def prepare_image_bytes(data, max_side=None):
+    # Returns (bytes, mime type). Inputs that are already small enough are only stripped of metadata (lossless);
+    # anything else is resized and normalized to a metadata-free JPEG.
+    with Image.open(io.BytesIO(data)) as img:
+        needs_resize = bool(max_side) and max(img.size) > max_side
+        rotated = img.getexif().get(0x0112, 1) != 1
+        if needs_resize and img.format == "JPEG":
+            # Decode at a reduced scale straight away; the final resize happens in _encode
+            img.draft("RGB", (max_side, max_side))
+        if img.format in ("JPEG", "WEBP") and not needs_resize and not rotated:
+            return _strip_metadata(data), MIME_TYPES[img.format]
+        encoded = _encode(img, max_side)
+        if img.format == "PNG" and not needs_resize and not rotated:
+            # A small PNG often compresses better than its JPEG version
+            stripped = _strip_png_metadata(data)
+            if len(stripped) <= len(encoded):
+                return stripped, MIME_TYPES["PNG"]
+        return encoded, "image/jpeg"
+
+
+def prepare_image(image_path, kind="img2img"):
+    # Data URI for a model input, cached by content so a face reused for a whole batch is only processed once
+    with open(image_path, "rb") as f:
+        data = f.read()
+    max_side = INPUT_MAX_SIDE.get(kind)
+    key = (hashlib.sha256(data).hexdigest(), max_side)
+    if (uri := prepared_cache.get(key)) is not None:
+        return uri
+    try:
+        prepared, mime_type = prepare_image_bytes(data, max_side)
+    except Exception as e:
+        # Not something Pillow can read; let the model decide what to do with it
+        print(f"Error preprocessing {image_path}: {str(e)}")
+        prepared, mime_type = data, "application/octet-stream"
+    uri = f"data:{mime_type};base64,{base64.b64encode(prepared).decode('utf-8')}"
+    prepared_cache.put(key, uri, len(uri))
+    return uri
+
+
+def prefetch_image(image_path, kind="img2img"):
+    # Starts preprocessing as soon as an input is chosen, so it is usually cached by the time it is needed
+    return preprocess_pool.submit(prepare_image, image_path, kind)
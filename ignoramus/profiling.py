@@ -0,0 +1,181 @@
+import atexit
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_REPORT_PATH = "ignoramus_profile.txt"
+SAMPLE_INTERVAL = 0.005
+# Only the allocating line is reported, deeper tracebacks would just slow every allocation down
+TRACEMALLOC_FRAMES = 1
+TOP_HOTSPOTS = 20
+TOP_ALLOCATORS = 15
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class SectionStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.samples = 0
+        self.self_samples = collections.Counter()
+        self.cumulative_samples = collections.Counter()
+        self.memory_growth = 0
+        self.max_memory_growth = 0
+
+
+class Profiler:
+    # Sampling profiler: a background thread records the Python stack of every thread every few milliseconds, so
+    # sections running concurrently on worker threads can all be profiled at once (cProfile allows only one).
+    # Sections also record how much traced memory grew during each call. Tracemalloc snapshots walk the whole heap,
+    # so only two are taken: at start, and at exit to attribute growth over the session to source lines.
+    def __init__(self):
+        self.enabled = False
+        self.report_path = DEFAULT_REPORT_PATH
+        self.started_at = None
+        self.lock = threading.Lock()
+        self.sections = collections.defaultdict(SectionStats)
+        self.active = {}
+        self.overall = SectionStats()
+        self.sampler = None
+        self.start_snapshot = None
+
+    def enable(self, report_path=DEFAULT_REPORT_PATH):
+        self.enabled = True
+        self.report_path = report_path
+        self.started_at = time.perf_counter()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.start_snapshot = tracemalloc.take_snapshot()
+        self.sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self.sampler.start()
+        atexit.register(self.write_report)
+        print(f"Profiling enabled, report will be written to {report_path}")
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while self.enabled:
+            time.sleep(SAMPLE_INTERVAL)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stats = [self.overall]
+                    stats.extend(self.sections[name] for name in self.active.get(thread_id, ()))
+                    self._record_stack(frame, stats)
+
+    @staticmethod
+    def _record_stack(frame, stats):
+        leaf = _frame_key(frame)
+        stack = set()
+        while frame is not None:
+            stack.add(_frame_key(frame))
+            frame = frame.f_back
+        for section in stats:
+            section.samples += 1
+            section.self_samples[leaf] += 1
+            section.cumulative_samples.update(stack)
+
+    def section(self, name):
+        return _Section(self, name)
+
+    def write_report(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        snapshot = tracemalloc.take_snapshot()
+        lines = [f"IGNORAMUS profile, {time.perf_counter() - self.started_at:.1f}s, "
+                 f"sampling every {SAMPLE_INTERVAL * 1000:.0f} ms", ""]
+        with self.lock:
+            for name, stats in sorted(self.sections.items()):
+                lines += self._format_section(name, stats)
+            lines += self._format_section("all threads (whole session)", self.overall)
+        lines += [f"== Memory growth since profiling started (top {TOP_ALLOCATORS}) =="]
+        for stat in snapshot.compare_to(self.start_snapshot, "lineno")[:TOP_ALLOCATORS]:
+            if stat.size_diff > 0:
+                lines.append(f"  {stat.size_diff / 1024:10.1f} KiB {stat.count_diff:+8d} blocks  {stat.traceback[0]}")
+        lines += ["", f"== Largest live allocations at exit (top {TOP_ALLOCATORS}) =="]
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATORS]:
+            lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback[0]}")
+        tracemalloc.stop()
+        try:
+            with open(self.report_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            print(f"Profile report written to {self.report_path}")
+        except OSError as e:
+            print(f"Error writing profile report: {str(e)}")
+
+    @staticmethod
+    def _format_section(name, stats):
+        lines = [f"== {name} =="]
+        if stats.calls:
+            lines.append(f"  calls {stats.calls}, total {stats.total_time:.3f}s, "
+                         f"mean {stats.total_time / stats.calls * 1000:.1f} ms, max {stats.max_time * 1000:.1f} ms")
+        lines.append(f"  {stats.samples} samples")
+        if stats.samples:
+            lines.append("  Hotspots (self)")
+            for key, count in stats.self_samples.most_common(TOP_HOTSPOTS):
+                lines.append(f"    {100 * count / stats.samples:5.1f}%  {key}")
+            lines.append("  Hotspots (cumulative)")
+            for key, count in stats.cumulative_samples.most_common(TOP_HOTSPOTS):
+                lines.append(f"    {100 * count / stats.samples:5.1f}%  {key}")
+        if stats.calls:
+            lines.append(f"  memory growth per call: mean {stats.memory_growth / stats.calls / 1024:.1f} KiB, "
+                         f"max {stats.max_memory_growth / 1024:.1f} KiB")
+        lines.append("")
+        return lines
+
+
+class _Section:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if not self.profiler.enabled:
+            return self
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        with self.profiler.lock:
+            self.profiler.active.setdefault(threading.get_ident(), []).append(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not hasattr(self, "started"):
+            return False
+        elapsed = time.perf_counter() - self.started
+        # Other threads allocate meanwhile too, so this is growth while the section ran, not strictly its own
+        growth = tracemalloc.get_traced_memory()[0] - self.memory if tracemalloc.is_tracing() else 0
+        with self.profiler.lock:
+            self.profiler.active[threading.get_ident()].remove(self.name)
+            stats = self.profiler.sections[self.name]
+            stats.calls += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.memory_growth += growth
+            stats.max_memory_growth = max(stats.max_memory_growth, growth)
+        return False
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    # Costs one attribute check per call unless --profile is on
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with profiler.section(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,178 @@
+import collections
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Headers of the last response the Replicate client received on each thread. ReplicateError only keeps the status,
+# so this is where retry() finds the Retry-After of the response the error was raised for.
+_last_response = threading.local()
+
+
+def record_response(response):
+    # httpx response event hook, installed on the Replicate client
+    _last_response.headers = response.headers
+
+
+def get_status_code(error):
+    # replicate.exceptions.ReplicateError carries the status directly, httpx and requests errors carry a response
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def get_retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None and isinstance(getattr(error, "status", None), int):
+        headers = getattr(_last_response, "headers", None)
+    headers = headers or {}
+    value = (headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    if isinstance(error, (httpx.TransportError, requests.ConnectionError, requests.Timeout)):
+        return True
+    return get_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self.lock:
+            # Tokens earned so far count at the old rate
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = rate
+
+    def block_for(self, seconds):
+        # Used to honour Retry-After: nobody gets a token until the server says we may continue
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AdaptiveScheduler:
+    def __init__(self, rate=5.0, burst=10, concurrency=4, min_concurrency=1, max_concurrency=8, max_retries=8,
+                 base_delay=1.0, max_delay=60.0, window=20, cooldown=5.0):
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = cooldown
+        self.active = 0
+        self.outcomes = collections.deque(maxlen=window)
+        self.successes_since_change = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self.condition:
+            while self.active >= self.concurrency:
+                self.condition.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        # Holds a concurrency slot for the whole call, including retries
+        with self.slot():
+            return self.retry(fn, *args, **kwargs)
+
+    def retry(self, fn, *args, **kwargs):
+        # Rate limited call with backoff, without taking a concurrency slot
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            _last_response.headers = None
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self._record(False)
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = get_retry_after(e)
+                if retry_after is not None:
+                    self.bucket.block_for(retry_after)
+                    delay = retry_after
+                else:
+                    # Exponential backoff with full jitter
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"Replicate call failed ({get_status_code(e) or type(e).__name__}), "
+                      f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._record(True)
+            return result
+
+    def _record(self, success):
+        with self.condition:
+            self.outcomes.append(success)
+            error_rate = self.outcomes.count(False) / len(self.outcomes)
+            now = time.monotonic()
+            if not success:
+                self.successes_since_change = 0
+                # Multiplicative decrease, at most once per cooldown so one burst of errors is not counted many times
+                if now - self.last_decrease >= self.cooldown:
+                    self.last_decrease = now
+                    self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                    self.bucket.set_rate(max(self.max_rate / 10, self.bucket.rate / 2))
+                return
+            self.successes_since_change += 1
+            # Additive increase once a full window of calls has gone through cleanly
+            if self.successes_since_change >= self.outcomes.maxlen and error_rate < 0.05:
+                self.successes_since_change = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.bucket.set_rate(min(self.max_rate, self.bucket.rate * 1.25))
+                self.condition.notify_all()
+
+
+# Shared by every module that talks to Replicate so they all stay inside the same account limits
+scheduler = AdaptiveScheduler()
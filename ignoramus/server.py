@@ -0,0 +1,175 @@
+import json
+import mimetypes
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+from ignoramus.analytics import get_analytics
+from ignoramus.engine import GenerationEngine, DEFAULT_WORKERS
+from ignoramus.gallery import Gallery
+from ignoramus.library import get_library
+from ignoramus.transport import transport
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Endpoints:
+#   POST /generate                 {"model": "schnell", "properties": {...}} -> job; an img2img "image_path" is the
+#                                  name of an image in the library, "image_root" its root (the output root by default)
+#   GET  /jobs                     all known jobs
+#   GET  /jobs/<id>                job status, progress, logs and saved images
+#   POST /jobs/<id>/cancel         cancel a queued or running job
+#   GET  /roots                    configured library roots
+#   GET  /gallery?offset=0&limit=100&root=<root>   all roots, newest first, unless a root is given; limit is at
+#                                  most 1000
+#   GET  /search?q=<text>&limit=100&root=<root>
+#   GET  /thumbnails/<name>?root=<root>   JPEG thumbnail; names are paths inside a root, the output root by default
+#   GET  /images/<name>?root=<root>       full size image
+#   GET  /metadata/<name>?root=<root>
+#   GET  /stats/http               connection reuse per host
+#   GET  /stats/models?days=7&model=<owner/name>   p50/p95 latency per model and parameter set
+
+
+class IgnoramusRequestHandler(BaseHTTPRequestHandler):
+    engine = None
+    gallery = None
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_bytes(body, "application/json", status)
+
+    def send_bytes(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json({"error": message}, status)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def generation_request(self):
+        request = self.read_json()
+        if not isinstance(request, dict):
+            raise ValueError("Request body must be a JSON object")
+        model, properties = request.get("model", "schnell"), request.get("properties", {})
+        if not isinstance(properties, dict):
+            raise ValueError("properties must be a JSON object")
+        properties = dict(properties)
+        root = properties.pop("image_root", None)
+        if properties.get("image_path"):
+            # Clients only get to pick images from the library, never arbitrary files the server can read
+            try:
+                properties["image_path"] = self.gallery.library.root(root).resolve(properties["image_path"])
+            except (KeyError, AttributeError):
+                raise ValueError(f"Image not found in the library: {properties['image_path']}")
+        return model, properties
+
+    def query_count(self, query, name, default):
+        try:
+            value = int(query.get(name, default))
+        except ValueError:
+            raise ValueError(f"{name} must be an integer")
+        if value < 0:
+            raise ValueError(f"{name} must not be negative")
+        return min(value, MAX_PAGE_SIZE) if name == "limit" else value
+
+    def route(self):
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return parts, query
+
+    def do_GET(self):
+        parts, query = self.route()
+        try:
+            if parts == ["jobs"]:
+                self.send_json([job.to_dict() for job in self.engine.list_jobs()])
+            elif len(parts) == 2 and parts[0] == "jobs":
+                if job := self.engine.get(parts[1]):
+                    self.send_json(job.to_dict())
+                else:
+                    self.send_error_json(404, "Job not found")
+            elif parts == ["gallery"]:
+                offset = self.query_count(query, "offset", 0)
+                limit = self.query_count(query, "limit", DEFAULT_PAGE_SIZE)
+                images = self.gallery.list_images(query.get("root"))
+                self.send_json({"total": len(images), "images": images[offset:offset + limit]})
+            elif parts == ["roots"]:
+                self.send_json([{"name": root.name, "path": root.path, "network": root.network, "output": root.output}
+                                for root in self.gallery.library.roots])
+            elif parts == ["search"]:
+                self.send_json(self.gallery.search(query.get("q", ""),
+                                                   self.query_count(query, "limit", DEFAULT_PAGE_SIZE),
+                                                   query.get("root")))
+            elif len(parts) >= 2 and parts[0] == "thumbnails":
+                self.send_bytes(self.gallery.thumbnail("/".join(parts[1:]), query.get("root")), "image/jpeg")
+            elif len(parts) >= 2 and parts[0] == "images":
+                path = self.gallery.path_for("/".join(parts[1:]), query.get("root"))
+                with open(path, "rb") as f:
+                    body = f.read()
+                self.send_bytes(body, mimetypes.guess_type(path)[0] or "application/octet-stream")
+            elif len(parts) >= 2 and parts[0] == "metadata":
+                self.send_json(self.gallery.metadata("/".join(parts[1:]), query.get("root")))
+            elif parts == ["stats", "http"]:
+                self.send_json(transport.stats())
+            elif parts == ["stats", "models"]:
+                since = time.time() - float(query["days"]) * 86400 if query.get("days") else None
+                self.send_json(get_analytics().summary(since, query.get("model")))
+            else:
+                self.send_error_json(404, "Not found")
+        except (KeyError, FileNotFoundError):
+            self.send_error_json(404, "Image not found")
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+        except OSError as e:
+            # Unreadable or truncated files, including images PIL can't identify
+            print(f"Error serving {self.path}: {str(e)}")
+            self.send_error_json(500, "Error reading image")
+
+    def do_POST(self):
+        parts, _ = self.route()
+        try:
+            if parts == ["generate"]:
+                job = self.engine.submit(*self.generation_request())
+                self.send_json(job.to_dict(), 202)
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+                if job := self.engine.cancel(parts[1]):
+                    self.send_json(job.to_dict())
+                else:
+                    self.send_error_json(404, "Job not found")
+            else:
+                self.send_error_json(404, "Not found")
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+        except OSError as e:
+            print(f"Error handling {self.path}: {str(e)}")
+            self.send_error_json(500, "Error handling request")
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+    # All requests share one engine and one gallery cache, whichever client they come from
+    engine = GenerationEngine(workers)
+    if resumed := engine.resume():
+        print(f"Resuming {len(resumed)} interrupted job(s).")
+    library = get_library()
+    # Listings come from the root indexes, which the watchers keep current
+    library.start_watching(lambda root: None)
+    handler = type("Handler", (IgnoramusRequestHandler,), {
+        "engine": engine,
+        "gallery": Gallery(library),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"IGNORAMUS API listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        server.server_close()
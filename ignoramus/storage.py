@@ -0,0 +1,124 @@
+import os
+import struct
+import zlib
+
+import piexif
+from PIL import Image
+
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+EXTENSION_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP", ".png": "PNG"}
+
+# Options used whenever an image has to be re-encoded in its own format (upscale, face swap)
+DEFAULT_SAVE_OPTIONS = {"JPEG": {"quality": 95}, "WEBP": {"quality": 95}, "PNG": {}}
+
+# How generated images are stored. "native" keeps the bytes the model returned and only inserts the metadata
+STORAGE_ENCODINGS = {
+    "native": None,
+    "webp_lossless": ("WEBP", {"lossless": True, "method": 4}),
+    "webp_q90": ("WEBP", {"quality": 90, "method": 4}),
+    "jpeg_q95": ("JPEG", {"quality": 95}),
+    "jpeg_q85": ("JPEG", {"quality": 85}),
+}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def detect_format(file_name):
+    with Image.open(file_name) as img:
+        return img.format
+
+
+def format_for_file(file_name):
+    return EXTENSION_FORMATS.get(os.path.splitext(file_name)[1].lower(), "JPEG")
+
+
+def save_with_metadata(img, file_name, exif_bytes):
+    # Re-encodes in the format matching the file extension
+    image_format = format_for_file(file_name)
+    if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    # Replaced atomically, other threads may be reading the file (e.g. the duplicate check)
+    temp_name = f"{file_name}.tmp"
+    img.save(temp_name, image_format, exif=exif_bytes, **DEFAULT_SAVE_OPTIONS[image_format])
+    os.replace(temp_name, file_name)
+
+
+def _insert_png_exif(file_name, exif_bytes):
+    with open(file_name, "rb") as f:
+        data = f.read()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError(f"Not a PNG file: {file_name}")
+
+    # Walk the chunks, dropping any existing eXIf and adding ours right after IHDR (it must precede IDAT)
+    payload = exif_bytes[6:] if exif_bytes.startswith(b"Exif\x00\x00") else exif_bytes
+    exif_chunk = struct.pack(">I", len(payload)) + b"eXIf" + payload + \
+        struct.pack(">I", zlib.crc32(b"eXIf" + payload) & 0xffffffff)
+    chunks = [PNG_SIGNATURE]
+    position = len(PNG_SIGNATURE)
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        end = position + 12 + length
+        if chunk_type != b"eXIf":
+            chunks.append(data[position:end])
+        if chunk_type == b"IHDR":
+            chunks.append(exif_chunk)
+        position = end
+
+    temp_name = f"{file_name}.tmp"
+    with open(temp_name, "wb") as f:
+        f.write(b"".join(chunks))
+    os.replace(temp_name, file_name)
+
+
+def insert_metadata(file_name, exif_bytes):
+    # Adds EXIF to the file as is, without decoding or re-encoding the image data
+    if detect_format(file_name) == "PNG":
+        _insert_png_exif(file_name, exif_bytes)
+    else:
+        piexif.insert(exif_bytes, file_name)
+
+
+def store_image(file_name, exif_bytes, encoding="native"):
+    # Returns the final file name, whose extension may change with the encoding
+    if STORAGE_ENCODINGS.get(encoding) is None:
+        try:
+            insert_metadata(file_name, exif_bytes)
+            return file_name
+        except Exception as e:
+            # Formats piexif can't insert into (e.g. GIF) are stored as JPEG instead
+            print(f"Error inserting metadata into {file_name}, re-encoding: {str(e)}")
+            image_format, options = "JPEG", DEFAULT_SAVE_OPTIONS["JPEG"]
+    else:
+        image_format, options = STORAGE_ENCODINGS[encoding]
+
+    new_file_name = os.path.splitext(file_name)[0] + FORMAT_EXTENSIONS[image_format]
+    with Image.open(file_name) as img:
+        img = img.convert("RGB") if image_format == "JPEG" and img.mode not in ("RGB", "L") else img.copy()
+    # Written next to the destination and moved into place, so the original stays intact until the new file is
+    # complete, even when the extension doesn't change and it is overwritten
+    temp_name = f"{new_file_name}.tmp"
+    try:
+        img.save(temp_name, image_format, exif=exif_bytes, **options)
+    except Exception:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    os.replace(temp_name, new_file_name)
+    if new_file_name != file_name:
+        os.remove(file_name)
+    return new_file_name
+
+
+def match_extension(file_name):
+    # Renames the file if its extension doesn't match the format it actually contains
+    extension = FORMAT_EXTENSIONS.get(detect_format(file_name))
+    if not extension or format_for_file(file_name) == EXTENSION_FORMATS[extension]:
+        return file_name
+    new_file_name = os.path.splitext(file_name)[0] + extension
+    os.replace(file_name, new_file_name)
+    return new_file_name
+
+
+def extension_for_url(url, default=".jpg"):
+    extension = os.path.splitext(str(url).split("?")[0])[1].lower()
+    return extension if extension in EXTENSION_FORMATS else default
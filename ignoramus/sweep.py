@@ -0,0 +1,86 @@
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ignoramus.image_generator import generate_image, process_generated_images, unique_timestamp
+
+# Parameters that can be swept, and the type their values are parsed into
+SWEEPABLE_PARAMETERS = {
+    "seed": int,
+    "aspect_ratio": str,
+    "guidance": float,
+    "num_inference_steps": int,
+    "steps": int,
+    "interval": float,
+    "prompt_strength": float,
+    "safety_tolerance": int,
+    "output_quality": int,
+}
+
+DEFAULT_SWEEP_CONCURRENCY = 4
+
+
+def parse_sweep_values(text, cast=str):
+    # Accepts either a comma separated list ("1, 2, 3") or an inclusive range ("start:stop:step")
+    text = text.strip()
+    if not text:
+        return []
+    if ":" in text and cast is not str:
+        parts = [part.strip() for part in text.split(":")]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid range: {text}")
+        start, stop = cast(parts[0]), cast(parts[1])
+        step = cast(parts[2]) if len(parts) == 3 else cast(1)
+        if step <= 0:
+            raise ValueError(f"Range step must be positive: {text}")
+        count = int(round((stop - start) / step, 9)) + 1
+        # Round to avoid float drift such as 2.3000000000000003
+        return [cast(round(start + i * step, 9)) for i in range(max(count, 0))]
+    return [cast(value.strip()) for value in text.split(",") if value.strip()]
+
+
+def expand_grid(base_properties, axes):
+    names = list(axes)
+    for combination in itertools.product(*(axes[name] for name in names)):
+        coords = dict(zip(names, combination))
+        properties = dict(base_properties)
+        properties.update(coords)
+        yield coords, properties
+
+
+def count_cells(axes):
+    count = 1
+    for values in axes.values():
+        count *= len(values)
+    return count
+
+
+def _run_cell(model, properties, sweep_id, index, coords, job_callback):
+    # Cells start concurrently, so the timestamp alone is not a unique file name
+    file_stem = f"{unique_timestamp()}_sweep_{sweep_id}_{index:03d}"
+    sweep_metadata = {"sweep_id": sweep_id, "sweep_index": index, "sweep_coords": coords}
+    output, file_stem, results_dir = generate_image(model, properties, job_callback, file_stem, sweep_metadata)
+    return process_generated_images(output, file_stem, results_dir, properties, model, sweep_metadata)
+
+
+def run_sweep(model, base_properties, axes, max_workers=DEFAULT_SWEEP_CONCURRENCY, on_cell_done=None,
+              job_callback=None):
+    sweep_id = uuid.uuid4().hex[:8]
+    cells = list(expand_grid(base_properties, axes))
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=f"sweep-{sweep_id}") as pool:
+        futures = {
+            pool.submit(_run_cell, model, properties, sweep_id, index, coords, job_callback): (index, coords)
+            for index, (coords, properties) in enumerate(cells)
+        }
+        for future in as_completed(futures):
+            index, coords = futures[future]
+            try:
+                result = {"index": index, "coords": coords, "images": future.result(), "error": None}
+            except Exception as e:
+                result = {"index": index, "coords": coords, "images": [], "error": str(e)}
+            results.append(result)
+            if on_cell_done:
+                on_cell_done(result, len(results), len(cells))
+    results.sort(key=lambda r: r["index"])
+    return sweep_id, results
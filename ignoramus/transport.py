@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Number of hosts with a kept-alive pool, and connections kept per host
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 16
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# Requests in flight to one host at a time; replicate.delivery serves every output, so this bounds download fan-out
+PER_HOST_CONCURRENCY = 8
+
+
+class HTTPTransport:
+    # One keep-alive session for every plain HTTP call (CDN downloads, GitHub), so repeated requests to the same host
+    # reuse their TCP/TLS connections. Replicate API calls go through the replicate client's own httpx pool.
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, per_host_concurrency=PER_HOST_CONCURRENCY):
+        self.timeout = (connect_timeout, read_timeout)
+        self.per_host_concurrency = per_host_concurrency
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return self.host_limits[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self._host_limit(url):
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        # Holds the host's slot until the body has been read, since that is when the connection is busy
+        kwargs.setdefault("timeout", self.timeout)
+        with self._host_limit(url):
+            response = self.session.request(method, url, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def stats(self):
+        # urllib3 counts new connections and requests per host pool; the difference is how often keep-alive paid off
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            if (pool := pools.get(key)) is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            stats[host] = {
+                "requests": pool.num_requests,
+                "connections": pool.num_connections,
+                "reused": max(0, pool.num_requests - pool.num_connections),
+            }
+        return stats
+
+
+transport = HTTPTransport()
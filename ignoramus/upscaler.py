@@ -1,16 +1,23 @@
-import base64
+from ignoramus.downloads import downloaded
+from ignoramus.local_upscaler import upscale_image_locally
+from ignoramus.predictions import run_model
+from ignoramus.preprocess import prepare_image
 
-import replicate
-import requests
+# "remote" runs CodeFormer on Replicate, "local" is a fast offline Lanczos + sharpen upscale on the CPU
+UPSCALE_ENGINES = ["remote", "local"]
 
 
-def upscale_image(image_path):
-    try:
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+def upscale_image(image_path, engine="remote"):
+    if engine == "local":
+        try:
+            return upscale_image_locally(image_path)
+        except Exception as e:
+            print(f"Error during local upscaling: {str(e)}")
+            return None
 
+    try:
         input_data = {
-            "image": f"data:image/png;base64,{encoded_string}",
+            "image": prepare_image(image_path, "upscale"),
             "upscale": 2,
             "face_upsample": False,
             "background_enhance": False,
@@ -18,15 +25,16 @@ def upscale_image(image_path):
         }
 
         if not (
-            output := replicate.run(
+            output := run_model(
                 "sczhou/codeformer:7de2ea26c616d5bf2245ad0d5e24f0ff9a6204578a5c876db53142edd9d2cd56",
                 input=input_data,
             )
         ):
             return None
 
-        response = requests.get(output)
-        return response.content if response.status_code == 200 else None
+        with downloaded(output) as path:
+            with open(path, "rb") as f:
+                return f.read()
     except Exception as e:
         print(f"Error during upscaling: {str(e)}")
         return None
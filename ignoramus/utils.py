@@ -1,3 +1,4 @@
+import io
 import json
 import os
 import platform
@@ -42,14 +43,41 @@ def focus_previous_widget(event):
 
 def read_image_metadata(file_path):
     try:
-        exif_dict = piexif.load(file_path)
+        # Read the EXIF block through Pillow so PNG (eXIf chunk) works as well as JPEG and WebP
+        with Image.open(file_path) as img:
+            exif_data = img.info.get("exif")
+        if not exif_data:
+            raise KeyError("exif")
+        exif_dict = piexif.load(exif_data)
         user_comment = exif_dict["Exif"][piexif.ExifIFD.UserComment]
         metadata = piexif.helper.UserComment.load(user_comment)
         return json.loads(metadata)
-    except (KeyError, json.JSONDecodeError, ValueError):
+    except (KeyError, json.JSONDecodeError, ValueError, OSError):
         return {"comment": "Image imported from outside of IGNORAMUS."}
 
 
+def read_exif_thumbnail(file_path):
+    # Image.open only parses the header, so this reads a few KB instead of decoding the whole image
+    try:
+        with Image.open(file_path) as img:
+            exif_data = img.info.get("exif")
+        if not exif_data:
+            return None
+        thumbnail = piexif.load(exif_data).get("thumbnail")
+        return Image.open(io.BytesIO(thumbnail)) if thumbnail else None
+    except Exception:
+        return None
+
+
+def load_thumbnail(file_path, size):
+    # Decoded thumbnail for a worker thread: the one embedded in the EXIF header, falling back to decoding the image
+    # (JPEGs at reduced size). Only the PhotoImage has to be made on the Tk thread.
+    with read_exif_thumbnail(file_path) or Image.open(file_path) as img:
+        img.draft("RGB", (size, size))
+        img.thumbnail((size, size))
+        return img.copy()
+
+
 def open_file_location(file_path):
     dir_path = os.path.dirname(os.path.abspath(file_path))
     if platform.system() == "Windows":
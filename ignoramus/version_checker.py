@@ -6,6 +6,8 @@ import tomllib as toml
 import requests
 from packaging import version
 
+from ignoramus.transport import transport
+
 
 def get_pyproject_data():
     try:
@@ -64,7 +66,7 @@ def check_latest_version(current_version):
 # TODO Rename this here and in `check_latest_version`
 def _extracted_from_check_latest_version_21(tags_url, headers, current_version):
     # Fetch the tags from GitHub
-    response = requests.get(tags_url, headers=headers)
+    response = transport.get(tags_url, headers=headers)
     response.raise_for_status()  # Raise an exception for HTTP errors
     tags = response.json()
 
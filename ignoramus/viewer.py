@@ -0,0 +1,463 @@
+import json
+import math
+import os
+import threading
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import ttk
+
+from PIL import Image, ImageTk
+
+from ignoramus.face_swapper import add_face_swap_button
+from ignoramus.image_cache import LRUCache, image_nbytes
+from ignoramus.image_generator import get_output_directory
+from ignoramus.utils import read_image_metadata, copy_image_to_clipboard, open_file_location
+
+TILE_SIZE = 512
+# Decoded tiles of every open viewer share this budget, so many huge images open at once can't exhaust RAM
+VIEWER_MEMORY_BUDGET = 256 * 1024 * 1024
+ZOOM_STEP = 1.25
+MAX_SCALE = 8.0
+
+# At most this many images are being decoded at once, across viewers and prefetching. Finished decodes are kept in
+# the tile cache, within its budget.
+DECODE_CONCURRENCY = 2
+
+tile_cache = LRUCache(VIEWER_MEMORY_BUDGET)
+decode_slots = threading.BoundedSemaphore(DECODE_CONCURRENCY)
+prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="viewer-prefetch")
+decode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="viewer-decode")
+
+
+class TiledImage:
+    # An image pyramid where level n is reduced by 2**n; only the tiles around the viewport are kept decoded
+    def __init__(self, path, cache=tile_cache):
+        self.path = path
+        self.cache = cache
+        self.mtime = os.path.getmtime(path)
+        with Image.open(path) as img:
+            self.size = img.size
+            self.format = img.format
+            self.mode = "RGBA" if img.mode in ("RGBA", "LA") or "transparency" in img.info else "RGB"
+        self.max_level = 0
+        while max(self.size) >> self.max_level > TILE_SIZE:
+            self.max_level += 1
+
+    def level_size(self, level):
+        factor = 2 ** level
+        return max(1, -(-self.size[0] // factor)), max(1, -(-self.size[1] // factor))
+
+    def level_for_scale(self, scale):
+        # Coarsest level that still has at least one source pixel per screen pixel
+        if scale >= 1:
+            return 0
+        return min(self.max_level, int(math.floor(math.log2(1 / scale))))
+
+    def source(self, level):
+        # The decoded image the regions of a level are cut from. JPEGs decode straight at 1/2, 1/4 or 1/8 scale;
+        # PNGs, and JPEGs at full size, can only be decoded whole, so every level of those shares one full decode.
+        # It is kept in the tile cache and counted against its budget, so panning and zooming cut regions from
+        # it instead of decoding the file again.
+        source_level = level if self.format == "JPEG" else 0
+        key = (self.path, self.mtime, "source", source_level)
+        if (img := self.cache.get(key)) is not None:
+            return img
+        with decode_slots:
+            with Image.open(self.path) as img:
+                if source_level:
+                    img.draft(self.mode, self.level_size(source_level))
+                img.load()
+            if img.mode != self.mode:
+                img = img.convert(self.mode)
+        # An image too large for the whole budget can't be kept; it is decoded again for the next region
+        self.cache.put(key, img, image_nbytes(img))
+        return img
+
+    def decode_region(self, level, box):
+        # Cuts box (in level coordinates) out of the level's source and scales it to the level
+        img = self.source(level)
+        factor = 2 ** level
+        full_box = (box[0] * factor, box[1] * factor,
+                    min(self.size[0], box[2] * factor), min(self.size[1], box[3] * factor))
+        ratio_x, ratio_y = img.size[0] / self.size[0], img.size[1] / self.size[1]
+        source = (full_box[0] * ratio_x, full_box[1] * ratio_y, full_box[2] * ratio_x, full_box[3] * ratio_y)
+        crop_box = (math.floor(source[0]), math.floor(source[1]),
+                    min(img.size[0], math.ceil(source[2])), min(img.size[1], math.ceil(source[3])))
+        region = img.crop(crop_box)
+        target = (box[2] - box[0], box[3] - box[1])
+        relative = (source[0] - crop_box[0], source[1] - crop_box[1], source[2] - crop_box[0],
+                    source[3] - crop_box[1])
+        if region.size != target or relative != (0, 0) + region.size:
+            region = region.resize(target, Image.LANCZOS, box=relative, reducing_gap=2.0)
+        return region
+
+    def _key(self, level, tx, ty):
+        return self.path, self.mtime, level, tx, ty
+
+    def _tile_box(self, level, tx, ty):
+        width, height = self.level_size(level)
+        return (tx * TILE_SIZE, ty * TILE_SIZE,
+                min(width, (tx + 1) * TILE_SIZE), min(height, (ty + 1) * TILE_SIZE))
+
+    def decode_tiles(self, level, coords):
+        # Decodes the missing tiles of coords plus a ring around them for panning, into the cache. Runs on a worker
+        # thread, never on the Tk thread.
+        missing = [c for c in coords if self._key(level, *c) not in self.cache]
+        if not missing:
+            return
+        columns, rows = (-(-size // TILE_SIZE) for size in self.level_size(level))
+        ring = {(tx + dx, ty + dy) for tx, ty in missing for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                if 0 <= tx + dx < columns and 0 <= ty + dy < rows} - set(missing)
+        ring = {c for c in ring if self._key(level, *c) not in self.cache}
+        wanted = set(missing) | ring
+        left, top = min(tx for tx, _ in wanted), min(ty for _, ty in wanted)
+        right, bottom = max(tx for tx, _ in wanted), max(ty for _, ty in wanted)
+        region_box = self._tile_box(level, left, top)[:2] + self._tile_box(level, right, bottom)[2:]
+        region = self.decode_region(level, region_box)
+
+        def cut(c):
+            box = self._tile_box(level, *c)
+            return region.crop((box[0] - region_box[0], box[1] - region_box[1],
+                                box[2] - region_box[0], box[3] - region_box[1]))
+
+        for c in missing:
+            tile = cut(c)
+            self.cache.put(self._key(level, *c), tile, image_nbytes(tile))
+        for c in ring:
+            tile = cut(c)
+            if not self.cache.has_room(image_nbytes(tile)):
+                break
+            self.cache.put(self._key(level, *c), tile, image_nbytes(tile))
+
+    def placeholder(self, level, tx, ty):
+        # A cached tile of a coarser level scaled up, shown until the tile itself is decoded
+        box = self._tile_box(level, tx, ty)
+        for coarser in range(level + 1, self.max_level + 1):
+            factor = 2 ** (coarser - level)
+            ctx, cty = box[0] // factor // TILE_SIZE, box[1] // factor // TILE_SIZE
+            tile = self.cache.get(self._key(coarser, ctx, cty))
+            if tile is None:
+                continue
+            source = (box[0] / factor - ctx * TILE_SIZE, box[1] / factor - cty * TILE_SIZE,
+                      min(tile.size[0], box[2] / factor - ctx * TILE_SIZE),
+                      min(tile.size[1], box[3] / factor - cty * TILE_SIZE))
+            return tile.resize((box[2] - box[0], box[3] - box[1]), Image.BILINEAR, box=source)
+        return None
+
+    def render(self, level, box):
+        # Composites the cached tiles covering box (in level coordinates) into a single image, with coarser
+        # placeholders for tiles that aren't decoded yet. Returns the image and the coordinates still missing.
+        left, top, right, bottom = box
+        coords = [(tx, ty)
+                  for ty in range(top // TILE_SIZE, (bottom - 1) // TILE_SIZE + 1)
+                  for tx in range(left // TILE_SIZE, (right - 1) // TILE_SIZE + 1)]
+        region = Image.new(self.mode, (right - left, bottom - top))
+        missing = []
+        for tx, ty in coords:
+            tile = self.cache.get(self._key(level, tx, ty))
+            if tile is None:
+                missing.append((tx, ty))
+                tile = self.placeholder(level, tx, ty)
+            if tile is not None:
+                region.paste(tile, (tx * TILE_SIZE - left, ty * TILE_SIZE - top))
+        return region, missing
+
+
+def prefetch(path, canvas_size):
+    # Decodes the tiles a viewer of the given size needs to show the image fitted, into the shared cache
+    try:
+        image = TiledImage(path)
+        scale = min(canvas_size[0] / image.size[0], canvas_size[1] / image.size[1])
+        level = image.level_for_scale(scale)
+        columns, rows = (-(-size // TILE_SIZE) for size in image.level_size(level))
+        image.decode_tiles(level, [(tx, ty) for ty in range(rows) for tx in range(columns)])
+    except Exception as e:
+        print(f"Error prefetching {path}: {str(e)}")
+
+
+class ImageViewer:
+    def __init__(self, gui, img_path):
+        self.gui = gui
+        self.img_path = None
+        self.image = None
+        self.scale = None  # None means fit to window
+        self.center = (0, 0)
+        self.prefetched = set()
+        self.drag_start = None
+        self.dragged = False
+        self.render_timer = None
+        self.render_delay = 200  # milliseconds
+        self.decoding = False
+
+        # Open the image in a new window
+        self.top = tk.Toplevel(gui.master)
+        self.top.title("Full Size Image")
+
+        # Create a main frame to hold everything
+        main_frame = ttk.Frame(self.top)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        # Create a frame for previous/next navigation
+        nav_frame = ttk.Frame(main_frame)
+        nav_frame.pack(fill=tk.X, expand=False, side=tk.BOTTOM)
+        ttk.Button(nav_frame, text="◀ Previous", command=self.show_previous).pack(side=tk.LEFT, padx=5, pady=5)
+        ttk.Button(nav_frame, text="Next ▶", command=self.show_next).pack(side=tk.RIGHT, padx=5, pady=5)
+        self.position_label = ttk.Label(nav_frame, text="", anchor=tk.CENTER)
+        self.position_label.pack(fill=tk.X, expand=True, pady=5)
+
+        # Create a frame to hold the text widget and buttons
+        self.control_frame = ttk.Frame(main_frame)
+        self.control_frame.pack(fill=tk.X, expand=False, side=tk.BOTTOM)
+
+        # Create a canvas to hold the image
+        self.canvas = tk.Canvas(main_frame)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+        # Re-render when the window is resized
+        self.canvas.bind("<Configure>", self.schedule_render)
+
+        # Zoom with the mouse wheel, pan by dragging, close with a click that isn't a drag
+        self.canvas.bind("<MouseWheel>", self.on_mousewheel)
+        self.canvas.bind("<Button-4>", self.on_mousewheel)
+        self.canvas.bind("<Button-5>", self.on_mousewheel)
+        self.canvas.bind("<ButtonPress-1>", self.start_pan)
+        self.canvas.bind("<B1-Motion>", self.pan)
+        self.canvas.bind("<ButtonRelease-1>", self.end_pan)
+        self.top.bind("<Key-0>", lambda e: self.set_scale(None))
+        self.top.bind("<Key-1>", lambda e: self.set_scale(1.0))
+        self.top.bind("<plus>", lambda e: self.zoom(ZOOM_STEP))
+        self.top.bind("<minus>", lambda e: self.zoom(1 / ZOOM_STEP))
+        self.top.bind("<Left>", lambda e: self.show_previous())
+        self.top.bind("<Right>", lambda e: self.show_next())
+
+        self.show_image(img_path)
+        self.top.update_idletasks()  # Ensure the window size is updated
+
+    def show_image(self, img_path):
+        # Each viewer keeps its own image state; the decoded tiles come from the shared cache
+        self.img_path = img_path
+        self.image = TiledImage(img_path)
+        self.scale = None
+        self.center = (self.image.size[0] / 2, self.image.size[1] / 2)
+        self.top.title(f"Full Size Image - {os.path.basename(img_path)}")
+
+        for widget in self.control_frame.winfo_children():
+            widget.destroy()
+        self.create_controls()
+
+        paths = self.gallery_paths()
+        if img_path in paths:
+            self.position_label.config(text=f"{paths.index(img_path) + 1} / {len(paths)}")
+        else:
+            self.position_label.config(text="")
+
+        self.top.after(100, self.render)
+        self.top.after(100, self.prefetch_neighbours)
+
+    def gallery_paths(self):
+        return self.gui.gallery_image_paths
+
+    def neighbour(self, offset):
+        paths = self.gallery_paths()
+        if self.img_path not in paths:
+            return None
+        return paths[(paths.index(self.img_path) + offset) % len(paths)]
+
+    def show_next(self):
+        if path := self.neighbour(1):
+            self.show_image(path)
+
+    def show_previous(self):
+        if path := self.neighbour(-1):
+            self.show_image(path)
+
+    def prefetch_neighbours(self):
+        canvas_size = (max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height()))
+        for offset in (1, -1, 2, -2):
+            path = self.neighbour(offset)
+            if path and (path, canvas_size) not in self.prefetched:
+                self.prefetched.add((path, canvas_size))
+                prefetch_pool.submit(prefetch, path, canvas_size)
+
+    def create_controls(self):
+        img_path = self.img_path
+
+        # Read metadata from EXIF
+        metadata = read_image_metadata(img_path)
+        if not metadata:
+            return
+
+        # Create a text widget to display metadata
+        text_widget = tk.Text(self.control_frame, height=10, wrap=tk.WORD)
+        text_widget.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        text_widget.insert(tk.END, json.dumps(metadata, indent=2))
+        text_widget.config(state=tk.DISABLED)  # Make it read-only
+
+        # Create a frame for buttons
+        button_frame = ttk.Frame(self.control_frame)
+        button_frame.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Create a button to set widgets according to EXIF data
+        set_widgets_button = ttk.Button(button_frame, text="🔧 Set Widgets",
+                                        command=lambda: self.gui.set_widgets_and_close(metadata, self.top))
+        set_widgets_button.pack(side=tk.TOP, padx=5, pady=5)
+
+        # Create an Upscale button
+        upscale_button = ttk.Button(button_frame, text="🔍 Upscale",
+                                    command=lambda: self.gui.upscale_image(img_path, metadata, self.top))
+        upscale_button.pack(side=tk.TOP, padx=5, pady=5)
+
+        # Create a Face Swap button
+        add_face_swap_button(button_frame, img_path, get_output_directory(), self.gui.post_gallery_reload)
+
+        # Create a button to find visually similar images
+        similar_button = ttk.Button(button_frame, text="🔎 Similar",
+                                    command=lambda: self.gui.show_similar_images(img_path))
+        similar_button.pack(side=tk.TOP, padx=5, pady=5)
+
+        # Create a button to copy the image to clipboard
+        copy_button = ttk.Button(button_frame, text="📋 Clipboard",
+                                 command=lambda: copy_image_to_clipboard(img_path))
+        copy_button.pack(side=tk.TOP, padx=2, pady=2)
+
+        # Create a button to open image location
+        open_location_button = ttk.Button(button_frame, text="📂 Open", style="Blue.TButton",
+                                          command=lambda: open_file_location(img_path))
+        open_location_button.pack(side=tk.TOP, padx=5, pady=5)
+
+        # Create a Delete button
+        style = ttk.Style()
+        style.configure("Red.TButton", foreground="#FF7C8B")
+        style.configure("Blue.TButton", foreground="lightblue")
+
+        delete_button = ttk.Button(button_frame, text="🗑️ Delete", style="Red.TButton",
+                                   command=lambda: self.gui.delete_image(img_path, self.top))
+        delete_button.pack(side=tk.TOP, padx=5, pady=5)
+
+    def fit_scale(self):
+        width, height = self.image.size
+        return min(self.canvas.winfo_width() / width, self.canvas.winfo_height() / height)
+
+    def current_scale(self):
+        return self.fit_scale() if self.scale is None else self.scale
+
+    def set_scale(self, scale):
+        self.scale = scale
+        if scale is None:
+            self.center = (self.image.size[0] / 2, self.image.size[1] / 2)
+        self.render()
+
+    def zoom(self, factor, x=None, y=None):
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        x = canvas_width / 2 if x is None else x
+        y = canvas_height / 2 if y is None else y
+        old_scale = self.current_scale()
+        new_scale = min(MAX_SCALE, max(self.fit_scale(), old_scale * factor))
+        # Keep the image point under the cursor in place
+        cx, cy = self.center
+        px = cx + (x - canvas_width / 2) / old_scale
+        py = cy + (y - canvas_height / 2) / old_scale
+        self.center = (px - (x - canvas_width / 2) / new_scale, py - (y - canvas_height / 2) / new_scale)
+        self.scale = None if new_scale <= self.fit_scale() else new_scale
+        self.render()
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.zoom(ZOOM_STEP, event.x, event.y)
+        elif event.num == 5 or event.delta < 0:
+            self.zoom(1 / ZOOM_STEP, event.x, event.y)
+
+    def start_pan(self, event):
+        self.drag_start = (event.x, event.y, self.center)
+        self.dragged = False
+
+    def pan(self, event):
+        if self.drag_start is None:
+            return
+        x, y, (cx, cy) = self.drag_start
+        if abs(event.x - x) + abs(event.y - y) > 3:
+            self.dragged = True
+        scale = self.current_scale()
+        self.center = (cx - (event.x - x) / scale, cy - (event.y - y) / scale)
+        self.render()
+
+    def end_pan(self, event):
+        self.drag_start = None
+        if not self.dragged:
+            self.top.destroy()
+
+    def schedule_render(self, event=None):
+        if self.render_timer is not None:
+            self.top.after_cancel(self.render_timer)
+        self.render_timer = self.top.after(self.render_delay, self.render)
+
+    def clamp_center(self, scale, canvas_width, canvas_height):
+        width, height = self.image.size
+        half_width, half_height = canvas_width / 2 / scale, canvas_height / 2 / scale
+        cx, cy = self.center
+        cx = width / 2 if width <= 2 * half_width else min(max(cx, half_width), width - half_width)
+        cy = height / 2 if height <= 2 * half_height else min(max(cy, half_height), height - half_height)
+        self.center = (cx, cy)
+
+    def render(self):
+        self.render_timer = None
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+
+        # Skip rendering if the window is too small
+        if canvas_width <= 1 or canvas_height <= 1:
+            return
+
+        scale = self.current_scale()
+        self.clamp_center(scale, canvas_width, canvas_height)
+        cx, cy = self.center
+        width, height = self.image.size
+
+        # Visible part of the image in full resolution coordinates
+        left = max(0.0, cx - canvas_width / 2 / scale)
+        top = max(0.0, cy - canvas_height / 2 / scale)
+        right = min(width, cx + canvas_width / 2 / scale)
+        bottom = min(height, cy + canvas_height / 2 / scale)
+
+        # Same region in the coordinates of the pyramid level closest to the display scale
+        level = self.image.level_for_scale(scale)
+        factor = 2 ** level
+        level_width, level_height = self.image.level_size(level)
+        box = (int(left // factor), int(top // factor),
+               min(level_width, math.ceil(right / factor)), min(level_height, math.ceil(bottom / factor)))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return
+
+        region, missing = self.image.render(level, box)
+        if missing:
+            self.request_tiles(self.image, level, missing)
+        display_size = (max(1, round((box[2] - box[0]) * factor * scale)),
+                        max(1, round((box[3] - box[1]) * factor * scale)))
+        resample = Image.LANCZOS if display_size[0] < region.size[0] else Image.BILINEAR
+        photo = ImageTk.PhotoImage(region.resize(display_size, resample))
+
+        # Update the canvas
+        self.canvas.delete("all")
+        self.canvas.create_image(canvas_width / 2 + (box[0] * factor - cx) * scale,
+                                 canvas_height / 2 + (box[1] * factor - cy) * scale,
+                                 anchor=tk.NW, image=photo)
+        self.canvas.image = photo  # Keep a reference
+
+    def request_tiles(self, image, level, coords):
+        # One decode per viewer at a time; when it is done the viewer renders again and asks for whatever the
+        # viewport then still lacks, so a fast pan doesn't queue up decodes for places already left behind
+        if self.decoding:
+            return
+        self.decoding = True
+        decode_pool.submit(self._decode_tiles, image, level, coords)
+
+    def _decode_tiles(self, image, level, coords):
+        try:
+            image.decode_tiles(level, coords)
+        except Exception as e:
+            print(f"Error decoding {image.path}: {str(e)}")
+        self.gui.events.post(self.tiles_decoded)
+
+    def tiles_decoded(self):
+        self.decoding = False
+        if self.top.winfo_exists():
+            self.render()
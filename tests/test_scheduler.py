@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+import httpx
+
+from ignoramus import scheduler as scheduler_module
+from ignoramus.predictions import build_client
+from ignoramus.scheduler import AdaptiveScheduler
+
+PREDICTION = {"id": "p1", "model": "black-forest-labs/flux-schnell", "version": "v1", "status": "starting",
+              "input": {}, "output": None, "logs": "", "error": None, "urls": {}}
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_retry_after_from_replicate_response_is_respected(self):
+        responses = [httpx.Response(429, headers={"Retry-After": "3"}, json={"detail": "Request was throttled."}),
+                     httpx.Response(201, json=PREDICTION)]
+        client = build_client(api_token="test", base_url="https://replicate.test",
+                              transport=httpx.MockTransport(lambda request: responses.pop(0)))
+        scheduler = AdaptiveScheduler(rate=100, burst=100)
+        with mock.patch.object(scheduler_module.time, "sleep") as sleep, \
+                mock.patch.object(scheduler.bucket, "block_for") as block_for:
+            prediction = scheduler.retry(client.models.predictions.create, model="black-forest-labs/flux-schnell",
+                                         input={})
+        self.assertEqual(prediction.id, "p1")
+        sleep.assert_called_once_with(3.0)
+        block_for.assert_called_once_with(3.0)
+
+    def test_stale_headers_are_not_reused(self):
+        # A 503 without Retry-After after a throttled call backs off with jitter instead of reusing the old header
+        responses = [httpx.Response(429, headers={"Retry-After": "3"}, json={}),
+                     httpx.Response(503, json={}),
+                     httpx.Response(201, json=PREDICTION)]
+        client = build_client(api_token="test", base_url="https://replicate.test",
+                              transport=httpx.MockTransport(lambda request: responses.pop(0)))
+        scheduler = AdaptiveScheduler(rate=100, burst=100, base_delay=0.5)
+        with mock.patch.object(scheduler_module.time, "sleep") as sleep, \
+                mock.patch.object(scheduler.bucket, "block_for"):
+            scheduler.retry(client.models.predictions.create, model="black-forest-labs/flux-schnell", input={})
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(delays[0], 3.0)
+        self.assertLess(delays[1], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()